@@ -0,0 +1,354 @@
+#!env/bin/python
+"""Throughput benchmarks of the DeNovoFilter pipeline on a synthetic trio
+
+Each stage runs in a fresh Python process, so that its peak RSS is measured in isolation.
+"""
+
+from __future__ import division
+from collections import OrderedDict
+from optparse import OptionParser, Values
+import gc
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from main import alleles, fileio, gnomad, gnomad_index, helper, parsers, toplevel, variantkeys
+import synthetic
+
+
+def stage_parse_child_vcf(files, config):
+
+    def run():
+        return len(parsers.read_vcf_file(files['child_var']))
+
+    return run
+
+
+def stage_parse_parent_vcfs(files, config):
+
+    def run():
+        return len(variantkeys.load(files['mother_var'])) + len(variantkeys.load(files['father_var']))
+
+    return run
+
+
+def stage_gnomad(files, config):
+
+    queries = _gnomad_queries(files)
+    readers = _gnomad_readers(config)
+
+    def run():
+        for reader in readers:
+            for (var_key, csn_key) in queries:
+                reader.get_max_frequency(var_key, csn_key)
+        return len(queries)
+
+    return run
+
+
+def stage_gnomad_batch(files, config):
+
+    queries = _gnomad_queries(files)
+    readers = _gnomad_readers(config)
+
+    def run():
+        for reader in readers:
+            reader.get_max_frequencies(queries)
+        return len(queries)
+
+    return run
+
+
+def stage_gnomad_index(files, config):
+
+    queries = _gnomad_queries(files)
+
+    # Building the indexes is a one-off step and not part of the measured lookups
+    index_fns = []
+    for reader in _gnomad_readers(config):
+        fn = config['GNOMAD_EXOMES_DATA_FILE'] if reader.exomes else config['GNOMAD_GENOMES_DATA_FILE']
+        index_fns.append(gnomad_index.index_fn(fn, reader.exomes))
+        gnomad_index.build(reader, index_fns[-1])
+    readers = _gnomad_readers(config, use_index=True)
+
+    # The readers keep their index open. The files are removed so that the other stages read the data files themselves
+    for fn in index_fns:
+        os.remove(fn)
+
+    def run():
+        for reader in readers:
+            for (var_key, csn_key) in queries:
+                reader.get_max_frequency(var_key, csn_key)
+        return len(queries)
+
+    return run
+
+
+def stage_gnomad_records(files, config):
+
+    readers = _gnomad_readers(config)
+
+    # Records of all gnomAD lines are retained after reading the keys matched in every lookup
+    def run():
+        records = []
+        for reader in readers:
+            for key in reader.file_fns:
+                tabix_file = reader._open(key)
+                for chrom in tabix_file.contigs:
+                    for line in tabix_file.fetch(chrom):
+                        n_alts, flags = reader._parse_line(line)
+                        if 'GENE' in flags and 'CSN' in flags:
+                            records.append((n_alts, flags))
+        return len(records), records
+
+    return run
+
+
+def stage_bam_counting(files, config, engine='aligned_pairs'):
+
+    var_keys = parsers.read_vcf_file(files['child_var']).keys()
+    counter = alleles.AlleleCounter(files['mother_bam'])
+
+    def run():
+        for var_key in var_keys:
+            alleles.count(counter.samfile, var_key, engine)
+        return len(var_keys)
+
+    return run
+
+
+def stage_bam_counting_cigar(files, config):
+
+    return stage_bam_counting(files, config, 'cigar')
+
+
+def stage_bam_counting_batch(files, config, engine='aligned_pairs'):
+
+    var_keys = parsers.read_vcf_file(files['child_var']).keys()
+    counter = alleles.AlleleCounter(files['mother_bam'])
+
+    def run():
+        return len(alleles.count_batch(counter.samfile, var_keys, engine))
+
+    return run
+
+
+def stage_bam_counting_batch_cigar(files, config):
+
+    return stage_bam_counting_batch(files, config, 'cigar')
+
+
+def stage_output(files, config):
+
+    rows = [(var_key, variant) for var_key, variants in parsers.read_vcf_file(files['child_var']).iteritems() for variant in variants]
+    result = {
+        'filter': 'low_quality,high_mother_tr (2)',
+        'control_freq': 0.2,
+        'gnomad_exomes_freq': 0.0123456,
+        'gnomad_genomes_freq': 0.0,
+        'pop_gnomad_exomes': 'NFE',
+        'pop_gnomad_genomes': '.',
+        'parent_alleles': {'mother_tc': 20, 'mother_tr': 2, 'father_tc': 18, 'father_tr': 0}
+    }
+
+    def run():
+        out = fileio.OutputWriter(os.devnull)
+        for (var_key, variant) in rows:
+            helper.output(out, var_key, variant, result, None, None, True)
+        out.close()
+        return len(rows)
+
+    return run
+
+
+def stage_pipeline(files, config):
+
+    outdir = tempfile.mkdtemp()
+    options = Values(dict(
+        files, full_details=True, output=os.path.join(outdir, 'bench'), processes=1, streaming=False, profile=False,
+        lazy_details=False, bgzip_output=False, output_format='tsv', trios=None
+    ))
+
+    def run():
+        toplevel.run(options)
+        with open(os.path.join(outdir, 'bench_denovo_candidates.txt')) as f1:
+            with open(os.path.join(outdir, 'bench_filtered_out.txt')) as f2:
+                return sum(1 for _ in f1) + sum(1 for _ in f2) - 2
+
+    return run
+
+
+STAGES = OrderedDict([
+    ('parse_child_vcf', stage_parse_child_vcf),
+    ('parse_parent_vcfs', stage_parse_parent_vcfs),
+    ('gnomad', stage_gnomad),
+    ('gnomad_batch', stage_gnomad_batch),
+    ('gnomad_index', stage_gnomad_index),
+    ('gnomad_records', stage_gnomad_records),
+    ('bam_counting', stage_bam_counting),
+    ('bam_counting_cigar', stage_bam_counting_cigar),
+    ('bam_counting_batch', stage_bam_counting_batch),
+    ('bam_counting_batch_cigar', stage_bam_counting_batch_cigar),
+    ('output', stage_output),
+    ('pipeline', stage_pipeline),
+])
+
+
+def _gnomad_queries(files):
+
+    child_var = parsers.read_vcf_file(files['child_var'])
+    return [(var_key, (v['gene'], v['csn'])) for var_key, variants in child_var.iteritems() for v in variants]
+
+
+def _gnomad_readers(config, use_index=False):
+
+    # Caches are disabled to measure the cost of the lookups themselves
+    return [
+        gnomad.GnomadDBReader(
+            config['GNOMAD_EXOMES_DATA_FILE'], result_cache_size=0, use_index=use_index
+        ),
+        gnomad.GnomadDBReader(
+            config['GNOMAD_GENOMES_DATA_FILE'], exomes=False, result_cache_size=0, use_index=use_index
+        )
+    ]
+
+
+def run_stage(name, files, result_fn):
+
+    # Progress messages of the pipeline are not part of the results
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+
+    config = parsers.read_config_file(files['config'])
+    run = STAGES[name](files, config)
+
+    usage_start = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.time()
+    items = run()
+    wall = time.time() - start
+    usage_end = resource.getrusage(resource.RUSAGE_SELF)
+
+    sys.stdout = stdout
+
+    # Stages may also return the objects they create, to count the allocations retained per item
+    retained = None
+    if isinstance(items, tuple):
+        items, retained = items
+
+    cpu = (usage_end.ru_utime - usage_start.ru_utime) + (usage_end.ru_stime - usage_start.ru_stime)
+    result = {
+        'items': items,
+        'wall_seconds': round(wall, 4),
+        'cpu_seconds': round(cpu, 4),
+        'items_per_second': round(items / wall, 1) if wall > 0 else None,
+        'peak_rss_mb': round(usage_end.ru_maxrss / 1024, 1)
+    }
+    if retained is not None and items > 0:
+        n_objects, n_bytes = count_objects(retained)
+        result['objects_per_item'] = round(n_objects / items, 1)
+        result['bytes_per_item'] = round(n_bytes / items, 1)
+    with open(result_fn, 'w') as out:
+        json.dump(result, out)
+
+
+def count_objects(root):
+
+    # Number and total size of the objects reachable from root (excluded), not counting classes and modules
+    seen = set([id(root)])
+    stack = gc.get_referents(root)
+    n_bytes = 0
+    while len(stack) > 0:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, (type, types.ModuleType)):
+            continue
+        seen.add(id(obj))
+        n_bytes += sys.getsizeof(obj)
+        stack.extend(gc.get_referents(obj))
+    return len(seen) - 1, n_bytes
+
+
+def compare(results, baseline_fn):
+
+    with open(baseline_fn) as f:
+        baseline = json.load(f)
+
+    print '\n{:<22}{:>16}{:>16}{:>10}'.format('Stage', 'Baseline (/s)', 'Current (/s)', 'Ratio')
+    for name, stage in results['stages'].iteritems():
+        if name not in baseline['stages']:
+            continue
+        old = baseline['stages'][name]['items_per_second']
+        new = stage['items_per_second']
+        ratio = '{:.2f}'.format(new / old) if old and new else '.'
+        print '{:<22}{:>16}{:>16}{:>10}'.format(name, old, new, ratio)
+
+
+def main():
+
+    parser = OptionParser(usage='python benchmarks/run_benchmarks.py <options>')
+    parser.add_option('--data', default=None, dest='data', help='Directory of the synthetic trio (default: temporary directory)')
+    parser.add_option('--variants', default=2000, type='int', dest='variants', help='Number of variants in the child (default: 2000)')
+    parser.add_option('--depth', default=10, type='int', dest='depth', help='Read depth at each variant in the parental BAMs (default: 10)')
+    parser.add_option('--seed', default=1, type='int', dest='seed', help='Random seed (default: 1)')
+    parser.add_option('--stages', default=','.join(STAGES.keys()), dest='stages', help='Comma-separated list of stages to run')
+    parser.add_option('--output', default='benchmark_results.json', dest='output', help='Output JSON file (default: benchmark_results.json)')
+    parser.add_option('--compare', default=None, dest='compare', help='JSON results of an earlier run to compare with')
+    parser.add_option('--run-stage', default=None, dest='run_stage', help=None)
+    parser.add_option('--result-file', default=None, dest='result_file', help=None)
+    (options, args) = parser.parse_args()
+
+    data_dir = options.data if options.data is not None else tempfile.mkdtemp()
+    files_fn = os.path.join(data_dir, 'files.json')
+
+    # Single stage in a child process
+    if options.run_stage is not None:
+        with open(files_fn) as f:
+            run_stage(options.run_stage, json.load(f), options.result_file)
+        return
+
+    params = OrderedDict([('variants', options.variants), ('depth', options.depth), ('seed', options.seed)])
+
+    # Generate the synthetic trio unless already present with the same parameters
+    if os.path.isfile(files_fn):
+        with open(files_fn) as f:
+            existing = json.load(f)
+    else:
+        existing = {}
+    if existing.get('params') != params:
+        print 'Generating synthetic trio in {} ...'.format(data_dir)
+        files = synthetic.generate(data_dir, n_variants=options.variants, depth=options.depth, seed=options.seed)
+        with open(files_fn, 'w') as f:
+            json.dump(dict(files, params=params), f)
+
+    results = OrderedDict([('params', params), ('stages', OrderedDict())])
+    for name in options.stages.split(','):
+        result_fn = tempfile.mktemp()
+        subprocess.check_call([
+            sys.executable, os.path.abspath(__file__), '--data', data_dir, '--run-stage', name, '--result-file', result_fn
+        ])
+        with open(result_fn) as f:
+            results['stages'][name] = json.load(f, object_pairs_hook=OrderedDict)
+        os.remove(result_fn)
+        stage = results['stages'][name]
+        print '{:<26}{:>10} items{:>10.2f} s{:>12} /s{:>10} MB{}'.format(
+            name, stage['items'], stage['wall_seconds'], stage['items_per_second'], stage['peak_rss_mb'],
+            '{:>8} objects/item{:>9} bytes/item'.format(stage['objects_per_item'], stage['bytes_per_item'])
+            if 'objects_per_item' in stage else ''
+        )
+
+    with open(options.output, 'w') as out:
+        json.dump(results, out, indent=2)
+    print '\nResults written to {}'.format(options.output)
+
+    if options.compare is not None:
+        compare(results, options.compare)
+
+
+if __name__ == '__main__':
+    main()
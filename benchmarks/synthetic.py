@@ -0,0 +1,338 @@
+"""Reproducible synthetic trio for benchmarking DeNovoFilter"""
+
+from __future__ import division
+import os
+import random
+import pysam
+
+
+POPULATIONS = ['AFR', 'AMR', 'ASJ', 'EAS', 'FIN', 'NFE', 'OTH', 'SAS']
+GNOMAD_CHROMOSOMES = map(str, range(1, 23)) + ['X']
+BASES = 'ACGT'
+READ_LENGTH = 50
+
+
+def generate(outdir, n_variants=2000, chroms=('1', '2', 'X'), chrom_length=200000, depth=10, seed=1):
+
+    rng = random.Random(seed)
+    chroms = list(chroms)
+
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    # Random reference sequence of each chromosome
+    genome = dict((c, ''.join(rng.choice(BASES) for _ in xrange(chrom_length))) for c in chroms)
+
+    # Variants of the trio: the parents share some of the child's variants
+    child = _make_variants(rng, genome, n_variants, chrom_length)
+    mother = _sorted_variants([v for v in child if rng.random() < 0.1] + _make_variants(rng, genome, n_variants // 4, chrom_length))
+    father = _sorted_variants([v for v in child if rng.random() < 0.1] + _make_variants(rng, genome, n_variants // 4, chrom_length))
+
+    # gnomAD records at or near half of the child's variants
+    csns = {}
+    gnomad_records = []
+    for (chrom, pos, ref, alts) in child:
+        if rng.random() < 0.5:
+            gnomad_records.append(_make_gnomad_record(rng, chrom, pos, ref, alts, csns))
+
+    _write_vcf(os.path.join(outdir, 'child.vcf'), child, rng, csns)
+    _write_vcf(os.path.join(outdir, 'mother.vcf'), mother, rng, {})
+    _write_vcf(os.path.join(outdir, 'father.vcf'), father, rng, {})
+
+    exomes_fn = _write_gnomad(os.path.join(outdir, 'gnomad_exomes.vcf'), gnomad_records, chroms, rng)
+    for c in GNOMAD_CHROMOSOMES:
+        _write_gnomad(
+            os.path.join(outdir, 'gnomad_genomes.{}.vcf'.format(c)),
+            [r for r in gnomad_records if r[0] == c and rng.random() < 0.7],
+            [c] if c in chroms else [],
+            rng
+        )
+
+    _write_control_file(os.path.join(outdir, 'control.txt'), child, rng, csns)
+    _write_exac_file(os.path.join(outdir, 'exac.txt'))
+    _write_maxentscan_file(os.path.join(outdir, 'maxentscan.txt'), child, rng)
+
+    _write_bam(os.path.join(outdir, 'mother.bam'), genome, chroms, child, rng, depth)
+    _write_bam(os.path.join(outdir, 'father.bam'), genome, chroms, child, rng, depth)
+
+    config_fn = os.path.join(outdir, 'config.txt')
+    with open(config_fn, 'w') as out:
+        out.write('GNOMAD_EXOMES_DATA_FILE = {}\n'.format(exomes_fn))
+        out.write('GNOMAD_GENOMES_DATA_FILE = {}\n'.format(os.path.join(outdir, 'gnomad_genomes.{}.vcf.gz')))
+        out.write('CONTROL_DATA_FILE = {}\n'.format(os.path.join(outdir, 'control.txt')))
+        out.write('MAXENTSCAN_DATA_FILE = {}\n'.format(os.path.join(outdir, 'maxentscan.txt')))
+        out.write('EXAC_DATA_FILE = {}\n'.format(os.path.join(outdir, 'exac.txt')))
+        out.write('GNOMAD_MAX_FREQUENCY = 0.05\n')
+        out.write('CHILD_MIN_TC = 10\n')
+
+    return {
+        'child_var': os.path.join(outdir, 'child.vcf'),
+        'mother_var': os.path.join(outdir, 'mother.vcf'),
+        'father_var': os.path.join(outdir, 'father.vcf'),
+        'child_bam': os.path.join(outdir, 'mother.bam'),
+        'mother_bam': os.path.join(outdir, 'mother.bam'),
+        'father_bam': os.path.join(outdir, 'father.bam'),
+        'config': config_fn
+    }
+
+
+def _make_variants(rng, genome, n, chrom_length):
+
+    ret = []
+    for chrom in sorted(genome.keys(), key=GNOMAD_CHROMOSOMES.index):
+        for pos in sorted(rng.sample(xrange(500, chrom_length - 500), n // len(genome))):
+            seq = genome[chrom]
+            kind = rng.random()
+            ref = seq[pos - 1]
+            if kind < 0.6:
+                # Substitution, sometimes multiallelic
+                alts = [rng.choice([b for b in BASES if b != ref])]
+                if rng.random() < 0.1:
+                    alts.append(rng.choice([b for b in BASES if b != ref and b not in alts]))
+            elif kind < 0.8:
+                # Deletion
+                ref = seq[pos - 1:pos + rng.randint(1, 4)]
+                alts = [ref[0]]
+            elif kind < 0.95:
+                # Insertion
+                alts = [ref + ''.join(rng.choice(BASES) for _ in range(rng.randint(1, 4)))]
+            else:
+                # Complex indel
+                ref = seq[pos - 1:pos + 3]
+                alts = [rng.choice([b for b in BASES if b != ref[0]]) + 'G']
+            ret.append((chrom, pos, ref, alts))
+    return ret
+
+
+def _sorted_variants(variants):
+
+    return sorted(variants, key=lambda v: (GNOMAD_CHROMOSOMES.index(v[0]), v[1]))
+
+
+def _random_csn(rng, i, ref, alt):
+
+    if rng.random() < 0.1:
+        return '.'
+    coord = rng.choice([str(100 + i), '{}+{}'.format(100 + i, rng.randint(1, 30)), '{}-{}'.format(100 + i, rng.randint(1, 30))])
+    return 'c.{}{}>{}'.format(coord, ref[0], alt[0])
+
+
+def _make_gnomad_record(rng, chrom, pos, ref, alts, csns):
+
+    # Most records are at the same position as the child's variant, others are nearby
+    if rng.random() < 0.6:
+        gnomad_pos, gnomad_ref, gnomad_alts = pos, ref, alts
+    else:
+        gnomad_pos = pos + rng.randint(-50, 50)
+        gnomad_ref = rng.choice(BASES)
+        gnomad_alts = [rng.choice([b for b in BASES if b != gnomad_ref])]
+
+    genes = []
+    gnomad_csns = []
+    for i, alt in enumerate(gnomad_alts):
+        csn = 'c.{}{}>{}'.format(gnomad_pos % 1000, gnomad_ref[0], alt[0])
+        csns[(chrom, pos, ref, alts[i] if i < len(alts) else alt)] = csn
+        genes.append('GENE{}:OTHER'.format(rng.randint(0, 49)))
+        gnomad_csns.append(csn + ':c.1A>G')
+
+    return chrom, gnomad_pos, gnomad_ref, gnomad_alts, genes, gnomad_csns
+
+
+def _write_vcf(fn, variants, rng, csns):
+
+    with open(fn, 'w') as out:
+        out.write('##fileformat=VCFv4.1\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n')
+        for i, (chrom, pos, ref, alts) in enumerate(variants):
+
+            tc = rng.randint(0, 60) if rng.random() < 0.02 else rng.randint(5, 60)
+            trs = [rng.randint(0, tc) for _ in alts]
+            n_transcripts = rng.randint(1, 3)
+
+            annotations = dict((k, []) for k in ['TYPE', 'GENE', 'CSN', 'CLASS', 'ALTANN', 'ALTCLASS'])
+            for alt in alts:
+                annotations['GENE'].append(':'.join('GENE{}'.format((i + j) % 50) for j in range(n_transcripts)))
+                annotations['CSN'].append(':'.join(
+                    csns[(chrom, pos, ref, alt)] if j == 0 and (chrom, pos, ref, alt) in csns else _random_csn(rng, i + j, ref, alt)
+                    for j in range(n_transcripts)
+                ))
+                annotations['CLASS'].append(':'.join(['MS'] * n_transcripts))
+                annotations['ALTANN'].append(':'.join(['.'] * n_transcripts))
+                annotations['ALTCLASS'].append(':'.join(['.'] * n_transcripts))
+                if len(ref) == 1 and len(alt) == 1:
+                    annotations['TYPE'].append('Substitution')
+                elif len(ref) > len(alt):
+                    annotations['TYPE'].append('Deletion')
+                else:
+                    annotations['TYPE'].append('Insertion')
+
+            info = ['FR=0.5', 'NF=' + ','.join(str(tr // 2) for tr in trs), 'NR=' + ','.join(str(tr - tr // 2) for tr in trs),
+                    'TC={}'.format(tc), 'TR=' + ','.join(map(str, trs))]
+            info += ['{}={}'.format(k, ','.join(annotations[k])) for k in ['TYPE', 'GENE', 'CSN', 'CLASS', 'ALTANN', 'ALTCLASS']]
+
+            out.write('\t'.join([
+                'chr' + chrom if rng.random() < 0.05 else chrom,
+                str(pos),
+                '.',
+                ref,
+                ','.join(alts),
+                str(rng.choice([50, 150, 300])),
+                rng.choice(['PASS', 'PASS', 'badReads']),
+                ';'.join(info)
+            ]) + '\n')
+
+
+def _genotype_counts(rng, n_alts):
+
+    n_genotypes = (n_alts + 1) * (n_alts + 2) // 2
+    if rng.random() < 0.05:
+        return ','.join(['0'] * n_genotypes)
+    gc = [rng.randint(1000, 5000)] + [rng.randint(0, 3) if rng.random() < 0.5 else 0 for _ in range(n_genotypes - 1)]
+    return ','.join(map(str, gc))
+
+
+def _write_gnomad(fn, records, contigs, rng):
+
+    lines = []
+    for (chrom, pos, ref, alts, genes, csns) in records:
+        info = ['AC=1', 'GENE=' + ','.join(genes), 'CSN=' + ','.join(csns)]
+        for pop in POPULATIONS:
+            if chrom == 'X':
+                info.append('GC_{}_Male={}'.format(pop, _genotype_counts(rng, len(alts))))
+                info.append('GC_{}_Female={}'.format(pop, _genotype_counts(rng, len(alts))))
+            else:
+                info.append('GC_{}={}'.format(pop, _genotype_counts(rng, len(alts))))
+            info.append('AF_{}={}'.format(pop, ','.join('{:.5e}'.format(rng.random() / 100) for _ in alts)))
+        info.append('VQSLOD=1.2;DP=1000;FLAG_X')
+        lines.append((GNOMAD_CHROMOSOMES.index(chrom), pos, '\t'.join([chrom, str(pos), '.', ref, ','.join(alts), '100', 'PASS', ';'.join(info)])))
+
+    with open(fn, 'w') as out:
+        out.write('##fileformat=VCFv4.1\n')
+        for c in contigs:
+            out.write('##contig=<ID={}>\n'.format(c))
+        out.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n')
+        for line in sorted(lines):
+            out.write(line[2] + '\n')
+
+    pysam.tabix_index(fn, preset='vcf', force=True)
+    return fn + '.gz'
+
+
+def _write_control_file(fn, variants, rng, csns):
+
+    with open(fn, 'w') as out:
+        out.write('##SAMPLES=500\n#CHROM\tPOS\tREF\tALT\n')
+        for (chrom, pos, ref, alts) in variants:
+            if rng.random() < 0.3:
+                cols = [chrom, str(pos), ref, alts[0]] + ['.'] * 17
+                cols[6] = 'GENE{}'.format(rng.randint(0, 49))
+                cols[9] = csns.get((chrom, pos, ref, alts[0]), '.')
+                cols[20] = str(rng.randint(0, 5))
+                out.write('\t'.join(cols) + '\n')
+
+
+def _write_exac_file(fn):
+
+    with open(fn, 'w') as out:
+        out.write('gene\tN_missense\tExp_missense\tZ_missense\tN_lof\tExp_lof\tpLI\n')
+        for g in range(0, 50, 2):
+            out.write('GENE{}\t{}\t{}\t{}\t{}\t{}\t{}\n'.format(g, g, g * 1.5, 0.123, g, 2.25, 0.5))
+
+
+def _write_maxentscan_file(fn, variants, rng):
+
+    with open(fn, 'w') as out:
+        out.write('CHROM\tPOS\tREF\tALT\n')
+        for (chrom, pos, ref, alts) in variants:
+            if len(ref) == 1 and len(alts[0]) == 1 and rng.random() < 0.3:
+                out.write('\t'.join([
+                    chrom, str(pos), ref, alts[0], 'ENST1', 'GENE1', 'Ex1', 'c.{}+2{}>{}'.format(pos % 100, ref, alts[0]),
+                    'SS', '8.1', '7.2', rng.choice(['.', '5.5', '-1.0', '9.1']), '6.1', '7.7', '3.3', '4.4', '100', '200'
+                ]) + '\n')
+
+
+def _md_tag(seq, start, read_seq, cigar):
+
+    md = []
+    n = 0
+    ref_pos = start
+    query_pos = 0
+    for (op, length) in cigar:
+        if op == 0:
+            for k in range(length):
+                if read_seq[query_pos + k] == seq[ref_pos + k]:
+                    n += 1
+                else:
+                    md.append(str(n) + seq[ref_pos + k])
+                    n = 0
+            ref_pos += length
+            query_pos += length
+        elif op in (1, 4):
+            query_pos += length
+        elif op == 2:
+            md.append(str(n) + '^' + seq[ref_pos:ref_pos + length])
+            n = 0
+            ref_pos += length
+    return ''.join(md) + str(n)
+
+
+def _make_read(rng, seq, pos, ref, alt):
+
+    start = pos - 1 - rng.randint(5, READ_LENGTH - 10)
+    offset = pos - 1 - start
+    cigar = [(0, READ_LENGTH)]
+    read_seq = seq[start:start + READ_LENGTH]
+
+    # Random sequencing error
+    if rng.random() < 0.2:
+        k = rng.randint(0, READ_LENGTH - 1)
+        read_seq = read_seq[:k] + rng.choice(BASES) + read_seq[k + 1:]
+
+    # Some reads support the alternative allele
+    if rng.random() < 0.1:
+        if len(ref) == 1 and len(alt) == 1:
+            read_seq = read_seq[:offset] + alt + read_seq[offset + 1:]
+        elif len(alt) == 1 and ref[0] == alt[0]:
+            d = len(ref) - 1
+            cigar = [(0, offset + 1), (2, d), (0, READ_LENGTH - offset - 1)]
+            read_seq = seq[start:start + offset + 1] + seq[start + offset + 1 + d:start + READ_LENGTH + d]
+        elif len(ref) == 1 and ref[0] == alt[0]:
+            k = len(alt) - 1
+            cigar = [(0, offset + 1), (1, k), (0, READ_LENGTH - offset - 1 - k)]
+            read_seq = seq[start:start + offset + 1] + alt[1:] + seq[start + offset + 1:start + READ_LENGTH - k]
+        else:
+            cigar = [(0, offset + 1), (2, len(ref) - 1), (1, 1), (0, READ_LENGTH - offset - 2)]
+            read_seq = seq[start:start + offset + 1] + 'G' + seq[start + offset + len(ref):start + len(ref) + READ_LENGTH - 2]
+
+    # Some reads are soft clipped
+    if rng.random() < 0.1:
+        cigar = [(4, 3), (0, cigar[0][1] - 3)] + cigar[1:]
+
+    return start, read_seq, cigar
+
+
+def _write_bam(fn, genome, chroms, variants, rng, depth):
+
+    reads = []
+    for (chrom, pos, ref, alts) in variants:
+        for _ in range(depth):
+            start, read_seq, cigar = _make_read(rng, genome[chrom], pos, ref, alts[0])
+            md = _md_tag(genome[chrom], start, read_seq, cigar)
+            reads.append((chroms.index(chrom), start, read_seq, cigar, md, rng.random() < 0.05))
+    reads.sort(key=lambda x: (x[0], x[1]))
+
+    header = {'HD': {'VN': '1.0', 'SO': 'coordinate'}, 'SQ': [{'LN': len(genome[c]), 'SN': c} for c in chroms]}
+    with pysam.AlignmentFile(fn, 'wb', header=header) as out:
+        for i, (tid, start, read_seq, cigar, md, is_duplicate) in enumerate(reads):
+            read = pysam.AlignedSegment()
+            read.query_name = 'read{}'.format(i)
+            read.query_sequence = read_seq
+            read.flag = 1024 if is_duplicate else 0
+            read.reference_id = tid
+            read.reference_start = start
+            read.mapping_quality = 60
+            read.cigartuples = cigar
+            read.query_qualities = pysam.qualitystring_to_array('I' * len(read_seq))
+            read.set_tag('MD', md)
+            out.write(read)
+
+    pysam.index(fn)
@@ -1,19 +1,105 @@
+import bisect
+import os
+import pysam
+from profiling import profiler
 
-def count(samfile, var_key):
+
+# Loci closer to each other than this are read from the BAM file in one region
+REGION_GAP = 500
+
+# Version of the allele counts, counts cached by earlier versions are not reused
+COUNTS_VERSION = 2
+
+
+class AlleleCounter(object):
+
+
+    def __init__(self, bam_fn, cache_fn=None, engine='aligned_pairs', name='BAM'):
+
+        if engine not in ENGINES:
+            raise ValueError('Unknown allele counting engine: {}'.format(engine))
+
+        self.samfile = pysam.AlignmentFile(bam_fn, "rb")
+        self.engine = engine
+        self.name = name
+
+        # Allele counts are only valid for the same version of the same BAM file and the same engine
+        mtime = str(int(os.path.getmtime(bam_fn)))
+        self.bam_id = (os.path.abspath(bam_fn), mtime, '{}.{}'.format(engine, COUNTS_VERSION))
+
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+
+        self.cache_file = None
+        if cache_fn is not None:
+            if os.path.isfile(cache_fn):
+                self._load_cache_file(cache_fn)
+            self.cache_file = open(cache_fn, 'a')
+
+
+    def count(self, var_key):
+
+        if var_key in self.cache:
+            self.hits += 1
+            return self.cache[var_key]
+
+        self.misses += 1
+        with profiler.timer('{} allele counting'.format(self.name)):
+            ret = count(self.samfile, var_key, self.engine)
+        self._store(var_key, ret)
+
+        return ret
+
+
+    def prefetch(self, var_keys):
+
+        var_keys = [k for k in set(var_keys) if k not in self.cache and k[0] in self.samfile.references]
+
+        with profiler.timer('{} batch allele counting'.format(self.name)):
+            counts = count_batch(self.samfile, var_keys, self.engine)
+        self.misses += len(counts)
+        for var_key, ret in counts.iteritems():
+            self._store(var_key, ret)
+
+
+    def cache_stats(self):
+
+        return [('allele counts', self.hits, self.misses)]
+
+
+    def _store(self, var_key, ret):
+
+        self.cache[var_key] = ret
+
+        if self.cache_file is not None:
+            self.cache_file.write('\t'.join(list(self.bam_id) + list(var_key) + map(str, ret)) + '\n')
+            self.cache_file.flush()
+
+
+    def _load_cache_file(self, fn):
+
+        with open(fn) as f:
+            for line in f:
+                cols = line.rstrip('\n').split('\t')
+                if len(cols) != 9 or tuple(cols[:3]) != self.bam_id:
+                    continue
+                self.cache[tuple(cols[3:7])] = (int(cols[7]), int(cols[8]))
+
+
+def count(samfile, var_key, engine='aligned_pairs'):
 
     [chrom, pos, ref, alt] = var_key
     pos = int(pos) - 1
 
-    if is_substitution(ref, alt) or is_deletion(ref, alt):
-        start, end = pos, pos
-    elif is_insertion(ref, alt):
-        start, end = pos, pos + 1
-    else:
-        start, end = pos, pos + len(ref) - 1
+    start, end = locus(pos, ref, alt)
+    supports_alt = ENGINES[engine]
 
     tc = 0
     tr = 0
+    n_reads = 0
     for read in samfile.fetch(chrom, start, end + 1):
+        n_reads += 1
 
         # Filter out optical and PCR duplicate reads and unmapped reads
         if read.is_duplicate or read.is_unmapped:
@@ -21,38 +107,146 @@ def count(samfile, var_key):
 
         tc += 1
 
-        # If substitution
-        if is_substitution(ref, alt):
-            if count_as_substitution(read, pos, alt):
-                tr += 1
-            continue
+        if supports_alt(read, pos, ref, alt):
+            tr += 1
 
-        # If deletion
-        if is_deletion(ref, alt):
-            if count_as_deletion(read, pos, ref):
-                tr += 1
-            continue
+    profiler.count('BAM reads iterated', n_reads)
+
+    return tc, tr
+
+
+def count_batch(samfile, var_keys, engine='aligned_pairs'):
+
+    ret = {}
+
+    supports_alt = ENGINES[engine]
+
+    by_chrom = {}
+    for var_key in var_keys:
+        [chrom, pos, ref, alt] = var_key
+        pos = int(pos) - 1
+        start, end = locus(pos, ref, alt)
+        by_chrom.setdefault(chrom, []).append((start, end + 1, var_key, pos, ref, alt))
+
+    for chrom, loci in by_chrom.iteritems():
+
+        # Merge nearby loci into regions
+        loci.sort()
+        regions = []
+        for l in loci:
+            if len(regions) > 0 and l[0] <= regions[-1][1] + REGION_GAP:
+                regions[-1][1] = max(regions[-1][1], l[1])
+                regions[-1][2].append(l)
+            else:
+                regions.append([l[0], l[1], [l]])
+
+        for (region_start, region_end, region_loci) in regions:
+            try:
+                ret.update(_count_region(samfile, chrom, region_start, region_end, region_loci, supports_alt))
+            except ValueError:
+                # Leave the loci to count() so that errors are reported for the affected variants only
+                continue
 
-        # If insertion
-        if is_insertion(ref, alt):
-            if count_as_insertion(read, pos):
-                tr += 1
+    return ret
+
+
+def _count_region(samfile, chrom, region_start, region_end, loci, supports_alt):
+
+    starts = [l[0] for l in loci]
+    max_span = max([l[1] - l[0] for l in loci])
+    counts = [[0, 0] for _ in loci]
+
+    n_reads = 0
+    for read in samfile.fetch(chrom, region_start, region_end):
+        n_reads += 1
+
+        # Filter out optical and PCR duplicate reads and unmapped reads
+        if read.is_duplicate or read.is_unmapped:
             continue
 
-        # If complex indel
-        if count_as_complex(read, pos, ref):
-            tr += 1
+        # Same overlap rule as used by fetch() (alignments span at least one base)
+        read_start = read.reference_start
+        read_end = read.reference_end
+        if read_end is None or read_end == read_start:
+            read_end = read_start + 1
 
-    return tc, tr
+        first = bisect.bisect_right(starts, read_start - max_span)
+        last = bisect.bisect_left(starts, read_end)
+        for i in range(first, last):
+            (start, end, var_key, pos, ref, alt) = loci[i]
+            if end <= read_start:
+                continue
+            counts[i][0] += 1
+            if supports_alt(read, pos, ref, alt):
+                counts[i][1] += 1
+
+    profiler.count('BAM reads iterated', n_reads)
+
+    return dict((loci[i][2], tuple(counts[i])) for i in range(len(loci)))
+
+
+def locus(pos, ref, alt):
+
+    if is_substitution(ref, alt) or is_deletion(ref, alt):
+        return pos, pos
+    elif is_insertion(ref, alt):
+        return pos, pos + 1
+    else:
+        return pos, pos + len(ref) - 1
+
+
+def supports_alt_by_aligned_pairs(read, pos, ref, alt):
+
+    # If substitution
+    if is_substitution(ref, alt):
+        return count_as_substitution(read, pos, alt)
+
+    # If deletion
+    if is_deletion(ref, alt):
+        return count_as_deletion(read, pos, ref)
+
+    # If insertion
+    if is_insertion(ref, alt):
+        return count_as_insertion(read, pos)
+
+    # If complex indel
+    return count_as_complex(read, pos, ref)
+
+
+def supports_alt_by_cigar(read, pos, ref, alt):
+
+    # If substitution: compare the base of the read aligned to the position (no MD tag needed)
+    if is_substitution(ref, alt):
+        return query_base_at(read, pos) == alt
+
+    deletions, insertions = cigar_indel_blocks(read)
+
+    # If deletion
+    if is_deletion(ref, alt):
+        return any([d[0] <= pos + 1 and pos + len(ref) - 1 <= d[1] for d in deletions])
+
+    # If insertion
+    if is_insertion(ref, alt):
+        return any([d[0] == pos for d in insertions])
+
+    # If complex indel
+    if any([d[0] <= pos + 1 and pos + len(ref) - 1 <= d[1] for d in deletions]):
+        return True
+    return any([pos <= d[0] < pos + len(ref) - 1 for d in insertions])
 
 
 def count_as_substitution(read, pos, alt):
 
-    for x in read.get_aligned_pairs(with_seq=True):
+    # The base of the read aligned to the position is compared, not the reference base
+    seq = read.query_sequence
+    if seq is None:
+        return False
+
+    for x in read.get_aligned_pairs():
         if x[1] == pos:
             if x[0] is None:
                 return False
-            return x[2] == alt
+            return seq[x[0]] == alt
 
     return False
 
@@ -108,6 +302,58 @@ def insertion_blocks(read):
     return ret
 
 
+def query_base_at(read, pos):
+
+    if read.query_sequence is None:
+        return None
+
+    ref_pos = read.reference_start
+    query_pos = 0
+    for (op, length) in read.cigartuples:
+
+        # M, = and X operations consume both the reference and the read
+        if op in (0, 7, 8):
+            if pos < ref_pos + length:
+                return read.query_sequence[query_pos + pos - ref_pos] if pos >= ref_pos else None
+            ref_pos += length
+            query_pos += length
+
+        # I and S operations consume the read only
+        elif op in (1, 4):
+            query_pos += length
+
+        # D and N operations consume the reference only
+        elif op in (2, 3):
+            if pos < ref_pos + length:
+                return None
+            ref_pos += length
+
+    return None
+
+
+def cigar_indel_blocks(read):
+
+    # Same blocks as deletion_blocks() and insertion_blocks(), derived from the CIGAR in one pass
+    deletions = []
+    insertions = []
+
+    ref_pos = read.reference_start
+    prev_end = None
+    for (op, length) in read.cigartuples:
+        if op in (0, 7, 8):
+            if prev_end is not None:
+                if ref_pos > prev_end:
+                    deletions.append((prev_end, ref_pos - 1))
+                elif ref_pos == prev_end:
+                    insertions.append((prev_end - 1, ref_pos))
+            ref_pos += length
+            prev_end = ref_pos
+        elif op in (2, 3):
+            ref_pos += length
+
+    return deletions, insertions
+
+
 def is_substitution(ref, alt):
 
     return len(ref) == 1 and len(alt) == 1
@@ -122,3 +368,9 @@ def is_insertion(ref, alt):
 
     return ref[0] == alt[0] and len(ref) == 1 and len(alt) > 1
 
+
+# Functions deciding whether a read supports the alternative allele
+ENGINES = {
+    'aligned_pairs': supports_alt_by_aligned_pairs,
+    'cigar': supports_alt_by_cigar
+}
@@ -0,0 +1,45 @@
+from collections import OrderedDict
+
+
+class LRUCache(object):
+
+
+    def __init__(self, maxsize, on_evict=None):
+
+        self.maxsize = maxsize
+        self.on_evict = on_evict
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+
+    def get(self, key):
+
+        if key not in self.data:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        value = self.data.pop(key)
+        self.data[key] = value
+        return value
+
+
+    def put(self, key, value):
+
+        # Nothing is cached if the size is not positive, the value is not evicted either
+        if self.maxsize <= 0:
+            return
+
+        if key in self.data:
+            del self.data[key]
+        elif len(self.data) >= self.maxsize:
+            evicted_key, evicted_value = self.data.popitem(last=False)
+            if self.on_evict is not None:
+                self.on_evict(evicted_key, evicted_value)
+        self.data[key] = value
+
+
+    def __len__(self):
+
+        return len(self.data)
@@ -1,12 +1,22 @@
 #!env/bin/python
 
 from optparse import OptionParser
+import sys
+import server
 import toplevel
 from .version import __version__
 
 
 def start_cli():
 
+    # Subcommands
+    if len(sys.argv) > 1 and sys.argv[1] == 'build-gnomad-index':
+        start_build_gnomad_index_cli(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == 'serve':
+        start_serve_cli(sys.argv[2:])
+        return
+
     parser = OptionParser(
         description='DeNovoFilter v{}'.format(__version__),
         usage='DeNovoFilter/denovo <options>',
@@ -69,6 +79,48 @@ def start_cli():
         help='Configuration file'
     )
 
+    add_filtering_options(parser)
+
+    parser.add_option(
+        '--output',
+        default=None,
+        dest='output',
+        action='store',
+        help='Output filename prefix'
+    )
+
+    parser.add_option(
+        '--processes',
+        default=1,
+        dest='processes',
+        action='store',
+        type='int',
+        help='Number of worker processes used for filtering variants, or for processing trios with --trios (default: 1)'
+    )
+
+    parser.add_option(
+        '--trios',
+        default=None,
+        dest='trios',
+        action='store',
+        help='Tab-separated manifest of trios to be processed in one run, with columns ' +
+             'child_var, mother_var, father_var, child_bam, mother_bam, father_bam and output (output filename prefix)'
+    )
+
+    parser.add_option(
+        '--profile',
+        default=False,
+        dest='profile',
+        action='store_true',
+        help='Write timings and counters of the run to <output>_profile.json'
+    )
+
+    (options, args) = parser.parse_args()
+    toplevel.run(options)
+
+
+def add_filtering_options(parser):
+
     parser.add_option(
         '--full_details',
         default=False,
@@ -78,12 +130,131 @@ def start_cli():
     )
 
     parser.add_option(
-        '--output',
+        '--output_format',
+        default='tsv',
+        dest='output_format',
+        action='store',
+        type='choice',
+        choices=['tsv', 'parquet', 'arrow'],
+        help='Format of the output files: tsv, parquet or arrow (Arrow IPC stream) (default: tsv), '
+             'parquet and arrow require pyarrow, installed with the columnar extra (pip install .[columnar])'
+    )
+
+    parser.add_option(
+        '--bgzip_output',
+        default=False,
+        dest='bgzip_output',
+        action='store_true',
+        help='Write bgzip-compressed tsv output files indexed with tabix (<output>_denovo_candidates.txt.gz, <output>_filtered_out.txt.gz), '
+             'the child VCF file must be sorted by position'
+    )
+
+    parser.add_option(
+        '--streaming',
+        default=False,
+        dest='streaming',
+        action='store_true',
+        help='Stream the variants of the child instead of loading them into memory, the child VCF file must be sorted by position. '
+             'Control and MaxEntScan data files are then loaded whole unless bgzipped and tabix-indexed'
+    )
+
+    parser.add_option(
+        '--lazy_details',
+        default=False,
+        dest='lazy_details',
+        action='store_true',
+        help="With --full_details, output '.' instead of the gnomAD, control and parental allele columns of variants failing a cheap filter"
+    )
+
+
+def start_serve_cli(args):
+
+    parser = OptionParser(
+        description='DeNovoFilter v{}'.format(__version__),
+        usage='DeNovoFilter/denovo serve <options>',
+        version=__version__
+    )
+
+    parser.add_option(
+        '--config',
         default=None,
-        dest='output',
+        dest='config',
         action='store',
-        help='Output filename prefix'
+        help='Configuration file'
     )
 
-    (options, args) = parser.parse_args()
-    toplevel.run(options)
\ No newline at end of file
+    parser.add_option(
+        '--host',
+        default='127.0.0.1',
+        dest='host',
+        action='store',
+        help='Address the HTTP server listens on (default: 127.0.0.1)'
+    )
+
+    parser.add_option(
+        '--port',
+        default=8642,
+        dest='port',
+        action='store',
+        type='int',
+        help='Port the HTTP server listens on (default: 8642)'
+    )
+
+    parser.add_option(
+        '--socket',
+        default=None,
+        dest='socket',
+        action='store',
+        help='Unix socket the HTTP server listens on instead of a TCP port, replacing an existing socket but no other file'
+    )
+
+    parser.add_option(
+        '--workers',
+        default=1,
+        dest='workers',
+        action='store',
+        type='int',
+        help='Number of worker processes running trio jobs (default: 1)'
+    )
+
+    parser.add_option(
+        '--max_queued_jobs',
+        default=1000,
+        dest='max_queued_jobs',
+        action='store',
+        type='int',
+        help='Maximum number of jobs waiting for a worker, further jobs are rejected (default: 1000)'
+    )
+
+    add_filtering_options(parser)
+
+    (options, args) = parser.parse_args(args)
+
+    # Only a socket left behind by an earlier server is replaced, a mistyped path must not delete a file
+    if options.socket is not None:
+        try:
+            server.check_socket_path(options.socket)
+        except ValueError as e:
+            parser.error(str(e))
+
+    toplevel.serve(options)
+
+
+def start_build_gnomad_index_cli(args):
+
+    parser = OptionParser(
+        description='DeNovoFilter v{}'.format(__version__),
+        usage='DeNovoFilter/denovo build-gnomad-index <options>',
+        version=__version__
+    )
+
+    parser.add_option(
+        '--config',
+        default=None,
+        dest='config',
+        action='store',
+        help='Configuration file naming the gnomAD data files to be indexed'
+    )
+
+    (options, args) = parser.parse_args(args)
+    toplevel.build_gnomad_index(options)
@@ -0,0 +1,65 @@
+from __future__ import division
+import os
+import pysam
+import parsers
+
+
+def open_control_data(fn, var_keys=None, csn_keys=None):
+
+    # A bgzipped and tabix-indexed control file is queried by region instead of being loaded
+    if os.path.isfile(fn + '.tbi'):
+        return ControlDBReader(fn)
+    return ControlData(fn, var_keys, csn_keys)
+
+
+class ControlData(object):
+
+
+    def __init__(self, fn, var_keys=None, csn_keys=None):
+
+        self.by_csnkey, self.by_varkey = parsers.read_custom_database_file(fn, var_keys, csn_keys)
+
+
+    def get_frequency(self, var_key, csn_key):
+
+        if csn_key[1] == '.':
+            return self.by_varkey[var_key] if var_key in self.by_varkey else 0.0
+        else:
+            return self.by_csnkey[csn_key] if csn_key in self.by_csnkey else 0.0
+
+
+class ControlDBReader(object):
+
+
+    def __init__(self, fn, delta=100):
+
+        self.fn = fn
+        self.tabix_file = pysam.Tabixfile(fn)
+        self.delta = delta
+
+        self.num_of_samples = None
+        for line in self.tabix_file.header:
+            if line.startswith('##SAMPLES='):
+                self.num_of_samples = int(line[line.find('=') + 1:])
+
+
+    def get_frequency(self, var_key, csn_key):
+
+        chrom = var_key[0]
+        pos = int(var_key[1])
+
+        if chrom not in self.tabix_file.contigs:
+            return 0.0
+
+        # Lines matching by CSN are only looked for in the vicinity of the variant
+        ret = 0.0
+        for line in self.tabix_file.fetch(chrom, max(0, pos - self.delta), pos + self.delta):
+            cols = line.strip().split('\t')
+            if csn_key[1] == '.':
+                if tuple(cols[:4]) != var_key:
+                    continue
+            elif (cols[6], cols[9]) != csn_key:
+                continue
+            ret = 100 * int(cols[20]) / self.num_of_samples
+
+        return ret
@@ -0,0 +1,355 @@
+from collections import OrderedDict
+from cStringIO import StringIO
+import itertools
+import Queue
+import threading
+import zlib
+import pysam
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+# First bytes of gzip (and thus bgzip) compressed files
+GZIP_MAGIC = '\x1f\x8b'
+
+# Size of the compressed blocks read at a time and the number of blocks decompressed ahead of the parser
+READ_AHEAD_BLOCK_SIZE = 1 << 20
+READ_AHEAD_BLOCKS = 8
+
+# Number of bytes of formatted lines collected before they are written to an output file
+OUTPUT_BUFFER_SIZE = 1 << 20
+
+# Number of records written together as a record batch to a columnar output file
+RECORD_BATCH_SIZE = 65536
+
+# Extensions of the output files of each output format, the arrow output files are Arrow IPC streams
+OUTPUT_EXTENSIONS = OrderedDict([('tsv', '.txt'), ('parquet', '.parquet'), ('arrow', '.arrows')])
+
+
+def is_gzipped(fn):
+
+    with open(fn, 'rb') as f:
+        return f.read(2) == GZIP_MAGIC
+
+
+def open_text(fn):
+
+    # Compressed files are decompressed in a background thread while the lines are parsed
+    if not is_gzipped(fn):
+        return open(fn)
+    return ReadAheadFile(iter_gzip_blocks(fn))
+
+
+def iter_gzip_blocks(fn, block_size=READ_AHEAD_BLOCK_SIZE):
+
+    # A bgzip file is a series of gzip members, each of them is decompressed in turn
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    with open(fn, 'rb') as f:
+        for data in iter(lambda: f.read(block_size), ''):
+            while data != '':
+                block = decompressor.decompress(data)
+                if block != '':
+                    yield block
+                data = decompressor.unused_data
+                if data != '':
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    block = decompressor.flush()
+    if block != '':
+        yield block
+
+
+class ReadAheadFile(object):
+
+
+    def __init__(self, blocks, max_blocks=READ_AHEAD_BLOCKS):
+
+        self.blocks = blocks
+        self.queue = Queue.Queue(max_blocks)
+        self.stopped = threading.Event()
+        self.error = None
+        self.lines = itertools.chain.from_iterable(self._iter_chunks())
+
+        self.thread = threading.Thread(target=self._read_blocks)
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    def _read_blocks(self):
+
+        try:
+            for block in self.blocks:
+                if not self._put(block):
+                    return
+        except Exception as e:
+            self.error = e
+        self._put('')
+
+
+    def _put(self, block):
+
+        # The reader gives up when the file is closed before all blocks are consumed
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(block, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+
+    def _iter_chunks(self):
+
+        # Blocks are cut after their last line break so that the lines are split by cStringIO
+        rest = ''
+        while True:
+            block = self.queue.get()
+            if block == '':
+                break
+            block = rest + block
+            i = block.rfind('\n') + 1
+            rest = block[i:]
+            yield StringIO(block[:i])
+
+        if self.error is not None:
+            raise self.error
+        if rest != '':
+            yield StringIO(rest)
+
+
+    def __iter__(self):
+
+        return self.lines
+
+
+    def next(self):
+
+        return next(self.lines)
+
+
+    def close(self):
+
+        self.stopped.set()
+        self.thread.join()
+        if hasattr(self.blocks, 'close'):
+            self.blocks.close()
+
+
+    def __enter__(self):
+
+        return self
+
+
+    def __exit__(self, *args):
+
+        self.close()
+
+
+class OutputWriter(object):
+
+
+    # Lines are collected and written to the file in bulk. A compressed output file is bgzipped and
+    # tabix-indexed by the chromosome and position columns when closed, its header line is skipped.
+    # Tabix needs the records sorted by position, with the records of each chromosome together.
+    def __init__(self, fn, compress=False, buffer_size=OUTPUT_BUFFER_SIZE):
+
+        self.fn = fn
+        self.compress = compress
+        self.buffer_size = buffer_size
+        self.lines = []
+        self.size = 0
+        self.chroms = set()
+        self.last = None
+        # The buffer of the file object itself is not needed
+        self.f = open(fn, 'w', 0)
+
+
+    def write_header(self, columns):
+
+        self.write('\t'.join(columns) + '\n')
+
+
+    def write_record(self, record):
+
+        if self.compress:
+            self._check_order(record[0], int(record[1]))
+
+        # Floats are written with two decimals
+        self.write('\t'.join([
+            x if type(x) is str else str(round(x, 2)) if type(x) is float else str(x) for x in record
+        ]) + '\n')
+
+
+    def _check_order(self, chrom, pos):
+
+        if self.last is None or chrom != self.last[0]:
+            if chrom in self.chroms:
+                raise ValueError('Cannot index {}, records of chromosome {} are not together, the input must be sorted'.format(self.fn, chrom))
+            self.chroms.add(chrom)
+        elif pos < self.last[1]:
+            raise ValueError('Cannot index {}, records are not sorted by position ({}:{} after {}:{}), the input must be sorted'.format(
+                self.fn, chrom, pos, self.last[0], self.last[1]
+            ))
+        self.last = (chrom, pos)
+
+
+    def write(self, line):
+
+        self.lines.append(line)
+        self.size += len(line)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+
+    def flush(self):
+
+        self.f.write(''.join(self.lines))
+        self.lines = []
+        self.size = 0
+
+
+    def close(self):
+
+        self.flush()
+        self.f.close()
+        if self.compress:
+            pysam.tabix_index(self.fn, seq_col=0, start_col=1, end_col=1, line_skip=1, force=True)
+
+
+class ColumnarWriter(object):
+
+
+    # Records are collected by column and written as record batches of typed columns to a Parquet file or
+    # an Arrow IPC stream. Columns are strings unless given another type, '.' values of typed columns are null.
+    def __init__(self, fn, output_format, column_types=None, batch_size=RECORD_BATCH_SIZE):
+
+        if pyarrow is None:
+            raise ImportError('pyarrow is required for the {} output format'.format(output_format))
+        if output_format not in ['parquet', 'arrow']:
+            raise ValueError('Unknown columnar output format: {}'.format(output_format))
+
+        self.fn = fn
+        self.output_format = output_format
+        self.column_types = column_types if column_types is not None else {}
+        self.batch_size = batch_size
+        self.schema = None
+        self.writer = None
+        self.converters = []
+        self.columns = []
+
+
+    def write_header(self, columns):
+
+        fields = columnar_fields(columns, self.column_types)
+        self.schema = pyarrow.schema([pyarrow.field(c, _arrow_type(t)) for c, t in fields])
+        self.converters = [COLUMN_CONVERTERS[t] for _, t in fields]
+        self.columns = [[] for _ in columns]
+
+        if self.output_format == 'parquet':
+            self.writer = pyarrow.parquet.ParquetWriter(self.fn, self.schema)
+        else:
+            self.writer = pyarrow.ipc.new_stream(self.fn, self.schema)
+
+
+    def write_record(self, record):
+
+        for column, convert, x in zip(self.columns, self.converters, record):
+            column.append(convert(x))
+        if len(self.columns[0]) >= self.batch_size:
+            self.flush()
+
+
+    def flush(self):
+
+        if len(self.columns) == 0 or len(self.columns[0]) == 0:
+            return
+
+        # Each batch is written as soon as it is full, with its own dictionaries of the dictionary-encoded columns.
+        # An Arrow IPC stream may replace the dictionaries between batches, unlike an Arrow IPC file.
+        arrays = []
+        for column, field in zip(self.columns, self.schema):
+            if pyarrow.types.is_dictionary(field.type):
+                arrays.append(pyarrow.array(column, type=field.type.value_type).dictionary_encode())
+            else:
+                arrays.append(pyarrow.array(column, type=field.type))
+        self.columns = [[] for _ in self.columns]
+
+        batch = pyarrow.RecordBatch.from_arrays(arrays, self.schema.names)
+        if self.output_format == 'parquet':
+            self.writer.write_table(pyarrow.Table.from_batches([batch]))
+        else:
+            self.writer.write_batch(batch)
+
+
+    def close(self):
+
+        if self.writer is None:
+            return
+        self.flush()
+        self.writer.close()
+
+
+def columnar_fields(columns, column_types):
+
+    # Columns with the types of their values in the columnar output formats
+    ret = []
+    for c in columns:
+        t = column_types.get(c, 'str')
+        if t not in COLUMN_CONVERTERS:
+            raise ValueError('Unknown type of output column {}: {}'.format(c, t))
+        ret.append((c, t))
+    return ret
+
+
+def _int_value(x):
+
+    return None if x == '.' else int(x)
+
+
+def _float_value(x):
+
+    return None if x == '.' else float(x)
+
+
+def _str_value(x):
+
+    # As in the text output
+    return x if type(x) is str else str(round(x, 2)) if type(x) is float else str(x)
+
+
+def _arrow_type(column_type):
+
+    if column_type == 'int':
+        return pyarrow.int64()
+    if column_type == 'float':
+        return pyarrow.float64()
+    if column_type == 'dictionary':
+        return pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+    return pyarrow.string()
+
+
+COLUMN_CONVERTERS = {
+    'int': _int_value,
+    'float': _float_value,
+    'str': _str_value,
+    'dictionary': _str_value
+}
+
+
+def open_output(fn_prefix, output_format='tsv', compress=False, column_types=None):
+
+    fn = fn_prefix + output_ext(output_format, compress=False)
+    if output_format == 'tsv':
+        return OutputWriter(fn, compress)
+    return ColumnarWriter(fn, output_format, column_types)
+
+
+def output_ext(output_format='tsv', compress=False):
+
+    # Only text output files are bgzipped, the columnar formats are compressed by their own means
+    ext = OUTPUT_EXTENSIONS[output_format]
+    return ext + '.gz' if compress and output_format == 'tsv' else ext
@@ -1,82 +1,109 @@
 from __future__ import division
 import helper
+from profiling import profiler
+
+
+# Maximum cost of the checks that only need the child variant and the sets of called variants
+CHEAP_CHECK_COST = 1
 
 
 class Filters(object):
 
 
-    def __init__(self, detailed):
+    # Filter checks as (name, method, cost, inputs). Checks are applied in order of increasing cost
+    # and each check is called with the listed inputs. Inputs other than the variant itself and the
+    # configuration are annotations looked up on demand, so a check that is never reached never
+    # pays for its annotation.
+    CHECKS = [
+        ('multi_allele_call', 'check_if_multiallelic', 1, ('config', 'data', 'var_key')),
+        ('called_in_parent', 'check_if_called_in_parent', 1, ('data', 'var_key')),
+        ('low_quality', 'check_if_low_quality', 1, ('variant',)),
+        ('outside_splice_site_boundary', 'check_if_outside_splice_side_boundary', 1, ('config', 'variant')),
+        ('low_child_tr', 'check_tr_in_child', 1, ('config', 'variant')),
+        ('low_child_tc', 'check_tc_in_child', 1, ('config', 'variant')),
+        ('low_child_tr_per_tc', 'check_tr_per_tc_in_child', 1, ('config', 'variant')),
+        ('high_control_frequency', 'check_control_frequency', 2, ('config', 'control_freq')),
+        ('high_gnomad_exomes_frequency', 'check_gnomad_exomes_frequency', 3, ('config', 'gnomad_exomes_freq')),
+        ('high_gnomad_genomes_frequency', 'check_gnomad_genomes_frequency', 3, ('config', 'gnomad_genomes_freq')),
+        ('mother_alleles', 'check_tc_and_tr_in_mother', 4, ('config', 'parent_alleles')),
+        ('father_alleles', 'check_tc_and_tr_in_father', 4, ('config', 'parent_alleles'))
+    ]
+
+    # Annotations as input name -> method looking them up
+    ANNOTATIONS = {
+        'control_freq': '_annotate_control_frequency',
+        'gnomad_exomes_freq': '_annotate_gnomad_exomes_frequency',
+        'gnomad_genomes_freq': '_annotate_gnomad_genomes_frequency',
+        'parent_alleles': '_annotate_parent_alleles'
+    }
+
+    # Annotations output in the detailed mode and their values when not looked up
+    RESULT_DEFAULTS = [
+        ('control_freq', '.'),
+        ('gnomad_exomes_freq', '.'),
+        ('gnomad_genomes_freq', '.'),
+        ('parent_alleles', {'mother_tr': '.', 'mother_tc': '.', 'father_tr': '.', 'father_tc': '.'}),
+        ('pop_gnomad_exomes', '.'),
+        ('pop_gnomad_genomes', '.')
+    ]
+
+
+    def __init__(self, detailed, lazy=False):
 
         self.detailed = detailed
+        self.lazy = lazy
         self.filter = []
+        self.checks = sorted(self.CHECKS, key=lambda check: check[2])
 
 
-    def apply_filters(self, var_key, variant, config, data):
-
-        csn_key = (variant['gene'], variant['csn'])
-
-        self.filter = []
+    def apply_filters(self, var_key, variant, config, data, cheap_filter=None):
 
-        try:
+        # The outcome of the cheap checks may be given if they were already run for the variant
+        if cheap_filter is None:
+            cheap_filter = self.cheap_filter(var_key, variant, config, data)
+        self.filter = list(cheap_filter)
 
-            # Check if variant is multiallelic
-            self.check_if_multiallelic(config, data, var_key)
+        if not self.detailed and len(self.filter) > 0:
+            return {'filter': self.filter[0]}
 
-            # Check if variant is called in either parent
-            self.check_if_called_in_parent(data, var_key)
+        values = {'var_key': var_key, 'variant': variant, 'config': config, 'data': data}
 
-            # Check if variant is "low" quality (as flagged by postCAVA)
-            self.check_if_low_quality(variant)
+        try:
 
-            # Check if variant is outside splice site boundary
-            self.check_if_outside_splice_side_boundary(config, variant)
+            # In the lazy detailed mode, expensive annotations are only looked up for variants passing the cheap checks
+            if not (self.lazy and len(self.filter) > 0):
+                self._run_checks(values, False)
 
-            # Check TR in the child
-            self.check_tr_in_child(config, variant)
+            result = {'filter': ','.join(self.filter) if len(self.filter) > 0 else '.'}
+            for key, default in self.RESULT_DEFAULTS:
+                result[key] = values.get(key, default)
+            return result
 
-            # Check TC in the child
-            self.check_tc_in_child(config, variant)
+        except ValueError as err:
 
-            # Check TR/TC in the child
-            self.check_tr_per_tc_in_child(config, variant)
+            return {'filter': str(err)}
 
-            # Check control variant frequency
-            if csn_key[1] == '.':
-                control_freq = data['control_varkey'][var_key] if var_key in data['control_varkey'] else 0.0
-            else:
-                control_freq = data['control_csnkey'][csn_key] if csn_key in data['control_csnkey'] else 0.0
-            self.check_control_frequency(config, control_freq)
 
-            # Check gnomAD exomes variant frequency
-            gnomad_exomes_freq, pop_gnomad_exomes = data['gnomad_exomes_reader'].get_max_frequency(var_key, csn_key)
-            self.check_gnomad_exomes_frequency(config, gnomad_exomes_freq)
+    def cheap_filter(self, var_key, variant, config, data):
 
-            # Check gnomAD genomes variant frequency
-            gnomad_genomes_freq, pop_gnomad_genomes = data['gnomad_genomes_reader'].get_max_frequency(var_key, csn_key)
-            self.check_gnomad_genomes_frequency(config, gnomad_genomes_freq)
+        # Filters set by the cheap checks: all of them in the detailed mode, the first one otherwise
+        self.filter = []
 
-            # Count alleles in parents
-            parent_alleles = helper.count_parent_alleles(data['mother_bam'], data['father_bam'], var_key)
+        values = {'var_key': var_key, 'variant': variant, 'config': config, 'data': data}
 
-            # Check TC and TR in the mother
-            self.check_tc_and_tr_in_mother(config, parent_alleles)
+        try:
+            self._run_checks(values, True)
+        except ValueError as err:
+            return [str(err)]
 
-            # Check TC and TR in the father
-            self.check_tc_and_tr_in_father(config, parent_alleles)
+        return self.filter
 
-            return {
-                'filter': ','.join(self.filter) if len(self.filter) > 0 else '.',
-                'control_freq': control_freq,
-                'gnomad_exomes_freq': gnomad_exomes_freq,
-                'gnomad_genomes_freq': gnomad_genomes_freq,
-                'parent_alleles': parent_alleles,
-                'pop_gnomad_exomes': pop_gnomad_exomes,
-                'pop_gnomad_genomes': pop_gnomad_genomes
-            }
 
-        except ValueError as err:
+    def needs_annotations(self, cheap_filter):
 
-            return {'filter': str(err)}
+        if self.detailed and not self.lazy:
+            return True
+        return len(cheap_filter) == 0
 
 
     # Checks:
@@ -186,7 +213,23 @@ class Filters(object):
         )
 
 
-    # Helper function:
+    # Helper functions:
+
+    def _run_checks(self, values, cheap):
+
+        for name, method, cost, inputs in self.checks:
+
+            if (cost <= CHEAP_CHECK_COST) != cheap:
+                continue
+
+            with profiler.timer('Check {}'.format(name)):
+
+                for input_name in inputs:
+                    if input_name not in values:
+                        getattr(self, self.ANNOTATIONS[input_name])(values)
+
+                getattr(self, method)(*[values[input_name] for input_name in inputs])
+
 
     def _apply(self, condition, txt):
 
@@ -197,16 +240,55 @@ class Filters(object):
                 raise ValueError(txt)
 
 
+    def _gnomad_frequency(self, data, dataset, var_key, csn_key):
 
+        # Use the frequencies precomputed for the current chunk of variants if available
+        precomputed = data.get('gnomad_{}_freqs'.format(dataset))
+        if precomputed is not None and (var_key, csn_key) in precomputed:
+            return precomputed[(var_key, csn_key)]
 
+        return data['gnomad_{}_reader'.format(dataset)].get_max_frequency(var_key, csn_key)
 
 
+    # Annotations:
 
 
+    def _annotate_control_frequency(self, values):
+
+        variant = values['variant']
+        values['control_freq'] = values['data']['control'].get_frequency(
+            values['var_key'],
+            (variant['gene'], variant['csn'])
+        )
 
 
+    def _annotate_gnomad_exomes_frequency(self, values):
 
+        variant = values['variant']
+        values['gnomad_exomes_freq'], values['pop_gnomad_exomes'] = self._gnomad_frequency(
+            values['data'],
+            'exomes',
+            values['var_key'],
+            (variant['gene'], variant['csn'])
+        )
 
 
+    def _annotate_gnomad_genomes_frequency(self, values):
 
+        variant = values['variant']
+        values['gnomad_genomes_freq'], values['pop_gnomad_genomes'] = self._gnomad_frequency(
+            values['data'],
+            'genomes',
+            values['var_key'],
+            (variant['gene'], variant['csn'])
+        )
 
+
+    def _annotate_parent_alleles(self, values):
+
+        data = values['data']
+        values['parent_alleles'] = helper.count_parent_alleles(
+            data['mother_alleles'],
+            data['father_alleles'],
+            values['var_key']
+        )
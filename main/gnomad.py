@@ -1,24 +1,190 @@
 from __future__ import division
+from collections import OrderedDict
+import bisect
 import pysam
+from cache import LRUCache
+import gnomad_index
+from profiling import profiler
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Fields of a gnomAD line accessible by name besides the INFO keys
+RECORD_FIELDS = frozenset(['pos', 'ref', 'alts'])
+
+# Minimum number of alt alleles of a line for computing their frequencies with NumPy
+NUMPY_MIN_ALTS = 2
+
+# Genotype incidence tables by number of alt alleles, built on first use
+_incidence = {}
+_incidence_matrices = {}
 
 
 class GnomadDBReader(object):
 
 
-    def __init__(self, format_fn, exomes=True):
+    # The result cache and the precomputed index are disabled unless enabled in the constructor
+    result_cache = None
+    index = None
+    name = 'gnomAD'
+    csn_window = 100
+
+
+    def __init__(
+        self,
+        format_fn,
+        exomes=True,
+        result_cache_size=100000,
+        use_index=True,
+        max_open_files=8,
+        csn_window=100
+    ):
 
         self.exomes = exomes
+        self.csn_window = csn_window
+        self.name = 'gnomAD exomes' if exomes else 'gnomAD genomes'
 
-        self.tabix_files = {}
-        if exomes:
-            self.tabix_files['_'] = pysam.Tabixfile(format_fn)
+        if result_cache_size > 0:
+            self.result_cache = LRUCache(result_cache_size)
+
+        # Data files by chromosome, or a single file under '_' holding all chromosomes
+        self.file_fns = OrderedDict()
+        if exomes or '{}' not in format_fn:
+            self.file_fns['_'] = format_fn
         else:
             for chrom in map(str, range(1,23)) + ['X']:
-                self.tabix_files[chrom] = pysam.Tabixfile(format_fn.format(chrom))
+                self.file_fns[chrom] = format_fn.format(chrom)
+        self.source_fns = self.file_fns.values()
+
+        # Data files are opened on first use, keeping at most max_open_files of them open
+        self.tabix_files = LRUCache(max_open_files, on_evict=lambda key, tabix_file: tabix_file.close())
+
+        # Frequencies are read from the index built by build-gnomad-index if it is up to date
+        if use_index:
+            self.index = gnomad_index.open_index(gnomad_index.index_fn(format_fn, exomes), self.source_fns)
 
 
     def get_max_frequency(self, var_key, csn_key, variant_frequency=True):
 
+        with profiler.timer('{} lookup'.format(self.name)):
+            return self._get_max_frequency(var_key, csn_key, variant_frequency)
+
+
+    def get_max_frequencies(self, queries, variant_frequency=True, delta=None):
+
+        if delta is None:
+            delta = self.csn_window
+
+        with profiler.timer('{} batch lookup'.format(self.name)):
+            return self._get_max_frequencies(queries, variant_frequency, delta)
+
+
+    def _get_max_frequency(self, var_key, csn_key, variant_frequency):
+
+        if self.result_cache is not None:
+            ret = self.result_cache.get((var_key, csn_key, variant_frequency))
+            if ret is not None:
+                return ret
+
+        ret = self._indexed_max_frequency(var_key, csn_key, variant_frequency, self.csn_window)
+
+        if ret is None:
+            chrom = var_key[0]
+            pos = int(var_key[1])
+
+            # Variants without a CSN only match lines at their exact position
+            if csn_key[1] == '.':
+                variants = self._read_variants_at(chrom, pos)
+            else:
+                variants = self._read_variants_in_vicinity(chrom, pos, self.csn_window)
+
+            ret = self._max_frequency(var_key, csn_key, variants, variant_frequency)
+
+        if self.result_cache is not None:
+            self.result_cache.put((var_key, csn_key, variant_frequency), ret)
+
+        return ret
+
+
+    def _get_max_frequencies(self, queries, variant_frequency, delta):
+
+        ret = {}
+
+        # Each distinct query is looked up once, in the result cache first
+        by_chrom = {}
+        for (var_key, csn_key) in set(queries):
+            if self.result_cache is not None:
+                cached = self.result_cache.get((var_key, csn_key, variant_frequency))
+                if cached is not None:
+                    ret[(var_key, csn_key)] = cached
+                    continue
+            indexed = self._indexed_max_frequency(var_key, csn_key, variant_frequency, delta)
+            if indexed is not None:
+                ret[(var_key, csn_key)] = indexed
+                if self.result_cache is not None:
+                    self.result_cache.put((var_key, csn_key, variant_frequency), indexed)
+                continue
+            by_chrom.setdefault(var_key[0], set()).add((var_key, csn_key))
+
+        for chrom, chrom_queries in by_chrom.iteritems():
+
+            tabix_file = self._tabix_file(chrom)
+
+            # Windows of the queries: the exact position for variants without a CSN, the vicinity otherwise.
+            # Windows starting before the contig start are left to get_max_frequency.
+            chrom_queries = [
+                (_query_window(int(var_key[1]), csn_key, delta), var_key, csn_key) for (var_key, csn_key) in chrom_queries
+            ]
+            chrom_queries = sorted([q for q in chrom_queries if q[0][0] >= 0])
+
+            if tabix_file is None:
+                for (window, var_key, csn_key) in chrom_queries:
+                    ret[(var_key, csn_key)] = (0.0, '.')
+                continue
+
+            # Merge the overlapping windows of the queries into regions
+            regions = []
+            for (window, var_key, csn_key) in chrom_queries:
+                if len(regions) > 0 and window[0] <= regions[-1][1]:
+                    regions[-1][1] = max(regions[-1][1], window[1])
+                    regions[-1][2].append((window, var_key, csn_key))
+                else:
+                    regions.append([window[0], window[1], [(window, var_key, csn_key)]])
+
+            # Read each region once and select the lines falling into the window of each query
+            for (start, end, region_queries) in regions:
+
+                variants = [self._parse_line(line) for line in tabix_file.fetch(chrom, start, end)]
+                profiler.count('{} lines parsed'.format(self.name), len(variants))
+                starts = [flags['pos'] - 1 for (n_alts, flags) in variants]
+                max_ref_length = max([len(flags['ref']) for (n_alts, flags) in variants]) if len(variants) > 0 else 0
+
+                for ((window_start, window_end), var_key, csn_key) in region_queries:
+                    first = bisect.bisect_right(starts, window_start - max_ref_length)
+                    last = bisect.bisect_left(starts, window_end)
+                    window = [
+                        (n_alts, flags) for (n_alts, flags) in variants[first:last]
+                        if flags['pos'] - 1 + len(flags['ref']) > window_start
+                    ]
+                    ret[(var_key, csn_key)] = self._max_frequency(var_key, csn_key, window, variant_frequency)
+                    if self.result_cache is not None:
+                        self.result_cache.put((var_key, csn_key, variant_frequency), ret[(var_key, csn_key)])
+
+        return ret
+
+
+    def cache_stats(self):
+
+        if self.result_cache is None:
+            return []
+        return [('results', self.result_cache.hits, self.result_cache.misses)]
+
+
+    def _max_frequency(self, var_key, csn_key, variants, variant_frequency):
+
         chrom = var_key[0]
         pos = int(var_key[1])
         ref = var_key[2]
@@ -26,7 +192,7 @@ class GnomadDBReader(object):
         gene = csn_key[0]
         csn = csn_key[1]
 
-        for (n_alts, flags) in self._read_variants_in_vicinity(chrom, pos):
+        for (n_alts, flags) in variants:
 
             for i in range(n_alts):
 
@@ -39,59 +205,135 @@ class GnomadDBReader(object):
                     if not any([genes[j] == gene and csns[j] == csn for j in range(len(genes))]):
                         continue
 
-                pops = self._extract_pops(flags)
-                if variant_frequency:
-                    popfreqs = [self._variant_frequency(pop, chrom, flags, n_alts, i) for pop in pops]
-                else:
-                    popfreqs = [float(flags['AF_' + pop].split(',')[i]) for pop in pops]
-                maxfreq = max(popfreqs)
+                return self._alt_max_frequency(chrom, flags, n_alts, i, variant_frequency)
 
-                if maxfreq == 0:
-                    return 0.0, '.'
+        return 0.0, '.'
 
-                return maxfreq, pops[popfreqs.index(maxfreq)]
 
-        return 0.0, '.'
+    def _alt_max_frequency(self, chrom, flags, n_alts, alt_idx, variant_frequency):
 
+        pops = self._extract_pops(flags)
+        if variant_frequency:
+            popfreqs = [self._variant_frequency(pop, chrom, flags, n_alts, alt_idx) for pop in pops]
+        else:
+            popfreqs = [float(flags['AF_' + pop].split(',')[alt_idx]) for pop in pops]
+        maxfreq = max(popfreqs)
+
+        if maxfreq == 0:
+            return 0.0, '.'
+
+        return maxfreq, pops[popfreqs.index(maxfreq)]
+
+
+    def _max_frequencies(self, chrom, flags, n_alts):
+
+        # For a single allele the overhead of NumPy outweighs the batched computation
+        ret = self._max_frequencies_numpy(chrom, flags, n_alts) if n_alts >= NUMPY_MIN_ALTS else None
+        if ret is None:
+            ret = [self._alt_max_frequency(chrom, flags, n_alts, i, True) for i in range(n_alts)]
+        return ret
 
-    def _read_variants_in_vicinity(self, chrom, pos, delta=100):
 
-        if self.exomes:
-            tabix_file = self.tabix_files['_']
+    def _max_frequencies_numpy(self, chrom, flags, n_alts):
+
+        # Frequencies of chrY variants are not computed from genotype counts
+        if numpy is None or chrom in ['Y', 'chrY']:
+            return None
+
+        pops = self._extract_pops(flags)
+        if len(pops) == 0:
+            return None
+
+        if chrom in ['X', 'chrX']:
+            keys = [('GC_' + pop + '_Male', 'GC_' + pop + '_Female') for pop in pops]
         else:
-            if chrom in self.tabix_files:
-                tabix_file = self.tabix_files[chrom]
-            else:
-                return []
+            keys = [('GC_' + pop,) for pop in pops]
 
-        if chrom not in tabix_file.contigs:
-            return []
+        incidence = _incidence_matrix(n_alts)
+        gcs = numpy.zeros((len(pops), incidence.shape[0]), dtype=numpy.int64)
+        for row, pop_keys in enumerate(keys):
+            for key in pop_keys:
+                gc_list = map(int, flags[key].split(','))
+
+                # Lines with unexpected numbers of genotype counts are left to the per-allele computation
+                if len(gc_list) != incidence.shape[0]:
+                    return None
+
+                gcs[row] += gc_list
+
+        # Frequencies of all alleles (columns) in all populations (rows)
+        totals = gcs.sum(axis=1)
+        freqs = numpy.zeros((len(pops), n_alts))
+        numpy.true_divide(100 * gcs.dot(incidence), totals[:, None], out=freqs, where=totals[:, None] > 0)
 
         ret = []
+        for i in range(n_alts):
+            k = int(freqs[:, i].argmax())
+            maxfreq = float(freqs[k, i])
+            ret.append((0.0, '.') if maxfreq == 0 else (maxfreq, pops[k]))
+        return ret
 
-        for line in tabix_file.fetch(chrom, pos - delta, pos + delta):
-            line = line.strip()
-            cols = line.split('\t')
 
-            n_alts = len(cols[4].split(','))
+    def _indexed_max_frequency(self, var_key, csn_key, variant_frequency, delta):
+
+        # The index only holds frequencies computed from genotype counts
+        if self.index is None or not variant_frequency:
+            return None
+        return self.index.get_max_frequency(var_key, csn_key, delta)
 
-            flags = {}
-            for x in cols[7].split(';'):
-                if '=' not in x:
-                    continue
-                k = x[:x.find('=')]
-                v = x[x.find('=') + 1:]
-                flags[k] = v
 
-            flags['pos'] = int(cols[1])
-            flags['ref'] = cols[3]
-            flags['alts'] = cols[4].split(',')
+    def _tabix_file(self, chrom):
 
-            ret.append((n_alts, flags))
+        key = '_' if '_' in self.file_fns else chrom
+        if key not in self.file_fns:
+            return None
+
+        tabix_file = self._open(key)
+
+        if chrom not in tabix_file.contigs:
+            return None
+
+        return tabix_file
+
+
+    def _open(self, key):
+
+        tabix_file = self.tabix_files.get(key)
+        if tabix_file is None:
+            tabix_file = pysam.Tabixfile(self.file_fns[key])
+            self.tabix_files.put(key, tabix_file)
+        return tabix_file
+
+
+    def _read_variants_in_vicinity(self, chrom, pos, delta=100):
+
+        return self._read_variants_in_region(chrom, pos - delta, pos + delta)
+
+
+    def _read_variants_at(self, chrom, pos):
+
+        return self._read_variants_in_region(chrom, pos - 1, pos)
+
+
+    def _read_variants_in_region(self, chrom, start, end):
+
+        tabix_file = self._tabix_file(chrom)
+        if tabix_file is None:
+            return []
+
+        ret = [self._parse_line(line) for line in tabix_file.fetch(chrom, start, end)]
+        profiler.count('{} lines parsed'.format(self.name), len(ret))
 
         return ret
 
 
+    def _parse_line(self, line):
+
+        cols = line.strip().split('\t', 8)
+        alts = cols[4].split(',')
+        return len(alts), GnomadRecord(int(cols[1]), cols[3], alts, cols[7])
+
+
     def _variant_frequency(self, pop, chrom, flags, n_alts, alt_idx):
 
         key = 'GC_' + pop
@@ -108,29 +350,17 @@ class GnomadDBReader(object):
 
     def _gc_to_variant_freqs(self, gc, n_alts, alt_idx):
 
-        ret = []
-
         gc_list = map(int, gc.split(','))
 
-        if sum(gc_list) == 0:
+        total = sum(gc_list)
+        if total == 0:
             return 0.0
 
-        genotypes = self._generate_genotypes(n_alts)
-
-        for i in range(n_alts):
-            N = 0
-            for j in range(len(genotypes)):
-                if i + 1 in genotypes[j]:
-                    N += gc_list[j]
-            ret.append(100 * N / sum(gc_list))
-
-        return ret[alt_idx]
+        return 100 * sum([gc_list[j] for j in _genotype_incidence(n_alts)[alt_idx]]) / total
 
 
     def _gc_mf_to_variant_freqs(self, gc_male, gc_female, n_alts, alt_idx):
 
-        ret = []
-
         gc_list_male = map(int, gc_male.split(','))
         gc_list_female = map(int, gc_female.split(','))
 
@@ -139,29 +369,117 @@ class GnomadDBReader(object):
         if total == 0:
             return 0.0
 
-        genotypes = self._generate_genotypes(n_alts)
-
-        for i in range(n_alts):
-            N_male = 0
-            N_female = 0
-            for j in range(len(genotypes)):
-                if i + 1 in genotypes[j]:
-                    N_male += gc_list_male[j]
-                    N_female += gc_list_female[j]
-            ret.append(100 * (N_male + N_female) / total)
+        genotypes = _genotype_incidence(n_alts)[alt_idx]
+        N_male = sum([gc_list_male[j] for j in genotypes])
+        N_female = sum([gc_list_female[j] for j in genotypes])
 
-        return ret[alt_idx]
+        return 100 * (N_male + N_female) / total
 
 
     def _generate_genotypes(self, n_alts):
 
-        ret = []
-        for a1 in range(n_alts + 1):
-            for a2 in range(a1 + 1):
-                ret.append((a1, a2))
-        return ret
+        return _generate_genotypes(n_alts)
 
 
     def _extract_pops(self, flags):
 
-        return [p for p in ['AFR', 'AMR', 'ASJ', 'EAS', 'FIN', 'NFE', 'OTH', 'SAS'] if 'AF_' + p in flags]
\ No newline at end of file
+        return [p for p in ['AFR', 'AMR', 'ASJ', 'EAS', 'FIN', 'NFE', 'OTH', 'SAS'] if 'AF_' + p in flags]
+
+
+class GnomadRecord(object):
+
+
+    # Line of a gnomAD data file. Only the position and alleles are split off the line, INFO values
+    # are extracted from the raw column when first looked up and cached (including missing keys).
+    __slots__ = ('pos', 'ref', 'alts', 'info', 'values')
+
+
+    def __init__(self, pos, ref, alts, info):
+
+        self.pos = pos
+        self.ref = ref
+        self.alts = alts
+        self.info = info
+        self.values = None
+
+
+    def __getitem__(self, key):
+
+        if key in RECORD_FIELDS:
+            return getattr(self, key)
+
+        value = self._value(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+
+    def __contains__(self, key):
+
+        return key in RECORD_FIELDS or self._value(key) is not None
+
+
+    def _value(self, key):
+
+        if self.values is None:
+            self.values = {}
+        elif key in self.values:
+            return self.values[key]
+
+        value = _info_value(self.info, key)
+        self.values[key] = value
+        return value
+
+
+def _info_value(info, key):
+
+    # The last occurrence of a key wins, as when all fields are read into a dict
+    prefix = key + '='
+    i = info.rfind(';' + prefix)
+    if i != -1:
+        start = i + len(prefix) + 1
+    elif info.startswith(prefix):
+        start = len(prefix)
+    else:
+        return None
+
+    end = info.find(';', start)
+    return info[start:] if end == -1 else info[start:end]
+
+
+def _query_window(pos, csn_key, delta):
+
+    if csn_key[1] == '.':
+        return (pos - 1, pos)
+    return (pos - delta, pos + delta)
+
+
+def _generate_genotypes(n_alts):
+
+    ret = []
+    for a1 in range(n_alts + 1):
+        for a2 in range(a1 + 1):
+            ret.append((a1, a2))
+    return ret
+
+
+def _genotype_incidence(n_alts):
+
+    # Indices of the genotypes carrying each alt allele, in the order of the GC_ counts
+    if n_alts not in _incidence:
+        genotypes = _generate_genotypes(n_alts)
+        _incidence[n_alts] = [
+            [j for j in range(len(genotypes)) if i + 1 in genotypes[j]] for i in range(n_alts)
+        ]
+    return _incidence[n_alts]
+
+
+def _incidence_matrix(n_alts):
+
+    # Genotypes (rows) carrying each alt allele (columns)
+    if n_alts not in _incidence_matrices:
+        matrix = numpy.zeros((len(_generate_genotypes(n_alts)), n_alts), dtype=numpy.int64)
+        for i, genotypes in enumerate(_genotype_incidence(n_alts)):
+            matrix[genotypes, i] = 1
+        _incidence_matrices[n_alts] = matrix
+    return _incidence_matrices[n_alts]
@@ -0,0 +1,178 @@
+import os
+import sqlite3
+
+
+# Suffix of the index file built next to a gnomAD data file
+INDEX_SUFFIX = '.denovo.sqlite'
+
+# Version of the index schema, indexes of other versions are ignored
+SCHEMA_VERSION = 1
+
+# Number of rows inserted in one statement while building an index
+INSERT_BATCH_SIZE = 10000
+
+
+class GnomadIndex(object):
+
+
+    def __init__(self, fn):
+
+        self.conn = sqlite3.connect(fn)
+        self.conn.text_factory = str
+
+
+    def get_max_frequency(self, var_key, csn_key, delta):
+
+        chrom = var_key[0]
+        pos = int(var_key[1])
+
+        # The first matching allele in file order wins, as when scanning the vicinity of the variant
+        if csn_key[1] == '.':
+            row = self.conn.execute(
+                'SELECT maxfreq, pop FROM varkey WHERE chrom=? AND pos=? AND ref=? AND alt=? ORDER BY seq LIMIT 1',
+                (chrom, pos, var_key[2], var_key[3])
+            ).fetchone()
+        else:
+            row = self.conn.execute(
+                'SELECT maxfreq, pop FROM csn WHERE gene=? AND csn=? AND chrom=? AND start<? AND end>? ORDER BY seq LIMIT 1',
+                (csn_key[0], csn_key[1], chrom, pos + delta, pos - delta)
+            ).fetchone()
+
+        if row is None:
+            return 0.0, '.'
+
+        # Alleles whose frequency could not be precomputed are looked up in the data file
+        if row[0] is None:
+            return None
+
+        return row[0], row[1]
+
+
+    def close(self):
+
+        self.conn.close()
+
+
+def index_fn(format_fn, exomes=True):
+
+    if exomes:
+        return format_fn + INDEX_SUFFIX
+    return format_fn.replace('{}', 'all') + INDEX_SUFFIX
+
+
+def open_index(fn, source_fns):
+
+    if not os.path.isfile(fn):
+        return None
+
+    index = GnomadIndex(fn)
+
+    # Indexes built from other versions of the data files are not used
+    try:
+        meta = dict(index.conn.execute('SELECT key, value FROM meta'))
+    except sqlite3.DatabaseError:
+        meta = {}
+    if meta != _meta(source_fns):
+        index.close()
+        return None
+
+    return index
+
+
+def build(reader, fn):
+
+    tmp_fn = '{}.{}.tmp'.format(fn, os.getpid())
+    if os.path.isfile(tmp_fn):
+        os.remove(tmp_fn)
+
+    conn = sqlite3.connect(tmp_fn)
+    conn.text_factory = str
+    conn.execute('PRAGMA journal_mode=OFF')
+    conn.execute('PRAGMA synchronous=OFF')
+    conn.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)')
+    conn.execute('CREATE TABLE varkey (chrom TEXT, pos INTEGER, ref TEXT, alt TEXT, seq INTEGER, maxfreq REAL, pop TEXT)')
+    conn.execute(
+        'CREATE TABLE csn (gene TEXT, csn TEXT, chrom TEXT, start INTEGER, end INTEGER, seq INTEGER, maxfreq REAL, pop TEXT)'
+    )
+
+    varkey_rows = []
+    csn_rows = []
+    seq = 0
+
+    for (chrom, line) in _iter_lines(reader):
+
+        n_alts, flags = reader._parse_line(line)
+        start = flags['pos'] - 1
+        end = start + len(flags['ref'])
+
+        # Frequencies of all alleles of the line are computed together when possible
+        try:
+            line_freqs = reader._max_frequencies(chrom, flags, n_alts)
+        except (KeyError, IndexError, ValueError):
+            line_freqs = None
+
+        for i in range(n_alts):
+
+            seq += 1
+
+            if line_freqs is not None:
+                maxfreq, pop = line_freqs[i]
+            else:
+                try:
+                    maxfreq, pop = reader._alt_max_frequency(chrom, flags, n_alts, i, True)
+                except (KeyError, IndexError, ValueError):
+                    maxfreq, pop = None, None
+
+            varkey_rows.append((chrom, flags['pos'], flags['ref'], flags['alts'][i], seq, maxfreq, pop))
+
+            if 'GENE' in flags and 'CSN' in flags:
+                genes = flags['GENE'].split(',')[i].split(':')
+                csns = flags['CSN'].split(',')[i].split(':')
+                for (gene, csn) in set(zip(genes, csns)):
+                    csn_rows.append((gene, csn, chrom, start, end, seq, maxfreq, pop))
+
+        if len(varkey_rows) >= INSERT_BATCH_SIZE:
+            _insert(conn, varkey_rows, csn_rows)
+            varkey_rows = []
+            csn_rows = []
+
+    _insert(conn, varkey_rows, csn_rows)
+
+    conn.execute('CREATE INDEX varkey_idx ON varkey (chrom, pos, ref, alt)')
+    conn.execute('CREATE INDEX csn_idx ON csn (gene, csn, chrom)')
+    conn.executemany('INSERT INTO meta VALUES (?, ?)', _meta(reader.source_fns).items())
+    conn.commit()
+    conn.close()
+
+    os.rename(tmp_fn, fn)
+
+    return seq
+
+
+def _iter_lines(reader):
+
+    for key in reader.file_fns:
+        tabix_file = reader._open(key)
+        for chrom in tabix_file.contigs:
+
+            # Each per-chromosome file is only queried for its own chromosome
+            if key != '_' and chrom != key:
+                continue
+
+            for line in tabix_file.fetch(chrom):
+                yield chrom, line
+
+
+def _insert(conn, varkey_rows, csn_rows):
+
+    conn.executemany('INSERT INTO varkey VALUES (?, ?, ?, ?, ?, ?, ?)', varkey_rows)
+    conn.executemany('INSERT INTO csn VALUES (?, ?, ?, ?, ?, ?, ?, ?)', csn_rows)
+
+
+def _meta(source_fns):
+
+    ret = {'schema_version': str(SCHEMA_VERSION)}
+    for fn in source_fns:
+        st = os.stat(fn)
+        ret['source:' + os.path.abspath(fn)] = '{}:{}'.format(st.st_size, int(st.st_mtime))
+    return ret
@@ -1,10 +1,13 @@
 from __future__ import division
+from collections import OrderedDict
+import copy
 import sys
 import alleles
+import control
 import parsers
-import pysam
 import gnomad
 import maxentscan
+import variantkeys
 
 
 def read_data(options, config):
@@ -15,56 +18,195 @@ def read_data(options, config):
     ret = {}
 
     # Read variant data of the three individuals
-    ret['child_var'] = parsers.read_vcf_file(options.child_var)
-    ret['mother_var'] = parsers.read_vcf_file(options.mother_var)
-    ret['father_var'] = parsers.read_vcf_file(options.father_var)
+    child_keys = read_variants(options, config, ret)
 
-    # Create list of multiallelic calls in the child
-    ret['multiallelic_calls'] = find_multiallelic_calls(ret['child_var'])
+    # Connect to BAM files and gnomAD databases
+    connect(options, config, ret)
 
-    # Connect to BAM files of the mother and the father
-    ret['mother_bam'] = pysam.AlignmentFile(options.mother_bam, "rb")
-    ret['father_bam'] = pysam.AlignmentFile(options.father_bam, "rb")
+    # Read control data of the child's variants, MaxEntScan and ExAC data
+    if ret['child_var'] is not None:
+        csn_keys = set([(v['gene'], v['csn']) for variants in ret['child_var'].itervalues() for v in variants])
+    else:
+        csn_keys = None
+    read_reference_data(config, ret, child_keys, csn_keys)
 
-    # Create GnomadDBReader objects for both gnomAD exomes and genomes
-    ret['gnomad_exomes_reader'] = gnomad.GnomadDBReader(config['GNOMAD_EXOMES_DATA_FILE'])
-    ret['gnomad_genomes_reader'] = gnomad.GnomadDBReader(config['GNOMAD_GENOMES_DATA_FILE'], exomes=False)
+    print ' - Done.'
+
+    return ret
+
+
+def read_shared_data(config):
+
+    # Data shared by all trios of a batch, the control data is read for all variants
+    ret = {}
+    connect_databases(config, ret)
+    read_reference_data(config, ret)
+    return ret
+
+
+def read_trio_data(options, config, shared):
+
+    ret = dict(shared)
+    read_variants(options, config, ret)
+    connect_bams(options, config, ret)
+    return ret
+
+
+def read_variants(options, config, data):
+
+    if options.streaming:
+        # The variants of the child are only read when they are streamed, so their number is not known. Multiallelic
+        # calls are found in each chunk, which holds all records of a position of the sorted VCF file.
+        child_keys = data['child_var'] = None
+        data['child_var_count'] = None
+        data['multiallelic_calls'] = None
+    else:
+        child_keys = data['child_var'] = parsers.read_vcf_file(options.child_var)
+        data['child_var_count'] = len(data['child_var'])
+
+        # Create list of multiallelic calls in the child
+        data['multiallelic_calls'] = find_multiallelic_calls(child_keys)
+
+    # Only the variant keys of the parents are needed
+    cache_dir = config['PARENT_INDEX_CACHE_DIR'] if config['PARENT_INDEX_CACHE_DIR'] != '' else None
+    data['mother_var'] = variantkeys.load(options.mother_var, cache_dir)
+    data['father_var'] = variantkeys.load(options.father_var, cache_dir)
+
+    return child_keys
+
+
+def read_reference_data(config, data, var_keys=None, csn_keys=None):
 
     # Read control data
-    ret['control_csnkey'] = parsers.read_custom_database_file_by_csnkey(config['CONTROL_DATA_FILE'])
-    ret['control_varkey'] = parsers.read_custom_database_file_by_varkey(config['CONTROL_DATA_FILE'])
+    data['control'] = control.open_control_data(config['CONTROL_DATA_FILE'], var_keys, csn_keys)
 
-    # Read MaxEntScan data
+    # Read MaxEntScan data of the child's variants
     fn = config['MAXENTSCAN_DATA_FILE']
-    ret['maxentscan'] = maxentscan.MaxEntScanData(fn) if fn != '' else None
+    data['maxentscan'] = maxentscan.open_maxentscan_data(fn, var_keys) if fn != '' else None
 
     # Read ExAC data
     fn = config['EXAC_DATA_FILE']
-    ret['exac'] = parsers.read_exac_data_file(fn) if fn != '' else None
+    data['exac'] = parsers.read_exac_data_file(fn) if fn != '' else None
+
+
+def connect(options, config, data):
+
+    connect_bams(options, config, data)
+    connect_databases(config, data)
 
-    print ' - Done.'
 
+def connect_bams(options, config, data):
+
+    # Connect to BAM files of the mother and the father
+    cache_fn = config['ALLELE_COUNT_CACHE_FILE'] if config['ALLELE_COUNT_CACHE_FILE'] != '' else None
+    engine = config['ALLELE_COUNTING_ENGINE']
+    data['mother_alleles'] = alleles.AlleleCounter(options.mother_bam, cache_fn, engine, 'Mother BAM')
+    data['father_alleles'] = alleles.AlleleCounter(options.father_bam, cache_fn, engine, 'Father BAM')
+
+
+def connect_databases(config, data):
+
+    # Create GnomadDBReader objects for both gnomAD exomes and genomes
+    data['gnomad_exomes_reader'] = gnomad.GnomadDBReader(
+        config['GNOMAD_EXOMES_DATA_FILE'],
+        csn_window=config['GNOMAD_CSN_WINDOW']
+    )
+    data['gnomad_genomes_reader'] = gnomad.GnomadDBReader(
+        config['GNOMAD_GENOMES_DATA_FILE'],
+        exomes=False,
+        csn_window=config['GNOMAD_CSN_WINDOW']
+    )
+
+    # Tabix-indexed control and MaxEntScan files opened before a fork are opened again
+    if isinstance(data.get('control'), control.ControlDBReader):
+        data['control'] = control.ControlDBReader(data['control'].fn, data['control'].delta)
+    if isinstance(data.get('maxentscan'), maxentscan.MaxEntScanDBReader):
+        data['maxentscan'] = maxentscan.MaxEntScanDBReader(data['maxentscan'].fn)
+
+
+def trio_options(options, trio):
+
+    # Options of a trio of a batch, whose variants are filtered in a single process
+    ret = copy.copy(options)
+    for key, value in trio.iteritems():
+        setattr(ret, key, value)
+    ret.trios = None
+    ret.processes = 1
     return ret
 
 
-def count_parent_alleles(mother_bam, father_bam, var_key):
+def count_parent_alleles(mother_alleles, father_alleles, var_key):
 
     ret = {}
-    ret['mother_tc'], ret['mother_tr'] = alleles.count(mother_bam, var_key)
-    ret['father_tc'], ret['father_tr'] = alleles.count(father_bam, var_key)
+    ret['mother_tc'], ret['mother_tr'] = mother_alleles.count(var_key)
+    ret['father_tc'], ret['father_tr'] = father_alleles.count(var_key)
     return ret
 
 
+def cache_stats(data):
+
+    ret = OrderedDict()
+    for (name, key) in [
+        ('gnomAD exomes', 'gnomad_exomes_reader'),
+        ('gnomAD genomes', 'gnomad_genomes_reader'),
+        ('Mother BAM', 'mother_alleles'),
+        ('Father BAM', 'father_alleles')
+    ]:
+        for (cache_name, hits, misses) in data[key].cache_stats():
+            ret['{} {}'.format(name, cache_name)] = [hits, misses]
+    return ret
+
+
+def merge_cache_stats(total, stats):
+
+    for name, (hits, misses) in stats.iteritems():
+        if name not in total:
+            total[name] = [0, 0]
+        total[name][0] += hits
+        total[name][1] += misses
+
+
 def find_multiallelic_calls(var_data):
 
     counts = {}
-    for var_key in var_data.keys():
+    for var_key in var_data:
         k = var_key[:3]
         if k not in counts:
             counts[k] = 1
         else:
             counts[k] += 1
-    return [x for x in counts.keys() if counts[x] > 1]
+    return set([x for x in counts.keys() if counts[x] > 1])
+
+
+def chunk_by_chromosome(variants, max_size):
+
+    # The records of a position are kept in the same chunk, even if it gets larger than max_size
+    chunk = []
+    for var_key, value in variants:
+        if len(chunk) > 0 and (chunk[-1][0][0] != var_key[0] or (len(chunk) >= max_size and chunk[-1][0][1] != var_key[1])):
+            yield chunk
+            chunk = []
+        chunk.append((var_key, value))
+
+    if len(chunk) > 0:
+        yield chunk
+
+
+def check_sorted(variants):
+
+    # Records of a position are only consecutive if the variants are sorted by position within each chromosome
+    # and the records of each chromosome are together
+    chroms = set()
+    prev = None
+    for var_key, value in variants:
+        if prev is None or var_key[0] != prev[0]:
+            if var_key[0] in chroms:
+                raise ValueError('Variants are not sorted, records of chromosome {} are not together'.format(var_key[0]))
+            chroms.add(var_key[0])
+        elif int(var_key[1]) < int(prev[1]):
+            raise ValueError('Variants are not sorted by position: {}:{} after {}:{}'.format(var_key[0], var_key[1], prev[0], prev[1]))
+        prev = var_key
+        yield var_key, value
 
 
 def within_splice_site_boundary(csn, cutoff):
@@ -113,9 +255,63 @@ def _split_to_exon_and_intron_coordinates(coord_part):
     return exonpart, intronpart
 
 
-def output_header_simplified(outfile):
-
-    header = [
+# Keys of the MaxEntScan scores and the ExAC values written to the output
+MAXENTSCAN_KEYS = [
+    'RefKnown5',
+    'RefKnown3',
+    'AltKnown',
+    'AltHighest5',
+    'RefHighest5',
+    'AltHighest3',
+    'RefHighest3',
+    'Boundary5',
+    'Boundary3',
+    'PI5',
+    'PI3',
+    'RefKnown',
+    'SpliceSiteScore',
+    'SpliceSiteType',
+    'PercentReduction',
+    'MAX5',
+    'MAX3'
+]
+
+EXAC_KEYS = [
+    'N_missense',
+    'Exp_missense',
+    'Z_missense',
+    'N_lof',
+    'Exp_lof',
+    'pLI',
+]
+
+# Types of the output columns in the columnar output formats, all other columns are strings
+OUTPUT_COLUMN_TYPES = {
+    'POS': 'int',
+    'Filter': 'dictionary',
+    'gnomAD_exomes_frequency': 'float',
+    'gnomAD_genomes_frequency': 'float',
+    'Control_frequency': 'float',
+    'Child_TR': 'int',
+    'Child_TC': 'int',
+    'Child_NF': 'int',
+    'Child_NR': 'int',
+    'Mother_TR': 'int',
+    'Mother_TC': 'int',
+    'Father_TR': 'int',
+    'Father_TC': 'int',
+    'ExAC_N_missense': 'int',
+    'ExAC_Exp_missense': 'float',
+    'ExAC_Z_missense': 'float',
+    'ExAC_N_lof': 'int',
+    'ExAC_Exp_lof': 'float',
+    'ExAC_pLI': 'float'
+}
+
+
+def output_columns_simplified():
+
+    return [
         'CHROM',
         'POS',
         'REF',
@@ -124,12 +320,11 @@ def output_header_simplified(outfile):
         'CSN',
         'Filter'
     ]
-    outfile.write('\t'.join(header)+'\n')
 
 
-def output_header(outfile, maxentscan_columns, exac_columns, output_filter_column):
+def output_columns(maxentscan_columns, exac_columns, output_filter_column):
 
-    header = [
+    columns = [
         'CHROM',
         'POS',
         'REF',
@@ -142,9 +337,9 @@ def output_header(outfile, maxentscan_columns, exac_columns, output_filter_colum
     ]
 
     if output_filter_column:
-        header.append('Filter')
+        columns.append('Filter')
 
-    header += [
+    columns += [
         'gnomAD_exomes_frequency',
         'Population_gnomAD_exomes',
         'gnomAD_genomes_frequency',
@@ -159,47 +354,38 @@ def output_header(outfile, maxentscan_columns, exac_columns, output_filter_colum
         'Father_TR',
         'Father_TC'
     ]
+
     if maxentscan_columns:
-        header += [
-            'MaxEntScan_RefKnown5',
-            'MaxEntScan_RefKnown3',
-            'MaxEntScan_AltKnown',
-            'MaxEntScan_AltHighest5',
-            'MaxEntScan_RefHighest5',
-            'MaxEntScan_AltHighest3',
-            'MaxEntScan_RefHighest3',
-            'MaxEntScan_Boundary5',
-            'MaxEntScan_Boundary3',
-            'MaxEntScan_PI5',
-            'MaxEntScan_PI3',
-            'MaxEntScan_RefKnown',
-            'MaxEntScan_SpliceSiteScore',
-            'MaxEntScan_SpliceSiteType',
-            'MaxEntScan_PercentReduction',
-            'MaxEntScan_MAX5',
-            'MaxEntScan_MAX3'
-        ]
+        columns += ['MaxEntScan_' + key for key in MAXENTSCAN_KEYS]
 
     if exac_columns:
-        header += [
-            'ExAC_N_missense',
-            'ExAC_Exp_missense',
-            'ExAC_Z_missense',
-            'ExAC_N_lof',
-            'ExAC_Exp_lof',
-            'ExAC_pLI',
-        ]
+        columns += ['ExAC_' + key for key in EXAC_KEYS]
+
+    return columns
+
+
+def output_header_simplified(outfile):
+
+    outfile.write_header(output_columns_simplified())
+
+
+def output_header(outfile, maxentscan_columns, exac_columns, output_filter_column):
 
-    outfile.write('\t'.join(header)+'\n')
+    outfile.write_header(output_columns(maxentscan_columns, exac_columns, output_filter_column))
 
 
 def output_simplified(out, var_key, variant, result):
 
-    out.write('\t'.join(list(var_key[:4])+[variant['gene'], variant['csn'], result['filter']]) + '\n')
+    out.write_record(list(var_key[:4])+[variant['gene'], variant['csn'], result['filter']])
 
 
 def output(outfile, var_key, data, result, maxentscan_scores, exac_values, output_filter_column):
 
+    outfile.write_record(output_record(var_key, data, result, maxentscan_scores, exac_values, output_filter_column))
+
+
+def output_record(var_key, data, result, maxentscan_scores, exac_values, output_filter_column):
+
     (chrom, pos, ref, alt) = var_key
 
     record = [
@@ -217,6 +403,7 @@ def output(outfile, var_key, data, result, maxentscan_scores, exac_values, outpu
     if output_filter_column:
         record.append(result['filter'])
 
+    parent_alleles = result['parent_alleles']
     record += [
         result['gnomad_exomes_freq'],
         result['pop_gnomad_exomes'],
@@ -227,55 +414,25 @@ def output(outfile, var_key, data, result, maxentscan_scores, exac_values, outpu
         data['TC'],
         data['NF'],
         data['NR'],
-        result['parent_alleles']['mother_tr'],
-        result['parent_alleles']['mother_tc'],
-        result['parent_alleles']['father_tr'],
-        result['parent_alleles']['father_tc']
+        parent_alleles['mother_tr'],
+        parent_alleles['mother_tc'],
+        parent_alleles['father_tr'],
+        parent_alleles['father_tc']
     ]
 
     if maxentscan_scores is not None:
-        maxentscan_columns = [
-            'RefKnown5',
-            'RefKnown3',
-            'AltKnown',
-            'AltHighest5',
-            'RefHighest5',
-            'AltHighest3',
-            'RefHighest3',
-            'Boundary5',
-            'Boundary3',
-            'PI5',
-            'PI3',
-            'RefKnown',
-            'SpliceSiteScore',
-            'SpliceSiteType',
-            'PercentReduction',
-            'MAX5',
-            'MAX3'
-        ]
         if maxentscan_scores != {}:
-            for c in maxentscan_columns:
-                record.append(maxentscan_scores[c])
+            record += [maxentscan_scores[c] for c in MAXENTSCAN_KEYS]
         else:
-            record += ['.'] * len(maxentscan_columns)
+            record += ['.'] * len(MAXENTSCAN_KEYS)
 
     if exac_values is not None:
-        exac_columns = [
-            'N_missense',
-            'Exp_missense',
-            'Z_missense',
-            'N_lof',
-            'Exp_lof',
-            'pLI',
-        ]
         if exac_values != {}:
-            for c in exac_columns:
-                record.append(exac_values[c])
+            record += [exac_values[c] for c in EXAC_KEYS]
         else:
-            record += ['.'] * len(exac_columns)
+            record += ['.'] * len(EXAC_KEYS)
 
-    record = [str(round(x, 2)) if type(x)==float else str(x) for x in record]
-    outfile.write('\t'.join(record)+'\n')
+    return record
 
 
 def welcome(version):
@@ -283,10 +440,32 @@ def welcome(version):
     print '\n{} DeNovoFilter {} {}'.format('='*3, version, '='*80)
 
 
-def goodbye(counter_denovo, counter_filtered, output_prefix, runtime):
+def goodbye(counter_denovo, counter_filtered, output_prefix, runtime, cache_stats=None, profile_fn=None, output_ext='.txt'):
+
+    print '\nNumber of de novo candidates: {}  ({}_denovo_candidates{})'.format(counter_denovo, output_prefix, output_ext)
+    print 'Number of variants filtered out: {}  ({}_filtered_out{})'.format(counter_filtered, output_prefix, output_ext)
 
-    print '\nNumber of de novo candidates: {}  ({}_denovo_candidates.txt)'.format(counter_denovo, output_prefix)
-    print 'Number of variants filtered out: {}  ({}_filtered_out.txt)'.format(counter_filtered, output_prefix)
+    _goodbye_details(runtime, cache_stats, profile_fn)
+
+
+def goodbye_trios(counter_trios, counter_denovo, counter_filtered, runtime, cache_stats=None, profile_fn=None):
+
+    print '\nNumber of trios: {}'.format(counter_trios)
+    print 'Number of de novo candidates: {}'.format(counter_denovo)
+    print 'Number of variants filtered out: {}'.format(counter_filtered)
+
+    _goodbye_details(runtime, cache_stats, profile_fn)
+
+
+def _goodbye_details(runtime, cache_stats, profile_fn):
+
+    if cache_stats:
+        print '\nCache hits / misses:'
+        for name, (hits, misses) in cache_stats.iteritems():
+            print '  {}: {} / {}'.format(name, hits, misses)
+
+    if profile_fn is not None:
+        print '\nProfile report: {}'.format(profile_fn)
 
     runtime = runtime[:runtime.find('.')]
     print '\n Finished in: {}'.format(runtime)
@@ -302,6 +481,12 @@ def init_progress():
 
 def print_progress(counter, total):
 
+    # The number of variants is not known when they are streamed
+    if total is None:
+        sys.stdout.write('\rProcessing variants ... {}'.format(counter))
+        sys.stdout.flush()
+        return
+
     x = round(100 * counter / total, 1)
     x = min(x, 100.0)
     sys.stdout.write('\rProcessing variants ... {}%'.format(x))
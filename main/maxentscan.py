@@ -1,71 +1,98 @@
-from collections import OrderedDict
+import os
+import pysam
+import fileio
+
+
+# Columns of a MaxEntScan data file
+HEADER = [
+    'CHROM', 'POS', 'REF', 'ALT', 'ENST', 'GENE', 'LOC', 'CSN', 'CLASS', 'RefKnown5', 'RefKnown3',
+    'AltKnown', 'AltHighest5', 'RefHighest5', 'AltHighest3', 'RefHighest3', 'Boundary5', 'Boundary3'
+]
+
+# Score columns copied to the output as they are
+SCORE_KEYS = [
+    'RefKnown5', 'RefKnown3', 'AltKnown', 'AltHighest5', 'RefHighest5', 'AltHighest3', 'RefHighest3',
+    'Boundary5', 'Boundary3'
+]
+
+# Variants closer to each other than this are looked up in the indexed file in one region
+REGION_GAP = 1000
+
+
+def open_maxentscan_data(fn, var_keys=None):
+
+    # A bgzipped and tabix-indexed MaxEntScan file is queried by region instead of being loaded
+    if os.path.isfile(fn + '.tbi'):
+        return MaxEntScanDBReader(fn)
+    return MaxEntScanData(fn, var_keys)
+
+
+def is_snv(key):
+
+    return len(key[2]) == 1 and len(key[3]) == 1
 
 
 class MaxEntScanData(object):
 
 
-    def __init__(self, fn):
+    # Only substitutions are scored, so only their lines are kept, and only those of the given variant keys if any
+    def __init__(self, fn, var_keys=None):
 
-        self.data = self._parse_data_file(fn)
+        self.data = self._parse_data_file(fn, var_keys)
 
 
-    def _parse_data_file(self, fn):
+    def _parse_data_file(self, fn, var_keys=None):
 
         ret = {}
 
-        header = [
-            'CHROM', 'POS', 'REF', 'ALT', 'ENST', 'GENE', 'LOC', 'CSN', 'CLASS', 'RefKnown5', 'RefKnown3',
-            'AltKnown', 'AltHighest5', 'RefHighest5', 'AltHighest3', 'RefHighest3', 'Boundary5', 'Boundary3'
-        ]
-
-        for line in open(fn):
+        for line in fileio.open_text(fn):
             line = line.strip()
             if line == '' or line[0] == '#' or line.upper().startswith('CHROM'):
                 continue
             cols = line.split('\t')
 
-            values = OrderedDict()
-            for i in range(len(header)):
-                values[header[i]] = cols[i]
-
             key = tuple(cols[:4])
-            ret[key] = values
+            if not is_snv(key) or (var_keys is not None and key not in var_keys):
+                continue
+            ret[key] = _values(cols)
 
         return ret
 
 
+    def prefetch(self, var_keys):
+
+        # All needed lines are already in memory
+        pass
+
+
+    def _record(self, key):
+
+        return self.data.get(key)
+
+
     def get_scores(self, key):
 
-        if not (len(key[2]) == 1 and len(key[3]) == 1):
+        if not is_snv(key):
             return {}
 
-        if key not in self.data:
+        values = self._record(key)
+        if values is None:
             return {}
 
+        d = dict(zip(HEADER, values))
+
         ret = {}
 
-        for k in [
-            'RefKnown5',
-            'RefKnown3',
-            'AltKnown',
-            'AltHighest5',
-            'RefHighest5',
-            'AltHighest3',
-            'RefHighest3',
-            'Boundary5',
-            'Boundary3'
-        ]:
-            ret[k] = self.data[key][k]
-
-        ret['PI5'] = self._pi5(key)
-        ret['PI3'] = self._pi3(key)
-        ret.update(self._process_maxentscan_data(key))
-        return ret
+        for k in SCORE_KEYS:
+            ret[k] = d[k]
 
+        ret['PI5'] = self._pi5(d)
+        ret['PI3'] = self._pi3(d)
+        ret.update(self._process_maxentscan_data(d))
+        return ret
 
-    def _pi5(self, key):
 
-        d = self.data[key]
+    def _pi5(self, d):
 
         Alt5 = '.' if d['AltKnown'] != '.' else d['AltHighest5']
 
@@ -84,9 +111,7 @@ class MaxEntScanData(object):
         return min(100, tmp)
 
 
-    def _pi3(self, key):
-
-        d = self.data[key]
+    def _pi3(self, d):
 
         Alt3 = '.' if d['AltKnown'] != '.' else d['AltHighest3']
 
@@ -105,14 +130,13 @@ class MaxEntScanData(object):
         return min(100, tmp)
 
 
-    def _process_maxentscan_data(self, key):
+    def _process_maxentscan_data(self, d):
 
         ret = {}
-        ret['RefKnown'] = self._ref_known(key)
+        ret['RefKnown'] = self._ref_known(d)
         ret['SpliceSiteScore'] = ret['RefKnown']
         ret['SpliceSiteType'] = 'spliceSiteRegion' if ret['SpliceSiteScore'] != '.' else '.'
-        ret['PercentReduction'] = self._percent_reduction(ret['RefKnown'], key)
-        d = self.data[key]
+        ret['PercentReduction'] = self._percent_reduction(ret['RefKnown'], d)
         if d['AltKnown'] != '.':
             ret['MAX5'] = '.'
             ret['MAX3'] = '.'
@@ -122,9 +146,7 @@ class MaxEntScanData(object):
         return ret
 
 
-    def _ref_known(self, key):
-
-        d = self.data[key]
+    def _ref_known(self, d):
 
         if d['AltKnown'] == '.':
             return '.'
@@ -145,9 +167,7 @@ class MaxEntScanData(object):
                 return 'check'
 
 
-    def _percent_reduction(self, ref_known, key):
-
-        d = self.data[key]
+    def _percent_reduction(self, ref_known, d):
 
         if d['AltKnown'] == '.':
             return '.'
@@ -167,9 +187,70 @@ class MaxEntScanData(object):
         return round(100 * x / y, 2)
 
 
+class MaxEntScanDBReader(MaxEntScanData):
+
+
+    # Lines are fetched from the indexed file when needed, those of the variants of a chunk in a few regions
+    def __init__(self, fn):
+
+        self.fn = fn
+        self.tabix_file = pysam.Tabixfile(fn)
+        self.data = {}
+
+
+    def prefetch(self, var_keys):
 
+        # Lines of the previous chunk are dropped, so that memory does not grow with the number of variants
+        self.data = {}
 
+        by_chrom = {}
+        for key in set(var_keys):
+            if is_snv(key) and key[0] in self.tabix_file.contigs:
+                by_chrom.setdefault(key[0], set()).add(key)
 
+        for chrom, keys in by_chrom.iteritems():
+            for (start, end) in _regions(sorted(int(key[1]) for key in keys)):
+                for line in self.tabix_file.fetch(chrom, start - 1, end):
+                    cols = line.strip().split('\t')
+                    key = tuple(cols[:4])
+                    if key in keys:
+                        self.data[key] = _values(cols)
+
+            # Variants without a line are not looked up again
+            for key in keys:
+                self.data.setdefault(key, None)
+
+
+    def _record(self, key):
+
+        if key in self.data:
+            return self.data[key]
+
+        ret = None
+        if key[0] in self.tabix_file.contigs:
+            pos = int(key[1])
+            for line in self.tabix_file.fetch(key[0], pos - 1, pos):
+                cols = line.strip().split('\t')
+                if tuple(cols[:4]) == key:
+                    ret = _values(cols)
+        self.data[key] = ret
+        return ret
+
+
+def _regions(positions):
+
+    # Sorted positions are merged into regions of nearby positions
+    ret = []
+    for pos in positions:
+        if ret and pos - ret[-1][1] <= REGION_GAP:
+            ret[-1][1] = pos
+        else:
+            ret.append([pos, pos])
+    return ret
 
 
+def _values(cols):
 
+    if len(cols) < len(HEADER):
+        raise ValueError('MaxEntScan data line with {} columns instead of {}'.format(len(cols), len(HEADER)))
+    return tuple(cols[:len(HEADER)])
@@ -0,0 +1,164 @@
+from collections import deque
+import multiprocessing
+import os
+import helper
+import filters
+from profiling import profiler
+
+
+# State of the current worker process
+_worker = {}
+
+# Seconds between checks that the worker process running a trio is still alive
+WORKER_CHECK_INTERVAL = 1.0
+
+
+class WorkerLostError(Exception):
+
+    pass
+
+
+def imap_chunks(process_fn, chunks, options, config, data, cache_stats):
+
+    # Worker processes are forked, so the input data is inherited rather than pickled
+    pool = multiprocessing.Pool(
+        processes=options.processes,
+        initializer=_init_worker,
+        initargs=(options, config, data)
+    )
+
+    # Chunks are submitted in a bounded window to keep memory use bounded when chunks are streamed
+    pending = deque()
+
+    try:
+        for chunk in chunks:
+            pending.append(pool.apply_async(_process_chunk, ((process_fn, chunk),)))
+            if len(pending) >= 2 * options.processes:
+                yield _collect(pending.popleft(), cache_stats)
+        while len(pending) > 0:
+            yield _collect(pending.popleft(), cache_stats)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def imap_trios(process_fn, trios, options, config, shared):
+
+    pool = trio_pool(options.processes, config, shared)
+
+    try:
+        tasks = [(process_fn, trio_options, None) for trio_options in trios]
+        for (ret, profile_stats) in pool.imap(_process_trio, tasks):
+            profiler.merge_stats(profile_stats)
+            yield ret
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def trio_pool(processes, config, shared):
+
+    # Worker processes inherit the shared data and process one trio at a time. A worker records its
+    # process ID in the slot of the trio it runs, so that run_trio notices when the worker dies.
+    job_pids = multiprocessing.Array('l', processes, lock=False)
+    pool = multiprocessing.Pool(
+        processes=processes,
+        initializer=_init_trio_worker,
+        initargs=(config, shared, job_pids)
+    )
+    pool.job_pids = job_pids
+    return pool
+
+
+def run_trio(pool, process_fn, trio_options, slot=0):
+
+    # The calling thread waits for the trio to be processed by a worker of the pool. The pool replaces
+    # a worker killed while running the trio, but the trio itself is lost and never returns.
+    pool.job_pids[slot] = 0
+    result = pool.apply_async(_process_trio, ((process_fn, trio_options, slot),))
+    while not result.ready():
+        result.wait(WORKER_CHECK_INTERVAL)
+        pid = pool.job_pids[slot]
+        if not result.ready() and pid != 0 and not _is_alive(pid):
+            raise WorkerLostError('Worker process {} died while running the trio'.format(pid))
+
+    (ret, profile_stats) = result.get()
+    profiler.merge_stats(profile_stats)
+    return ret
+
+
+def _collect(async_result, cache_stats):
+
+    (chunk_results, chunk_cache_stats, profile_stats) = async_result.get()
+    helper.merge_cache_stats(cache_stats, chunk_cache_stats)
+    profiler.merge_stats(profile_stats)
+    return chunk_results
+
+
+def _init_worker(options, config, data):
+
+    # Timings of the parent process before the fork are reported by the parent
+    profiler.reset()
+
+    # pysam file handles cannot be shared across forks, so each worker opens its own
+    data = dict(data)
+    helper.connect(options, config, data)
+
+    _worker['config'] = config
+    _worker['data'] = data
+    _worker['filt'] = filters.Filters(options.full_details, options.lazy_details)
+    _worker['cache_stats'] = helper.cache_stats(data)
+
+
+def _process_chunk(args):
+
+    (process_fn, chunk) = args
+    ret = process_fn(chunk, _worker['config'], _worker['data'], _worker['filt'])
+
+    # Cache statistics accumulated while processing this chunk
+    cache_stats = helper.cache_stats(_worker['data'])
+    for name, (hits, misses) in _worker['cache_stats'].iteritems():
+        cache_stats[name][0] -= hits
+        cache_stats[name][1] -= misses
+    _worker['cache_stats'] = helper.cache_stats(_worker['data'])
+
+    return ret, cache_stats, profiler.pop_stats()
+
+
+def _init_trio_worker(config, shared, job_pids=None):
+
+    # Timings of the parent process before the fork are reported by the parent
+    profiler.reset()
+
+    # pysam file handles cannot be shared across forks, so each worker opens its own
+    shared = dict(shared)
+    helper.connect_databases(config, shared)
+
+    _worker['config'] = config
+    _worker['shared'] = shared
+    _worker['job_pids'] = job_pids
+
+
+def _process_trio(args):
+
+    (process_fn, trio_options, slot) = args
+    if slot is not None:
+        _worker['job_pids'][slot] = os.getpid()
+    ret = process_fn(trio_options, _worker['config'], _worker['shared'])
+    return ret, profiler.pop_stats()
+
+
+def _is_alive(pid):
+
+    # Exited workers are reaped by the pool, after which their process ID no longer exists
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
@@ -1,60 +1,180 @@
 from __future__ import division
 from collections import OrderedDict
 import sys
+import fileio
 
 
 
+# Fields shared by all transcripts of an allele and fields of each transcript
+ALLELE_FIELDS = ('quality', 'TR', 'TC', 'NF', 'NR')
+TRANSCRIPT_FIELDS = ('gene', 'csn', 'class_', 'altann', 'altclass')
+TRANSCRIPT_FIELD_INDEX = dict((key, i) for i, key in enumerate(TRANSCRIPT_FIELDS))
+
+# INFO keys of the transcript annotations, in the order of TRANSCRIPT_FIELDS
+TRANSCRIPT_INFO_KEYS = ('GENE', 'CSN', 'CLASS', 'ALTANN', 'ALTCLASS')
+
+# INFO keys read from the variant records of the child, all other keys are skipped
+VCF_INFO_KEYS = frozenset(('TC', 'TR', 'NF', 'NR', 'TYPE') + TRANSCRIPT_INFO_KEYS)
+
+
+class AlleleRecord(object):
+
+
+    # Allele called in a VCF record. The annotations of its transcripts are kept as the colon-separated
+    # INFO values of the allele and only split when first accessed, which gives a TranscriptRecord
+    # for each transcript. The split transcripts are kept but not pickled.
+    STATE = ALLELE_FIELDS + ('annotations',)
+    __slots__ = STATE + ('_transcripts',)
+
+
+    def __init__(self, quality, TR, TC, NF, NR, annotations):
+
+        self.quality = quality
+        self.TR = TR
+        self.TC = TC
+        self.NF = NF
+        self.NR = NR
+        self.annotations = annotations
+        self._transcripts = None
+
+
+    @property
+    def transcripts(self):
+
+        if self._transcripts is None:
+            columns = [x.split(':') for x in self.annotations]
+            self._transcripts = tuple(tuple(column[j] for column in columns) for j in range(len(columns[0])))
+        return self._transcripts
+
+
+    def __len__(self):
+
+        return self.annotations[0].count(':') + 1
+
+
+    def __getitem__(self, index):
+
+        return TranscriptRecord(self, self.transcripts[index])
+
+
+    def __iter__(self):
+
+        for transcript in self.transcripts:
+            yield TranscriptRecord(self, transcript)
+
+
+    def __getstate__(self):
+
+        return tuple(getattr(self, key) for key in self.STATE)
+
+
+    def __setstate__(self, state):
+
+        for key, value in zip(self.STATE, state):
+            setattr(self, key, value)
+        self._transcripts = None
+
+
+class TranscriptRecord(object):
+
+
+    # One transcript of an AlleleRecord with its annotations as a tuple of TRANSCRIPT_FIELDS,
+    # accessed like the dict of the variant
+    __slots__ = ('allele', 'transcript')
+
+
+    def __init__(self, allele, transcript):
+
+        self.allele = allele
+        self.transcript = transcript
+
+
+    def __getitem__(self, key):
+
+        if key in TRANSCRIPT_FIELD_INDEX:
+            return self.transcript[TRANSCRIPT_FIELD_INDEX[key]]
+        if key in ALLELE_FIELDS:
+            return getattr(self.allele, key)
+        raise KeyError(key)
+
+
+    def __contains__(self, key):
+
+        return key in TRANSCRIPT_FIELD_INDEX or key in ALLELE_FIELDS
+
+
+    def as_dict(self):
+
+        return dict((key, self[key]) for key in ALLELE_FIELDS + TRANSCRIPT_FIELDS)
+
+
+    def __getstate__(self):
+
+        return self.allele, self.transcript
+
+
+    def __setstate__(self, state):
+
+        self.allele, self.transcript = state
+
+
 def parse_vcf_record(line):
 
-    cols = line.split()
+    cols = line.split(None, 8)
 
-    info = dict(x.split('=', 1) for x in cols[7].split(';') if '=' in x)
+    info = info_fields(cols[7], VCF_INFO_KEYS)
 
     if float(info['TC']) == 0:
         return
 
     by_alt = dict((key, info[key].split(',')) for key in info)
 
-    chrom = cols[0] if not cols[0].startswith('chr') else cols[0][3:]
+    chrom = strip_chr(cols[0])
+    tc = int(info['TC'])
 
     ret = {}
     for i, alt in enumerate(cols[4].split(",")):
 
         var_key = (chrom, cols[1], cols[3], alt)
 
-        by_transcript = dict((key, by_alt[key][i].split(':')) for key in ['GENE', 'CSN', 'CLASS', 'ALTANN', 'ALTCLASS'])
-
         if by_alt['TYPE'][i] == 'Substitution':
             qual_flag = 'high' if float(cols[5]) >= 100 else 'low'
         else:
             prop = float(by_alt['TR'][i]) / float(info['TC'])
             qual_flag = 'high' if prop > 0.2 and cols[6] == 'PASS' else 'low'
 
-        ret[var_key] = []
-        for j in range(len(by_transcript['GENE'])):
-
-            ret[var_key].append(
-                {
-                    'quality': qual_flag,
-                    'TR': int(by_alt['TR'][i]),
-                    'TC': int(info['TC']),
-                    'NF': int(by_alt['NF'][i]),
-                    'NR': int(by_alt['NR'][i]),
-                    'gene': by_transcript['GENE'][j],
-                    'csn': by_transcript['CSN'][j],
-                    'class_': by_transcript['CLASS'][j],
-                    'altann': by_transcript['ALTANN'][j],
-                    'altclass': by_transcript['ALTCLASS'][j]
-                }
-            )
+        ret[var_key] = AlleleRecord(
+            qual_flag,
+            int(by_alt['TR'][i]),
+            tc,
+            int(by_alt['NF'][i]),
+            int(by_alt['NR'][i]),
+            tuple(by_alt[key][i] for key in TRANSCRIPT_INFO_KEYS)
+        )
+
+    return ret
+
+
+def info_fields(info, keys):
 
+    # Values of the given keys read in a single scan of the INFO column, the last occurrence of a key wins
+    ret = {}
+    for x in info.split(';'):
+        key, sep, value = x.partition('=')
+        if sep and key in keys:
+            ret[key] = value
     return ret
 
 
+def strip_chr(chrom):
+
+    return chrom[3:] if chrom.startswith('chr') else chrom
+
+
 def read_vcf_file(fn):
 
     ret = OrderedDict()
-    for line in open(fn):
+    for line in fileio.open_text(fn):
         line = line.strip()
         if line == '' or line.startswith('#'):
             continue
@@ -65,6 +185,36 @@ def read_vcf_file(fn):
     return ret
 
 
+def iter_vcf_file(fn):
+
+    # Unlike read_vcf_file(), a var_key occurring in more than one record is yielded for each record
+    for line in fileio.open_text(fn):
+        line = line.strip()
+        if line == '' or line.startswith('#'):
+            continue
+        parsed_record = parse_vcf_record(line)
+        if parsed_record is None:
+            continue
+        for var_key, variants in parsed_record.iteritems():
+            yield var_key, variants
+
+
+def parse_vcf_record_keys(line):
+
+    cols = line.split(None, 8)
+
+    # Records with zero coverage are skipped, as in parse_vcf_record() the last TC value is used
+    info = ';' + cols[7]
+    start = info.rfind(';TC=') + 4
+    end = info.find(';', start)
+    if float(info[start:end] if end != -1 else info[start:]) == 0:
+        return []
+
+    chrom = strip_chr(cols[0])
+
+    return [(chrom, cols[1], cols[3], alt) for alt in cols[4].split(',')]
+
+
 def read_config_file(fn):
 
     sys.stdout.write('\nReading configuration file ... ')
@@ -84,7 +234,12 @@ def read_config_file(fn):
         'GNOMAD_GENOMES_DATA_FILE': '',
         'CONTROL_DATA_FILE': '',
         'MAXENTSCAN_DATA_FILE': '',
-        'EXAC_DATA_FILE': ''
+        'EXAC_DATA_FILE': '',
+        'ALLELE_COUNT_CACHE_FILE': '',
+        'ALLELE_COUNTING_ENGINE': 'aligned_pairs',
+        'BATCH_BAM_QUERIES': 'false',
+        'PARENT_INDEX_CACHE_DIR': '',
+        'GNOMAD_CSN_WINDOW': 100
     }
 
     if fn is not None:
@@ -108,11 +263,13 @@ def read_config_file(fn):
         'CHILD_MIN_TR',
         'CHILD_MIN_TC',
         'PARENT_MIN_COVERAGE',
-        'PARENT_MAX_ALT_ALLELE_COUNT'
+        'PARENT_MAX_ALT_ALLELE_COUNT',
+        'GNOMAD_CSN_WINDOW'
     ]:
         ret[k] = int(ret[k])
 
-    ret['REMOVE_MULTI_ALLELE_CALLS'] = (ret['REMOVE_MULTI_ALLELE_CALLS'].upper() == 'TRUE')
+    for k in ['REMOVE_MULTI_ALLELE_CALLS', 'BATCH_BAM_QUERIES']:
+        ret[k] = (ret[k].upper() == 'TRUE')
 
     print ' - Done.'
 
@@ -120,35 +277,47 @@ def read_config_file(fn):
 
 
 
-def read_custom_database_file_by_csnkey(fn):
+# Columns of a trio manifest file, in any order
+TRIO_MANIFEST_COLUMNS = ['child_var', 'mother_var', 'father_var', 'child_bam', 'mother_bam', 'father_bam', 'output']
 
-    ret = {}
-    num_of_samples = None
+
+def read_trio_manifest(fn):
+
+    # The first line names the columns, its leading '#' is optional
+    ret = []
+    header = None
     with open(fn) as f:
-        for line in f:
+        for line_number, line in enumerate(f, 1):
             line = line.strip()
             if line == '':
                 continue
-            if line.startswith('##SAMPLES='):
-                num_of_samples = int(line[line.find('=')+1:])
+            if header is None:
+                header = line.lstrip('#').split('\t')
+                missing = [c for c in TRIO_MANIFEST_COLUMNS if c not in header]
+                if missing:
+                    raise ValueError('Missing columns in trio manifest {}: {}'.format(fn, ', '.join(missing)))
                 continue
             if line[0] == '#':
                 continue
 
-            cols = line.split('\t')
-
-            key = (cols[6], cols[9])
-            ret[key] = 100 * int(cols[20]) / num_of_samples
+            # Empty fields are missing values too
+            values = dict(zip(header, line.split('\t')))
+            missing = [c for c in TRIO_MANIFEST_COLUMNS if values.get(c, '').strip() == '']
+            if missing:
+                raise ValueError(
+                    'Missing values in trio manifest {}, line {}: {}'.format(fn, line_number, ', '.join(missing))
+                )
+            ret.append(OrderedDict((c, values[c]) for c in TRIO_MANIFEST_COLUMNS))
 
     return ret
 
 
+def read_custom_database_file(fn, var_keys=None, csn_keys=None):
 
-def read_custom_database_file_by_varkey(fn):
-
-    ret = {}
+    by_csnkey = {}
+    by_varkey = {}
     num_of_samples = None
-    with open(fn) as f:
+    with fileio.open_text(fn) as f:
         for line in f:
             line = line.strip()
             if line == '':
@@ -161,16 +330,27 @@ def read_custom_database_file_by_varkey(fn):
 
             cols = line.split('\t')
 
-            key = tuple(cols[:4])
-            ret[key] = 100 * int(cols[20]) / num_of_samples
+            # Only keys of interest are kept if the keys are given
+            csn_key = (cols[6], cols[9])
+            var_key = tuple(cols[:4])
+            keep_csnkey = csn_keys is None or csn_key in csn_keys
+            keep_varkey = var_keys is None or var_key in var_keys
+            if not (keep_csnkey or keep_varkey):
+                continue
 
-    return ret
+            freq = 100 * int(cols[20]) / num_of_samples
+            if keep_csnkey:
+                by_csnkey[csn_key] = freq
+            if keep_varkey:
+                by_varkey[var_key] = freq
+
+    return by_csnkey, by_varkey
 
 
 def read_exac_data_file(fn):
 
     ret = {}
-    with open(fn) as f:
+    with fileio.open_text(fn) as f:
         for line in f:
             line = line.strip()
             if 'N_missense' in line or line == '':
@@ -0,0 +1,112 @@
+from collections import OrderedDict
+import json
+import time
+
+
+class Profiler(object):
+
+
+    def __init__(self):
+
+        self.enabled = False
+        self.timers = OrderedDict()
+        self.counters = OrderedDict()
+
+
+    def timer(self, name):
+
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+
+    def count(self, name, n=1):
+
+        if not self.enabled:
+            return
+        self.counters[name] = self.counters.get(name, 0) + n
+
+
+    def reset(self):
+
+        self.timers = OrderedDict()
+        self.counters = OrderedDict()
+
+
+    def pop_stats(self):
+
+        ret = {'timers': self.timers, 'counters': self.counters}
+        self.reset()
+        return ret
+
+
+    def merge_stats(self, stats):
+
+        for name, (calls, wall, cpu) in stats['timers'].iteritems():
+            self._add_time(name, calls, wall, cpu)
+        for name, n in stats['counters'].iteritems():
+            self.counters[name] = self.counters.get(name, 0) + n
+
+
+    def write_report(self, fn):
+
+        report = OrderedDict()
+        report['timers'] = OrderedDict(
+            (name, OrderedDict([('calls', calls), ('wall_seconds', round(wall, 6)), ('cpu_seconds', round(cpu, 6))]))
+            for name, (calls, wall, cpu) in self.timers.iteritems()
+        )
+        report['counters'] = self.counters
+
+        with open(fn, 'w') as out:
+            json.dump(report, out, indent=2)
+            out.write('\n')
+
+
+    def _add_time(self, name, calls, wall, cpu):
+
+        if name not in self.timers:
+            self.timers[name] = [0, 0.0, 0.0]
+        t = self.timers[name]
+        t[0] += calls
+        t[1] += wall
+        t[2] += cpu
+
+
+class _Timer(object):
+
+
+    def __init__(self, profiler, name):
+
+        self.profiler = profiler
+        self.name = name
+
+
+    def __enter__(self):
+
+        self.wall = time.time()
+        self.cpu = time.clock()
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        self.profiler._add_time(self.name, 1, time.time() - self.wall, time.clock() - self.cpu)
+
+
+class _NullTimer(object):
+
+
+    def __enter__(self):
+
+        pass
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+# Profiler shared by all modules of the current process
+profiler = Profiler()
@@ -0,0 +1,270 @@
+from __future__ import division
+from collections import deque, OrderedDict
+import BaseHTTPServer
+import json
+import os
+import Queue
+import SocketServer
+import stat
+import threading
+import time
+import helper
+import parallel
+import parsers
+
+
+# Maximum number of jobs waiting for a worker, further jobs are rejected until the queue drains
+MAX_QUEUED_JOBS = 1000
+
+# Number of finished jobs whose status is kept
+MAX_FINISHED_JOBS = 10000
+
+
+class JobQueue(object):
+
+
+    # Trio jobs are queued and run by a fixed number of dispatcher threads, each of them waiting for a
+    # worker process of the pool to process its trio
+    def __init__(self, pool, process_fn, options, workers, max_queued=MAX_QUEUED_JOBS):
+
+        self.pool = pool
+        self.process_fn = process_fn
+        self.options = options
+        self.queue = Queue.Queue(max_queued)
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.finished = deque()
+        self.next_id = 1
+        self.running = 0
+        self.counters = OrderedDict([('submitted', 0), ('rejected', 0), ('done', 0), ('failed', 0)])
+        self.wait_time = 0.0
+        self.run_time = 0.0
+        self.max_run_time = 0.0
+        self.workers_lost = 0
+
+        # Each dispatcher thread has its own slot of the pool, recording the worker running its trio
+        self.threads = []
+        for slot in range(workers):
+            thread = threading.Thread(target=self._dispatch, args=(slot,))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+
+    def submit(self, trio):
+
+        with self.lock:
+            job = OrderedDict([
+                ('id', self.next_id),
+                ('status', 'queued'),
+                ('output', trio['output']),
+                ('submitted', time.time())
+            ])
+            try:
+                self.queue.put_nowait((job, trio))
+            except Queue.Full:
+                self.counters['rejected'] += 1
+                return None
+            self.next_id += 1
+            self.counters['submitted'] += 1
+            self.jobs[job['id']] = job
+
+        return OrderedDict(job)
+
+
+    def status(self, job_id):
+
+        with self.lock:
+            return OrderedDict(self.jobs[job_id]) if job_id in self.jobs else None
+
+
+    def metrics(self):
+
+        with self.lock:
+            finished = self.counters['done'] + self.counters['failed']
+            ret = OrderedDict()
+            ret['workers'] = len(self.threads)
+            ret['queue_depth'] = self.queue.qsize()
+            ret['running'] = self.running
+            ret.update(('jobs_{}'.format(key), value) for key, value in self.counters.iteritems())
+            ret['mean_wait_seconds'] = round(self.wait_time / finished, 3) if finished > 0 else None
+            ret['mean_run_seconds'] = round(self.run_time / finished, 3) if finished > 0 else None
+            ret['max_run_seconds'] = round(self.max_run_time, 3)
+            ret['workers_lost'] = self.workers_lost
+            return ret
+
+
+    def _dispatch(self, slot):
+
+        while True:
+            (job, trio) = self.queue.get()
+
+            with self.lock:
+                self.running += 1
+                job['status'] = 'running'
+                job['started'] = time.time()
+
+            lost = False
+            try:
+                (_, counter_included, counter_excluded, _) = parallel.run_trio(
+                    self.pool, self.process_fn, helper.trio_options(self.options, trio), slot
+                )
+                result = OrderedDict([
+                    ('status', 'done'),
+                    ('denovo_candidates', counter_included),
+                    ('filtered_out', counter_excluded)
+                ])
+            except Exception as e:
+                result = OrderedDict([('status', 'failed'), ('error', '{}: {}'.format(type(e).__name__, e))])
+                lost = isinstance(e, parallel.WorkerLostError)
+
+            with self.lock:
+                if lost:
+                    self.workers_lost += 1
+                self.running -= 1
+                job.update(result)
+                job['finished'] = time.time()
+                wait_time = job['started'] - job['submitted']
+                run_time = job['finished'] - job['started']
+                job['wait_seconds'] = round(wait_time, 3)
+                job['run_seconds'] = round(run_time, 3)
+                self.counters[job['status']] += 1
+                self.wait_time += wait_time
+                self.run_time += run_time
+                self.max_run_time = max(self.max_run_time, run_time)
+
+                # Statuses of the oldest finished jobs are dropped
+                self.finished.append(job['id'])
+                if len(self.finished) > MAX_FINISHED_JOBS:
+                    del self.jobs[self.finished.popleft()]
+
+            print 'Job {}: {} in {}s  ({})'.format(job['id'], job['status'], job['run_seconds'], job['output'])
+
+
+class RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+
+    # POST /jobs submits a trio given as a JSON object with the columns of a trio manifest,
+    # GET /jobs/<id> returns the status of a job and GET /metrics the state of the job queue
+    def do_POST(self):
+
+        if self.path != '/jobs':
+            return self._reply(404, {'error': 'Not found'})
+
+        try:
+            trio = json.loads(self.rfile.read(int(self.headers.getheader('content-length', 0))))
+        except ValueError:
+            return self._reply(400, {'error': 'Invalid JSON'})
+
+        error = validate_job(trio)
+        if error is not None:
+            return self._reply(400, {'error': error})
+
+        job = self.server.jobs.submit(OrderedDict((c, trio[c].encode('utf-8')) for c in parsers.TRIO_MANIFEST_COLUMNS))
+        if job is None:
+            return self._reply(503, {'error': 'Job queue is full'})
+        self._reply(202, job)
+
+
+    def do_GET(self):
+
+        if self.path == '/metrics':
+            return self._reply(200, self.server.jobs.metrics())
+
+        if self.path.startswith('/jobs/'):
+            try:
+                job = self.server.jobs.status(int(self.path[len('/jobs/'):]))
+            except ValueError:
+                job = None
+            if job is not None:
+                return self._reply(200, job)
+
+        self._reply(404, {'error': 'Not found'})
+
+
+    def _reply(self, code, body):
+
+        content = json.dumps(body) + '\n'
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+    def address_string(self):
+
+        # Clients of a Unix socket have no host address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+
+    def log_message(self, format, *args):
+
+        pass
+
+
+class HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+
+class UnixHTTPServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+
+    daemon_threads = True
+    bound = False
+
+
+    def server_bind(self):
+
+        # A socket file left behind by an earlier server is replaced, any other file is left alone
+        check_socket_path(self.server_address)
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        SocketServer.UnixStreamServer.server_bind(self)
+        self.bound = True
+
+
+    def server_close(self):
+
+        # Also called when binding fails, the socket file is only removed if this server created it
+        SocketServer.UnixStreamServer.server_close(self)
+        if self.bound:
+            os.remove(self.server_address)
+
+
+def validate_job(trio):
+
+    if not isinstance(trio, dict):
+        return 'A job must be a JSON object'
+    missing = [c for c in parsers.TRIO_MANIFEST_COLUMNS if c not in trio]
+    if missing:
+        return 'Missing fields: {}'.format(', '.join(missing))
+    unknown = [c for c in trio if c not in parsers.TRIO_MANIFEST_COLUMNS]
+    if unknown:
+        return 'Unknown fields: {}'.format(', '.join(sorted(unknown)))
+    if not all(isinstance(trio[c], basestring) for c in parsers.TRIO_MANIFEST_COLUMNS):
+        return 'Fields must be strings'
+    return None
+
+
+def check_socket_path(path):
+
+    if os.path.exists(path) and not stat.S_ISSOCK(os.stat(path).st_mode):
+        raise ValueError('Not a socket, refusing to replace it: {}'.format(path))
+
+
+def create_server(options, jobs):
+
+    if options.socket is not None:
+        server = UnixHTTPServer(options.socket, RequestHandler)
+    else:
+        server = HTTPServer((options.host, options.port), RequestHandler)
+    server.jobs = jobs
+    return server
+
+
+def server_address(options, server):
+
+    if options.socket is not None:
+        return 'unix:{}'.format(options.socket)
+    return 'http://{}:{}'.format(*server.server_address[:2])
@@ -1,8 +1,21 @@
 from .version import __version__
+from collections import OrderedDict
 import datetime
+import os
+import sys
+import fileio
 import parsers
 import helper
 import filters
+import gnomad
+import gnomad_index
+import parallel
+import server
+from profiling import profiler
+
+
+# Maximum number of child variants processed together in one chunk
+CHUNK_SIZE = 1000
 
 
 def run(options):
@@ -10,18 +23,134 @@ def run(options):
     # Start time
     start_time = datetime.datetime.now()
 
+    # Collect timings and counters if requested
+    profiler.enabled = options.profile
+
     # Print welcome message and information
     helper.welcome(__version__)
 
     # Read configuration file
     config = parsers.read_config_file(options.config)
 
+    # Process a batch of trios listed in a manifest file
+    if options.trios is not None:
+        run_trios(options, config, start_time)
+        return
+
     # Read input data
-    data = helper.read_data(options, config)
+    with profiler.timer('Read input data'):
+        data = helper.read_data(options, config)
+
+    # Filter the variants of the child and write output files
+    (counter_included, counter_excluded, cache_stats) = process_trio(options, config, data)
+
+    # Write profile report
+    profile_fn = write_profile_report(options, options.output)
+
+    # Runtime
+    run_time = str(datetime.datetime.now() - start_time)
+
+    # Print goodbye message and information
+    helper.goodbye(
+        counter_included, counter_excluded, options.output, run_time, cache_stats, profile_fn,
+        fileio.output_ext(options.output_format, options.bgzip_output)
+    )
+
+
+def run_trios(options, config, start_time):
+
+    trios = [helper.trio_options(options, trio) for trio in parsers.read_trio_manifest(options.trios)]
+
+    # Reference data are read and gnomAD databases are connected to only once for all trios
+    sys.stdout.write('Reading shared data ... ')
+    sys.stdout.flush()
+    with profiler.timer('Read shared data'):
+        shared = helper.read_shared_data(config)
+    print ' - Done.\n'
+
+    # Trios are processed either in this process or in a pool of worker processes
+    if options.processes > 1:
+        results = parallel.imap_trios(run_trio, trios, options, config, shared)
+    else:
+        results = (run_trio(trio_options, config, shared) for trio_options in trios)
+
+    counter_included = 0
+    counter_excluded = 0
+    cache_stats = OrderedDict()
+    for i, (output, trio_included, trio_excluded, trio_cache_stats) in enumerate(results):
+        print 'Trio {}/{}: {} de novo candidates, {} filtered out  ({})'.format(
+            i + 1, len(trios), trio_included, trio_excluded, output
+        )
+        counter_included += trio_included
+        counter_excluded += trio_excluded
+        helper.merge_cache_stats(cache_stats, trio_cache_stats)
+
+    # Write profile report
+    profile_fn = write_profile_report(options, os.path.splitext(options.trios)[0])
+
+    # Runtime
+    run_time = str(datetime.datetime.now() - start_time)
+
+    # Print goodbye message and information
+    helper.goodbye_trios(len(trios), counter_included, counter_excluded, run_time, cache_stats, profile_fn)
+
+
+def serve(options):
+
+    # Print welcome message and information
+    helper.welcome(__version__)
+
+    # Read configuration file
+    config = parsers.read_config_file(options.config)
+
+    # Reference data are read and gnomAD databases are connected to only once for all jobs
+    sys.stdout.write('Reading shared data ... ')
+    sys.stdout.flush()
+    shared = helper.read_shared_data(config)
+    print ' - Done.'
+
+    # Worker processes are forked before any thread of the server is started
+    pool = parallel.trio_pool(options.workers, config, shared)
+    jobs = server.JobQueue(pool, run_trio, options, options.workers, options.max_queued_jobs)
+    httpd = server.create_server(options, jobs)
+
+    print '\nServing on {} with {} workers'.format(server.server_address(options, httpd), options.workers)
+    sys.stdout.flush()
+
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        pool.terminate()
+        pool.join()
+
+
+def run_trio(options, config, shared):
+
+    with profiler.timer('Read input data'):
+        data = helper.read_trio_data(options, config, shared)
+
+    # Cache statistics of the shared gnomAD readers are counted from the start of the trio
+    cache_stats_before = helper.cache_stats(data)
+    (counter_included, counter_excluded, cache_stats) = process_trio(options, config, data, False)
+    for name, (hits, misses) in cache_stats_before.iteritems():
+        cache_stats[name][0] -= hits
+        cache_stats[name][1] -= misses
+
+    return options.output, counter_included, counter_excluded, cache_stats
+
+
+def process_trio(options, config, data, show_progress=True):
 
     # Initialize output files
-    out_included = open('{}_denovo_candidates.txt'.format(options.output), 'w')
-    out_excluded = open('{}_filtered_out.txt'.format(options.output), 'w')
+    out_included, out_excluded = [
+        fileio.open_output(
+            '{}_{}'.format(options.output, name), options.output_format, options.bgzip_output, helper.OUTPUT_COLUMN_TYPES
+        )
+        for name in ['denovo_candidates', 'filtered_out']
+    ]
 
     # Decide whether to write MaxEntScan and ExAC columns
     write_maxentscan = config['MAXENTSCAN_DATA_FILE'] != ''
@@ -34,25 +163,114 @@ def run(options):
     else:
         helper.output_header_simplified(out_excluded)
 
-    # Initialize Filters object
-    filt = filters.Filters(options.full_details)
-
     # Initialize counters
     counter = 0
     counter_included = 0
     counter_excluded = 0
 
     # Initialize progress info
-    helper.init_progress()
+    if show_progress:
+        helper.init_progress()
+
+    # Split the variants called in the child into chunks of the same chromosome
+    if options.streaming:
+        child_var = helper.check_sorted(parsers.iter_vcf_file(options.child_var))
+    else:
+        child_var = data['child_var'].iteritems()
+    chunks = helper.chunk_by_chromosome(child_var, CHUNK_SIZE)
 
-    # Iterate through the variants called in the child
-    for var_key, variants in data['child_var'].iteritems():
+    # Process chunks either in this process or in a pool of worker processes
+    cache_stats = OrderedDict()
+    if options.processes > 1:
+        results = parallel.imap_chunks(process_chunk, chunks, options, config, data, cache_stats)
+    else:
+        filt = filters.Filters(options.full_details, options.lazy_details)
+        results = (process_chunk(chunk, config, data, filt) for chunk in chunks)
+
+    # Iterate through the results in the original order of the variants
+    for chunk_results in results:
 
-        for variant in variants:
+        for (var_key, variant, result, maxentscan_scores, exac_values) in chunk_results:
             counter += 1
 
             # Print progress info
-            helper.print_progress(counter, len(data['child_var']))
+            if show_progress:
+                helper.print_progress(counter, data['child_var_count'])
+
+            # Output result
+            with profiler.timer('Output'):
+                if result['filter'] == '.':
+                    helper.output(out_included, var_key, variant, result, maxentscan_scores, exac_values, False)
+                    counter_included += 1
+                else:
+                    if options.full_details:
+                        helper.output(out_excluded, var_key, variant, result, maxentscan_scores, exac_values, True)
+                    else:
+                        helper.output_simplified(out_excluded, var_key, variant, result)
+                    counter_excluded += 1
+
+    # Finalize progress info
+    if show_progress:
+        helper.finalize_progress()
+
+    # Cache statistics of the serial run
+    if options.processes <= 1:
+        cache_stats = helper.cache_stats(data)
+
+    # Close output files, which are compressed and indexed if requested
+    with profiler.timer('Output'):
+        out_included.close()
+        out_excluded.close()
+
+    return counter_included, counter_excluded, cache_stats
+
+
+def write_profile_report(options, output_prefix):
+
+    if not options.profile:
+        return None
+    profile_fn = '{}_profile.json'.format(output_prefix)
+    profiler.write_report(profile_fn)
+    return profile_fn
+
+
+def process_chunk(chunk, config, data, filt):
+
+    ret = []
+
+    # Multiallelic calls of streamed variants are found in each chunk, which holds all records of their positions
+    if data['child_var'] is None:
+        data['multiallelic_calls'] = helper.find_multiallelic_calls(set(var_key for var_key, variants in chunk))
+
+    # Cheap checks of the variants of the chunk, their outcome is reused when the filters are applied
+    cheap_filters = [[filt.cheap_filter(var_key, v, config, data) for v in variants] for var_key, variants in chunk]
+
+    # Variants of the chunk whose annotations may be needed, i.e. not rejected by a cheap check
+    annotated = [
+        (var_key, variant)
+        for (var_key, variants), variant_filters in zip(chunk, cheap_filters)
+        for variant, cheap_filter in zip(variants, variant_filters)
+        if filt.needs_annotations(cheap_filter)
+    ]
+
+    # Look up gnomAD frequencies of these variants in one sweep through each database
+    queries = [(var_key, (variant['gene'], variant['csn'])) for var_key, variant in annotated]
+    data['gnomad_exomes_freqs'] = data['gnomad_exomes_reader'].get_max_frequencies(queries)
+    data['gnomad_genomes_freqs'] = data['gnomad_genomes_reader'].get_max_frequencies(queries)
+
+    # Count alleles at their loci in one pass through each parental BAM file
+    if config['BATCH_BAM_QUERIES']:
+        var_keys = list(OrderedDict.fromkeys(var_key for var_key, variant in annotated))
+        data['mother_alleles'].prefetch(var_keys)
+        data['father_alleles'].prefetch(var_keys)
+
+    # Read MaxEntScan data of the chunk's variants
+    if data['maxentscan'] is not None:
+        data['maxentscan'].prefetch(var_key for var_key, variants in chunk)
+
+    for (var_key, variants), variant_filters in zip(chunk, cheap_filters):
+
+        for variant, cheap_filter in zip(variants, variant_filters):
 
             # MaxEntScan scores of the variant
             maxentscan_scores = data['maxentscan'].get_scores(var_key) if data['maxentscan'] is not None else None
@@ -65,30 +283,36 @@ def run(options):
                 exac_values = data['exac'][gene] if gene in data['exac'] else {}
 
             # Apply filters to the variant
-            result = filt.apply_filters(var_key, variant, config, data)
+            result = filt.apply_filters(var_key, variant, config, data, cheap_filter)
 
-            # Output result
-            if result['filter'] == '.':
-                helper.output(out_included, var_key, variant, result, maxentscan_scores, exac_values, False)
-                counter_included += 1
-            else:
-                if options.full_details:
-                    helper.output(out_excluded, var_key, variant, result, maxentscan_scores, exac_values, True)
-                else:
-                    helper.output_simplified(out_excluded, var_key, variant, result)
-                counter_excluded += 1
+            ret.append((var_key, variant, result, maxentscan_scores, exac_values))
 
-    # Finalize progress info
-    helper.finalize_progress()
+    return ret
 
-    # Close output files
-    out_included.close()
-    out_excluded.close()
 
-    # Runtime
-    run_time = str(datetime.datetime.now() - start_time)
+def build_gnomad_index(options):
 
-    # Print goodbye message and information
-    helper.goodbye(counter_included, counter_excluded, options.output, run_time)
+    # Start time
+    start_time = datetime.datetime.now()
 
+    # Print welcome message and information
+    helper.welcome(__version__)
 
+    # Read configuration file
+    config = parsers.read_config_file(options.config)
+
+    for (name, key, exomes) in [
+        ('gnomAD exomes', 'GNOMAD_EXOMES_DATA_FILE', True),
+        ('gnomAD genomes', 'GNOMAD_GENOMES_DATA_FILE', False)
+    ]:
+        reader = gnomad.GnomadDBReader(config[key], exomes=exomes, result_cache_size=0, use_index=False)
+        fn = gnomad_index.index_fn(config[key], exomes)
+        print '\nIndexing {} ...'.format(name),
+        sys.stdout.flush()
+        n = gnomad_index.build(reader, fn)
+        print 'done ({} alleles): {}'.format(n, fn)
+
+    # Runtime
+    run_time = str(datetime.datetime.now() - start_time)
+    print '\n Finished in: {}'.format(run_time[:run_time.find('.')])
+    print '{}\n'.format('=' * 103)
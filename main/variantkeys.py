@@ -0,0 +1,104 @@
+from array import array
+import bisect
+import hashlib
+import errno
+import os
+import struct
+import sys
+import fileio
+import parsers
+
+
+def _hash_format():
+
+    # The array module of Python 2 has no 'q' type, its native long integers have 64 bits on 64-bit Unix platforms
+    try:
+        array('q')
+        return 'q'
+    except ValueError:
+        return 'l'
+
+
+# Variant keys are stored as 64-bit integers taken from the MD5 hash of the key
+HASH_FORMAT = _hash_format()
+HASH_SIZE = array(HASH_FORMAT).itemsize
+
+# First line of the cached key set files, the hashes are stored with the native size and byte order
+CACHE_HEADER = 'variantkeys {} {}\n'.format(HASH_SIZE, sys.byteorder)
+
+
+class VariantKeySet(object):
+
+
+    def __init__(self, hashes):
+
+        self.hashes = hashes
+
+
+    def __contains__(self, var_key):
+
+        h = hash_key(var_key)
+        i = bisect.bisect_left(self.hashes, h)
+        return i < len(self.hashes) and self.hashes[i] == h
+
+
+    def __len__(self):
+
+        return len(self.hashes)
+
+
+def load(fn, cache_dir=None):
+
+    # The key set of a VCF file is cached under the checksum of the file. Cached files of another hash size or
+    # byte order are read again.
+    if cache_dir is not None:
+        cache_fn = os.path.join(cache_dir, '{}.keys'.format(checksum(fn)))
+        if os.path.isfile(cache_fn):
+            with open(cache_fn, 'rb') as f:
+                if f.readline() == CACHE_HEADER:
+                    hashes = array(HASH_FORMAT)
+                    hashes.fromfile(f, (os.path.getsize(cache_fn) - len(CACHE_HEADER)) // HASH_SIZE)
+                    return VariantKeySet(hashes)
+
+    hashes = array(HASH_FORMAT)
+    for line in fileio.open_text(fn):
+        line = line.strip()
+        if line == '' or line.startswith('#'):
+            continue
+        for var_key in parsers.parse_vcf_record_keys(line):
+            hashes.append(hash_key(var_key))
+    hashes = array(HASH_FORMAT, sorted(set(hashes)))
+
+    if cache_dir is not None:
+        make_dirs(cache_dir)
+        tmp_fn = '{}.{}.tmp'.format(cache_fn, os.getpid())
+        with open(tmp_fn, 'wb') as f:
+            f.write(CACHE_HEADER)
+            hashes.tofile(f)
+        os.rename(tmp_fn, cache_fn)
+
+    return VariantKeySet(hashes)
+
+
+def make_dirs(path):
+
+    # The directory may be created by another process at the same time
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST or not os.path.isdir(path):
+            raise
+
+
+def hash_key(var_key):
+
+    return struct.unpack(HASH_FORMAT, hashlib.md5('\t'.join(var_key[:4])).digest()[:HASH_SIZE])[0]
+
+
+def checksum(fn):
+
+    md5 = hashlib.md5()
+    with open(fn, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), ''):
+            md5.update(block)
+    return md5.hexdigest()
@@ -12,5 +12,8 @@ setup(
     license='MIT',
     packages=['main'],
     scripts=['bin/DeNovoFilter.py'],
+    extras_require={
+        'columnar': ['pyarrow']
+    },
     zip_safe=False
 )
@@ -0,0 +1,157 @@
+"""Unit tests for the alleles module"""
+
+from unittest import TestCase
+from main import alleles
+import os
+import shutil
+import tempfile
+import pysam
+
+
+
+# Reference sequence of the test BAM file (positions are 0-based)
+REFERENCE = 'ACGTACGTAC' * 10
+
+# Reads of the test BAM file: (start, CIGAR, read sequence, MD tag, is_duplicate)
+READS = [
+    (10, [(0, 20)], REFERENCE[10:30], '20', False),
+    (12, [(0, 20)], REFERENCE[12:20] + 'T' + REFERENCE[21:32], '8A11', False),
+    (14, [(0, 7), (2, 3), (0, 10)], REFERENCE[14:21] + REFERENCE[24:34], '7^CGT10', False),
+    (15, [(0, 20)], REFERENCE[15:20] + 'T' + REFERENCE[21:35], '5A14', False),
+    (15, [(0, 20)], REFERENCE[15:20] + 'T' + REFERENCE[21:35], '5A14', True),
+    (16, [(4, 2), (0, 5), (1, 2), (0, 10)], 'GG' + REFERENCE[16:21] + 'TT' + REFERENCE[21:31], '15', False),
+    (17, [(0, 4), (2, 3), (1, 1), (0, 10)], REFERENCE[17:21] + 'G' + REFERENCE[24:34], '4^CGT10', False),
+    (18, [(0, 2), (3, 5), (0, 10)], REFERENCE[18:20] + REFERENCE[25:35], '12', False),
+]
+
+
+
+class TestAlleles(TestCase):
+
+
+    @classmethod
+    def setUpClass(cls):
+
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.bam_fn = os.path.join(cls.tmpdir, 'test.bam')
+
+        header = {'HD': {'VN': '1.0', 'SO': 'coordinate'}, 'SQ': [{'LN': len(REFERENCE), 'SN': '1'}]}
+        with pysam.AlignmentFile(cls.bam_fn, 'wb', header=header) as out:
+            for i, (start, cigar, seq, md, dup) in enumerate(READS):
+                read = pysam.AlignedSegment()
+                read.query_name = 'read{}'.format(i)
+                read.query_sequence = seq
+                read.flag = 1024 if dup else 0
+                read.reference_id = 0
+                read.reference_start = start
+                read.mapping_quality = 60
+                read.cigartuples = cigar
+                read.set_tag('MD', md)
+                out.write(read)
+        pysam.index(cls.bam_fn)
+
+        cls.samfile = pysam.AlignmentFile(cls.bam_fn, 'rb')
+
+
+    @classmethod
+    def tearDownClass(cls):
+
+        cls.samfile.close()
+        shutil.rmtree(cls.tmpdir)
+
+
+    def test_engines_agree_on_indels(self):
+
+        var_keys = [
+            ('1', '21', 'ACGT', 'A'),
+            ('1', '21', 'AC', 'A'),
+            ('1', '22', 'CG', 'C'),
+            ('1', '21', 'A', 'ATT'),
+            ('1', '20', 'T', 'TTT'),
+            ('1', '21', 'ACGT', 'G'),
+            ('1', '21', 'ACG', 'AT'),
+            ('1', '30', 'A', 'AC'),
+        ]
+
+        for var_key in var_keys:
+            self.assertEquals(
+                alleles.count(self.samfile, var_key, 'cigar'),
+                alleles.count(self.samfile, var_key, 'aligned_pairs'),
+                var_key
+            )
+
+        # The reference skip of the last read is counted as a deletion, as in deletion_blocks()
+        self.assertEquals(alleles.count(self.samfile, ('1', '21', 'ACGT', 'A'), 'cigar'), (7, 3))
+        self.assertEquals(alleles.count(self.samfile, ('1', '21', 'A', 'ATT'), 'cigar'), (7, 1))
+        self.assertEquals(alleles.count(self.samfile, ('1', '21', 'ACGT', 'G'), 'cigar'), (7, 4))
+
+
+    def test_engines_agree_on_coverage_of_substitutions(self):
+
+        for pos in range(9, 36):
+            for alt in 'ACGT':
+                if alt == REFERENCE[pos]:
+                    continue
+                var_key = ('1', str(pos + 1), REFERENCE[pos], alt)
+                self.assertEquals(
+                    alleles.count(self.samfile, var_key, 'cigar'),
+                    alleles.count(self.samfile, var_key, 'aligned_pairs'),
+                    var_key
+                )
+
+
+
+    def test_count_batch(self):
+
+        var_keys = [('1', str(pos + 1), REFERENCE[pos], 'T') for pos in range(5, 40)]
+        var_keys += [('1', '21', 'ACGT', 'A'), ('1', '21', 'A', 'ATT'), ('1', '21', 'ACGT', 'G'), ('1', '95', 'C', 'CA')]
+
+        for engine in ['aligned_pairs', 'cigar']:
+            result = alleles.count_batch(self.samfile, var_keys, engine)
+            self.assertEquals(len(result), len(var_keys))
+            for var_key in var_keys:
+                self.assertEquals(result[var_key], alleles.count(self.samfile, var_key, engine), var_key)
+
+
+    def test_count_substitution_by_cigar(self):
+
+        # Two reads have a T at position 20, a third one is a duplicate and the last one skips the position
+        for engine in ['aligned_pairs', 'cigar']:
+            self.assertEquals(alleles.count(self.samfile, ('1', '21', 'A', 'T'), engine), (7, 2))
+            self.assertEquals(alleles.count(self.samfile, ('1', '21', 'A', 'G'), engine), (7, 0))
+
+
+    def test_query_base_at(self):
+
+        read = pysam.AlignedSegment()
+        read.query_sequence = 'GG' + REFERENCE[16:21] + 'TT' + REFERENCE[21:31]
+        read.reference_start = 16
+        read.cigartuples = [(4, 2), (0, 5), (1, 2), (0, 10)]
+
+        self.assertIsNone(alleles.query_base_at(read, 15))
+        self.assertEquals(alleles.query_base_at(read, 16), REFERENCE[16])
+        self.assertEquals(alleles.query_base_at(read, 20), REFERENCE[20])
+        self.assertEquals(alleles.query_base_at(read, 21), REFERENCE[21])
+        self.assertEquals(alleles.query_base_at(read, 30), REFERENCE[30])
+        self.assertIsNone(alleles.query_base_at(read, 31))
+
+
+    def test_allele_counter_cache_file(self):
+
+        cache_fn = os.path.join(self.tmpdir, 'allele_counts.txt')
+        var_key = ('1', '21', 'ACGT', 'A')
+
+        counter = alleles.AlleleCounter(self.bam_fn, cache_fn, 'cigar')
+        self.assertEquals(counter.count(var_key), (7, 3))
+        self.assertEquals(counter.count(var_key), (7, 3))
+        self.assertEquals((counter.hits, counter.misses), (1, 1))
+        counter.cache_file.close()
+
+        counter = alleles.AlleleCounter(self.bam_fn, cache_fn, 'cigar')
+        self.assertEquals(counter.count(var_key), (7, 3))
+        self.assertEquals((counter.hits, counter.misses), (1, 0))
+
+        # Counts of another engine are not reused
+        counter = alleles.AlleleCounter(self.bam_fn, cache_fn, 'aligned_pairs')
+        self.assertEquals(counter.count(var_key), (7, 3))
+        self.assertEquals((counter.hits, counter.misses), (0, 1))
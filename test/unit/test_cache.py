@@ -0,0 +1,53 @@
+"""Unit tests for the cache module"""
+
+from unittest import TestCase
+from main import cache
+
+
+
+class TestLRUCache(TestCase):
+
+
+    def test_get_and_put(self):
+
+        lru = cache.LRUCache(2)
+
+        self.assertIsNone(lru.get('a'))
+
+        lru.put('a', 1)
+        lru.put('b', 2)
+        self.assertEquals(lru.get('a'), 1)
+
+        # 'b' is the least recently used item, so it is evicted
+        lru.put('c', 3)
+        self.assertIsNone(lru.get('b'))
+        self.assertEquals(lru.get('a'), 1)
+        self.assertEquals(lru.get('c'), 3)
+        self.assertEquals(len(lru), 2)
+
+        self.assertEquals(lru.hits, 3)
+        self.assertEquals(lru.misses, 2)
+
+
+    def test_on_evict(self):
+
+        evicted = []
+        lru = cache.LRUCache(1, on_evict=lambda key, value: evicted.append((key, value)))
+
+        lru.put('a', 1)
+        lru.put('a', 2)
+        self.assertEquals(evicted, [])
+
+        lru.put('b', 3)
+        self.assertEquals(evicted, [('a', 2)])
+
+
+    def test_zero_maxsize(self):
+
+        evicted = []
+        lru = cache.LRUCache(0, on_evict=lambda key, value: evicted.append((key, value)))
+
+        lru.put('a', 1)
+        self.assertIsNone(lru.get('a'))
+        self.assertEquals(len(lru), 0)
+        self.assertEquals(evicted, [])
@@ -0,0 +1,87 @@
+"""Unit tests for the control module"""
+
+from unittest import TestCase
+from main import control
+import os
+import pysam
+import shutil
+import tempfile
+
+
+
+def control_line(var_key, gene, csn, count):
+
+    cols = list(var_key) + ['.'] * 17
+    cols[6] = gene
+    cols[9] = csn
+    cols[20] = str(count)
+    return '\t'.join(cols) + '\n'
+
+
+
+class TestControlData(TestCase):
+
+
+    def setUp(self):
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.fn = os.path.join(self.tmpdir, 'control.txt')
+        with open(self.fn, 'w') as f:
+            f.write('##SAMPLES=200\n#header\n')
+            f.write(control_line(('1', '100', 'A', 'C'), 'G1', 'c.10A>C', 4))
+            f.write(control_line(('1', '500', 'G', 'T'), 'G2', 'c.77G>T', 1))
+            f.write(control_line(('2', '900', 'C', 'A'), 'G3', '.', 10))
+
+
+    def tearDown(self):
+
+        shutil.rmtree(self.tmpdir)
+
+
+    def test_get_frequency(self):
+
+        data = control.ControlData(self.fn)
+
+        self.assertEquals(data.get_frequency(('1', '100', 'A', 'C'), ('G1', '.')), 2.0)
+        self.assertEquals(data.get_frequency(('9', '100', 'A', 'C'), ('G2', 'c.77G>T')), 0.5)
+        self.assertEquals(data.get_frequency(('2', '900', 'C', 'A'), ('G3', '.')), 5.0)
+        self.assertEquals(data.get_frequency(('2', '901', 'C', 'A'), ('G3', '.')), 0.0)
+        self.assertEquals(data.get_frequency(('1', '100', 'A', 'C'), ('G1', 'c.11A>C')), 0.0)
+
+
+    def test_prefiltered_keys(self):
+
+        data = control.ControlData(self.fn, set([('1', '100', 'A', 'C')]), set([('G2', 'c.77G>T')]))
+
+        self.assertEquals(data.by_varkey, {('1', '100', 'A', 'C'): 2.0})
+        self.assertEquals(data.by_csnkey, {('G2', 'c.77G>T'): 0.5})
+
+
+    def test_indexed_file(self):
+
+        with open(self.fn, 'w') as f:
+            f.write('##SAMPLES=50\n#header\n')
+            f.write(control_line(('1', '100', 'A', 'C'), 'G1', 'c.10A>C', 4))
+            f.write(control_line(('1', '180', 'G', 'T'), 'G2', 'c.77G>T', 1))
+            f.write(control_line(('1', '400', 'C', 'A'), 'G3', 'c.5C>A', 10))
+        fn = pysam.tabix_index(self.fn, seq_col=0, start_col=1, end_col=1, force=True)
+
+        data = control.open_control_data(fn)
+        self.assertIsInstance(data, control.ControlDBReader)
+        self.assertEquals(data.num_of_samples, 50)
+
+        # Variants without a CSN only match their own line
+        self.assertEquals(data.get_frequency(('1', '100', 'A', 'C'), ('G1', '.')), 8.0)
+        self.assertEquals(data.get_frequency(('1', '100', 'A', 'G'), ('G1', '.')), 0.0)
+
+        # Lines matching by CSN are found within 100bp of the variant
+        self.assertEquals(data.get_frequency(('1', '150', 'C', 'G'), ('G2', 'c.77G>T')), 2.0)
+        self.assertEquals(data.get_frequency(('1', '150', 'C', 'G'), ('G1', 'c.10A>C')), 8.0)
+        self.assertEquals(data.get_frequency(('1', '279', 'C', 'G'), ('G2', 'c.77G>T')), 2.0)
+        self.assertEquals(data.get_frequency(('1', '280', 'C', 'G'), ('G2', 'c.77G>T')), 0.0)
+        self.assertEquals(data.get_frequency(('1', '80', 'C', 'G'), ('G2', 'c.77G>T')), 2.0)
+        self.assertEquals(data.get_frequency(('1', '79', 'C', 'G'), ('G2', 'c.77G>T')), 0.0)
+        self.assertEquals(data.get_frequency(('1', '150', 'C', 'G'), ('G3', 'c.5C>A')), 0.0)
+
+        # Chromosomes missing from the file have no frequencies
+        self.assertEquals(data.get_frequency(('2', '100', 'A', 'C'), ('G1', '.')), 0.0)
@@ -0,0 +1,162 @@
+"""Unit tests for the fileio module"""
+
+from unittest import TestCase, skipIf
+from main import fileio, helper
+from mock import patch
+import gzip
+import os
+import shutil
+import tempfile
+import pysam
+import zlib
+
+if fileio.pyarrow is not None:
+    import pyarrow
+
+
+
+class TestFileIO(TestCase):
+
+
+    def setUp(self):
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.fn = os.path.join(self.tmp_dir, 'data.txt')
+        self.lines = ['#header\n'] + ['line{}\tx\n'.format(i) for i in range(1000)] + ['last']
+        with open(self.fn, 'w') as f:
+            f.write(''.join(self.lines))
+
+
+    def tearDown(self):
+
+        shutil.rmtree(self.tmp_dir)
+
+
+    def test_open_text(self):
+
+        gzip_fn = self.fn + '.gzip.gz'
+        with open(self.fn) as f_in:
+            f_out = gzip.open(gzip_fn, 'wb')
+            f_out.write(f_in.read())
+            f_out.close()
+        pysam.tabix_compress(self.fn, self.fn + '.gz')
+
+        for fn in [self.fn, gzip_fn, self.fn + '.gz']:
+            with fileio.open_text(fn) as f:
+                self.assertEquals(list(f), self.lines)
+
+        self.assertFalse(fileio.is_gzipped(self.fn))
+        self.assertTrue(fileio.is_gzipped(gzip_fn))
+
+
+    def test_read_ahead_file(self):
+
+        # Blocks smaller than the lines and a short queue make the reader wait for the parser
+        data = ''.join(self.lines)
+        blocks = [data[i:i + 3] for i in range(0, len(data), 3)]
+        self.assertEquals(list(fileio.ReadAheadFile(iter(blocks), max_blocks=2)), self.lines)
+
+        # Closing the file stops the reader before the end of the file
+        f = fileio.ReadAheadFile(iter(blocks), max_blocks=2)
+        self.assertEquals(next(f), self.lines[0])
+        f.close()
+        self.assertFalse(f.thread.is_alive())
+
+
+    def test_iter_gzip_blocks(self):
+
+        # Each line is compressed as a separate gzip member
+        fn = self.fn + '.gz'
+        with open(fn, 'wb') as f:
+            for line in self.lines:
+                compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+                f.write(compressor.compress(line) + compressor.flush())
+
+        self.assertEquals(''.join(fileio.iter_gzip_blocks(fn, block_size=5)), ''.join(self.lines))
+
+
+    def test_output_writer(self):
+
+        # Lines are only written when the buffer is full or the file is closed
+        fn = os.path.join(self.tmp_dir, 'out.txt')
+        out = fileio.OutputWriter(fn, buffer_size=10)
+        out.write_header(['CHROM', 'POS'])
+        self.assertEquals(open(fn).read(), 'CHROM\tPOS\n')
+        out.write('1\t5\n')
+        self.assertEquals(open(fn).read(), 'CHROM\tPOS\n')
+        out.write('1\t9\n')
+        out.write_record(['2', 3, 0.126, '.'])
+        out.close()
+        self.assertEquals(open(fn).read(), 'CHROM\tPOS\n1\t5\n1\t9\n2\t3\t0.13\t.\n')
+
+        # Compressed output files are indexed by chromosome and position
+        out = fileio.OutputWriter(fn, compress=True)
+        for line in ['CHROM\tPOS\n', '1\t5\n', '1\t9\n', '2\t3\n']:
+            out.write(line)
+        out.close()
+        self.assertEquals(fileio.output_ext('tsv', True), '.txt.gz')
+        self.assertFalse(os.path.isfile(fn))
+        self.assertEquals(list(pysam.TabixFile(fn + '.gz').fetch('1', 6, 10)), ['1\t9'])
+
+        # Records to be indexed must be sorted
+        for records in [[['1', '9'], ['1', '5']], [['1', '5'], ['2', '3'], ['1', '9']]]:
+            out = fileio.OutputWriter(fn, compress=True)
+            out.write_header(['CHROM', 'POS'])
+            with self.assertRaises(ValueError):
+                for record in records:
+                    out.write_record(record)
+
+
+    @skipIf(fileio.pyarrow is None, 'pyarrow is not installed')
+    def test_columnar_writer(self):
+
+        column_types = {'POS': 'int', 'Freq': 'float', 'Filter': 'dictionary'}
+        records = [['1', '5', 0.5, 'a'], ['1', '9', '.', 'b'], ['2', '3', 0.25, 'a'], ['2', '7', 0.75, 'c']]
+
+        for output_format in ['parquet', 'arrow']:
+            fn = os.path.join(self.tmp_dir, 'out' + fileio.output_ext(output_format))
+            out = fileio.ColumnarWriter(fn, output_format, column_types, batch_size=2)
+            out.write_header(['CHROM', 'POS', 'Freq', 'Filter'])
+            for record in records:
+                out.write_record(record)
+            out.close()
+
+            if output_format == 'parquet':
+                table = pyarrow.parquet.read_table(fn)
+            else:
+                table = pyarrow.ipc.open_stream(fn).read_all()
+            self.assertEquals(table.num_rows, 4)
+            self.assertEquals(table.column('POS').to_pylist(), [5, 9, 3, 7])
+            self.assertEquals(table.column('Freq').to_pylist(), [0.5, None, 0.25, 0.75])
+
+            # Each batch has its own dictionary of the Filter values
+            self.assertEquals([str(x) for x in table.column('Filter').to_pylist()], ['a', 'b', 'a', 'c'])
+
+
+    def test_columnar_fields(self):
+
+        # Every typed column is an output column
+        columns = helper.output_columns(True, True, True)
+        fields = fileio.columnar_fields(columns, helper.OUTPUT_COLUMN_TYPES)
+        self.assertEquals([c for c, _ in fields], columns)
+        self.assertEquals(
+            sorted(c for c, t in fields if t != 'str'),
+            sorted(helper.OUTPUT_COLUMN_TYPES)
+        )
+        self.assertEquals(dict(fields)['Filter'], 'dictionary')
+        self.assertEquals(dict(fields)['GENE'], 'str')
+
+        # Values are converted by the types of their columns
+        converted = [fileio.COLUMN_CONVERTERS[t](x) for (_, t), x in zip(fields[:3], ['1', '5', 'A'])]
+        self.assertEquals(converted, ['1', 5, 'A'])
+        self.assertEquals(fileio.COLUMN_CONVERTERS['float']('.'), None)
+
+        with self.assertRaises(ValueError):
+            fileio.columnar_fields(['POS'], {'POS': 'date'})
+
+
+    @patch('main.fileio.pyarrow', None)
+    def test_columnar_writer_without_pyarrow(self):
+
+        with self.assertRaises(ImportError):
+            fileio.open_output(os.path.join(self.tmp_dir, 'out'), 'parquet')
@@ -2,6 +2,7 @@
 
 from unittest import TestCase
 from main import filters
+from mock import MagicMock
 
 
 
@@ -439,6 +440,95 @@ class TestFilters(TestCase):
         self.assertEquals(len(self.filt.filter), 0)
 
 
+    def make_input(self, quality='high', mother_counts=(20, 0)):
+
+        var_key = ('1', 12345678, 'A', 'G')
+        variant = {'gene': 'GENE1', 'csn': 'c.100A>G', 'quality': quality, 'TR': 10, 'TC': 20}
+        config = {
+            'REMOVE_MULTI_ALLELE_CALLS': True,
+            'SPLICE_SITE_BOUNDARY': 10,
+            'CHILD_MIN_TR': 3,
+            'CHILD_MIN_TC': 4,
+            'CHILD_MIN_TR_PER_TC': 0.1,
+            'CONTROL_MAX_FREQUENCY': 0.1,
+            'GNOMAD_MAX_FREQUENCY': 0.1,
+            'PARENT_MIN_COVERAGE': 7,
+            'PARENT_MAX_ALT_ALLELE_COUNT': 1
+        }
+        data = {
+            'multiallelic_calls': set(),
+            'mother_var': set(),
+            'father_var': set(),
+            'control': MagicMock(),
+            'gnomad_exomes_reader': MagicMock(),
+            'gnomad_genomes_reader': MagicMock(),
+            'mother_alleles': MagicMock(),
+            'father_alleles': MagicMock()
+        }
+        data['control'].get_frequency.return_value = 0.0
+        data['gnomad_exomes_reader'].get_max_frequency.return_value = (0.0, 'NFE')
+        data['gnomad_genomes_reader'].get_max_frequency.return_value = (0.5, 'AFR')
+        data['mother_alleles'].count.return_value = mother_counts
+        data['father_alleles'].count.return_value = (20, 0)
+        return var_key, variant, config, data
+
+
     def test_apply_filters(self):
 
-        self.fail('Test not yet implemented')
\ No newline at end of file
+        var_key, variant, config, data = self.make_input()
+        result = self.filt.apply_filters(var_key, variant, config, data)
+        self.assertEquals(result, {'filter': 'high_gnomad_genomes_frequency (0.5)'})
+
+        # The parental BAM files are not read once a check has failed
+        self.assertFalse(data['mother_alleles'].count.called)
+
+        filt = filters.Filters(True)
+        var_key, variant, config, data = self.make_input(mother_counts=(5, 0))
+        result = filt.apply_filters(var_key, variant, config, data)
+        self.assertEquals(result['filter'], 'high_gnomad_genomes_frequency (0.5),low_mother_tc (5)')
+        self.assertEquals(result['gnomad_exomes_freq'], 0.0)
+        self.assertEquals(result['pop_gnomad_genomes'], 'AFR')
+        self.assertEquals(result['parent_alleles'], {'mother_tc': 5, 'mother_tr': 0, 'father_tc': 20, 'father_tr': 0})
+
+
+    def test_apply_filters_lazy(self):
+
+        filt = filters.Filters(True, lazy=True)
+
+        var_key, variant, config, data = self.make_input(quality='low')
+        result = filt.apply_filters(var_key, variant, config, data)
+        self.assertEquals(result['filter'], 'low_quality')
+        self.assertEquals(result['control_freq'], '.')
+        self.assertEquals(result['gnomad_exomes_freq'], '.')
+        self.assertEquals(result['parent_alleles']['mother_tc'], '.')
+        self.assertFalse(data['gnomad_exomes_reader'].get_max_frequency.called)
+        self.assertFalse(data['mother_alleles'].count.called)
+
+        # Variants passing the cheap checks are annotated in full
+        var_key, variant, config, data = self.make_input()
+        result = filt.apply_filters(var_key, variant, config, data)
+        self.assertEquals(result['filter'], 'high_gnomad_genomes_frequency (0.5)')
+        self.assertEquals(result['parent_alleles']['mother_tc'], 20)
+
+
+    def test_cheap_filter(self):
+
+        filt = filters.Filters(True, lazy=True)
+
+        var_key, variant, config, data = self.make_input(quality='low')
+        variant['TR'] = 1
+        cheap_filter = filt.cheap_filter(var_key, variant, config, data)
+        self.assertEquals(cheap_filter, ['low_quality', 'low_child_tr (1)', 'low_child_tr_per_tc (0.05)'])
+        self.assertFalse(filt.needs_annotations(cheap_filter))
+        self.assertTrue(filters.Filters(True).needs_annotations(cheap_filter))
+        self.assertEquals(filters.Filters(False).cheap_filter(var_key, variant, config, data), ['low_quality'])
+
+        # The outcome of the cheap checks is not computed again when given
+        result = filt.apply_filters(var_key, variant, config, data, ['low_quality'])
+        self.assertEquals(result['filter'], 'low_quality')
+
+        var_key, variant, config, data = self.make_input()
+        cheap_filter = filt.cheap_filter(var_key, variant, config, data)
+        self.assertEquals(cheap_filter, [])
+        self.assertTrue(filt.needs_annotations(cheap_filter))
+        self.assertFalse(data['control'].get_frequency.called)
@@ -1,6 +1,11 @@
 from unittest import TestCase
 from main import gnomad
+from main.cache import LRUCache
 from mock import patch
+import os
+import shutil
+import tempfile
+import pysam
 
 
 class TestGnomadDBReader(TestCase):
@@ -118,3 +123,201 @@ class TestGnomadDBReader(TestCase):
         self.assertEquals(result[0], 1.45985e-01)
         self.assertEquals(result[1], 'AFR')
 
+
+
+    @patch('main.gnomad.GnomadDBReader._tabix_file')
+    @patch('main.gnomad.GnomadDBReader.__init__')
+    def test_get_max_frequencies(self, mocked_init, mocked_tabix_file):
+
+        mocked_init.return_value = None
+
+        lines = [
+            '1\t1000\t.\tC\tT\t.\tPASS\tGENE=G1;CSN=c.10C>T;GC_AFR=90,10,0;GC_NFE=100,0,0;AF_AFR=0.05;AF_NFE=0.0',
+            '1\t1050\t.\tGA\tG\t.\tPASS\tGENE=G1;CSN=c.60delA;GC_AFR=100,0,0;GC_NFE=98,2,0;AF_AFR=0.0;AF_NFE=0.01',
+            '1\t5000\t.\tA\tG,T\t.\tPASS\tGENE=G2:G3,G2:G3;CSN=c.5A>G:c.7A>G,c.5A>T:c.7A>T;'
+            'GC_AFR=50,0,0,50,0,0;GC_NFE=100,0,0,0,0,0;AF_AFR=0.0,0.25;AF_NFE=0.0,0.0',
+        ]
+        mocked_tabix_file.return_value = FakeTabixFile(lines)
+
+        queries = [
+            (('1', '1000', 'C', 'T'), ('G1', '.')),
+            (('1', '1000', 'C', 'T'), ('G1', 'c.60delA')),
+            (('1', '1120', 'G', 'A'), ('G1', 'c.60delA')),
+            (('1', '1160', 'G', 'A'), ('G1', 'c.60delA')),
+            (('1', '5000', 'A', 'T'), ('G3', 'c.7A>T')),
+            (('1', '4950', 'A', 'C'), ('G2', 'c.5A>G')),
+            (('1', '50', 'A', 'C'), ('G2', 'c.5A>G')),
+        ]
+
+        reader = gnomad.GnomadDBReader()
+        result = reader.get_max_frequencies(queries)
+
+        self.assertEquals(result[queries[0]], (10.0, 'AFR'))
+        self.assertEquals(result[queries[1]], (2.0, 'NFE'))
+        self.assertEquals(result[queries[2]], (2.0, 'NFE'))
+        self.assertEquals(result[queries[3]], (0.0, '.'))
+        self.assertEquals(result[queries[4]], (50.0, 'AFR'))
+        self.assertEquals(result[queries[5]], (0.0, '.'))
+        self.assertNotIn(queries[6], result)
+
+        for q in queries[:6]:
+            self.assertEquals(result[q], reader.get_max_frequency(*q))
+
+
+    @patch('main.gnomad.GnomadDBReader._tabix_file')
+    @patch('main.gnomad.GnomadDBReader.__init__')
+    def test_get_max_frequencies_result_cache(self, mocked_init, mocked_tabix_file):
+
+        mocked_init.return_value = None
+        mocked_tabix_file.return_value = FakeTabixFile([
+            '1\t1000\t.\tC\tT\t.\tPASS\tGENE=G1;CSN=c.10C>T;GC_AFR=90,10,0;AF_AFR=0.05'
+        ])
+
+        reader = gnomad.GnomadDBReader()
+        reader.result_cache = LRUCache(10)
+        queries = [(('1', '1000', 'C', 'T'), ('G1', '.')), (('1', '1000', 'C', 'T'), ('G1', 'c.10C>T'))]
+
+        # Repeated queries are looked up once
+        result = reader.get_max_frequencies(queries * 3)
+        self.assertEquals(result, dict((q, (10.0, 'AFR')) for q in queries))
+        self.assertEquals(reader.cache_stats(), [('results', 0, 2)])
+
+        self.assertEquals(reader.get_max_frequencies(queries), result)
+        self.assertEquals(reader.cache_stats(), [('results', 2, 2)])
+        self.assertEquals(mocked_tabix_file.call_count, 1)
+
+
+    @patch('main.gnomad.GnomadDBReader.__init__')
+    def test_max_frequencies(self, mocked_init):
+
+        mocked_init.return_value = None
+        reader = gnomad.GnomadDBReader()
+
+        flags = {
+            'GC_AFR': '90,5,1,3,0,1',
+            'AF_AFR': '0,0',
+            'GC_NFE': '90,2,0,8,0,0',
+            'AF_NFE': '0,0',
+            'GC_SAS': '0,0,0,0,0,0',
+            'AF_SAS': '0,0'
+        }
+        expected = [(6.0, 'AFR'), (8.0, 'NFE')]
+        self.assertEquals(reader._max_frequencies('1', flags, 2), expected)
+        self.assertEquals([reader._gc_to_variant_freqs(flags['GC_AFR'], 2, i) for i in range(2)], [6.0, 4.0])
+
+        # Without NumPy the alleles are computed one by one
+        with patch('main.gnomad.numpy', None):
+            self.assertIsNone(reader._max_frequencies_numpy('1', flags, 2))
+            self.assertEquals(reader._max_frequencies('1', flags, 2), expected)
+
+        # Lines with unexpected numbers of genotype counts are left to the per-allele computation
+        flags['GC_SAS'] = '0,0,0,0,0,0,0'
+        self.assertIsNone(reader._max_frequencies_numpy('1', flags, 2))
+        self.assertEquals(reader._max_frequencies('1', flags, 2), expected)
+
+
+    @patch('main.gnomad.GnomadDBReader.__init__')
+    def test_parse_line(self, mocked_init):
+
+        mocked_init.return_value = None
+        reader = gnomad.GnomadDBReader()
+
+        line = '1\t100\t.\tG\tA,T\t100\tPASS\tAC=1;GENE=GENE1,GENE1;FLAG_X;CSN=c.100G>A,c.100G>T;AF_AFR=0.1,0.2;AC=2'
+        n_alts, flags = reader._parse_line(line)
+
+        self.assertEquals(n_alts, 2)
+        self.assertEquals((flags['pos'], flags['ref'], flags['alts']), (100, 'G', ['A', 'T']))
+        self.assertEquals(flags['GENE'], 'GENE1,GENE1')
+        self.assertEquals(flags['AF_AFR'], '0.1,0.2')
+        self.assertEquals(flags['AC'], '2')
+        self.assertIn('CSN', flags)
+        self.assertNotIn('FLAG_X', flags)
+        self.assertNotIn('AF_NFE', flags)
+        with self.assertRaises(KeyError):
+            flags['AF_NFE']
+
+        # Only the keys looked up are extracted from the INFO column
+        self.assertIsInstance(flags, gnomad.GnomadRecord)
+        self.assertEquals(sorted(flags.values.keys()), ['AC', 'AF_AFR', 'AF_NFE', 'CSN', 'FLAG_X', 'GENE'])
+        self.assertIsNone(flags.values['AF_NFE'])
+
+
+    @patch('main.gnomad.GnomadDBReader._read_variants_in_vicinity')
+    @patch('main.gnomad.GnomadDBReader._read_variants_at')
+    @patch('main.gnomad.GnomadDBReader.__init__')
+    def test_get_max_frequency_exact_position(self, mocked_init, mocked_read_variants_at, mocked_read_variants_in_vicinity):
+
+        mocked_init.return_value = None
+        mocked_read_variants_at.return_value = [
+            (1, {'pos': 100, 'ref': 'G', 'alts': ['A'], 'GC_AFR': '90,10,0', 'AF_AFR': '0.05'})
+        ]
+        mocked_read_variants_in_vicinity.return_value = []
+
+        reader = gnomad.GnomadDBReader()
+
+        # Variants without a CSN are only looked up at their position
+        self.assertEquals(reader.get_max_frequency(('1', '100', 'G', 'A'), ('.', '.')), (10.0, 'AFR'))
+        mocked_read_variants_at.assert_called_once_with('1', 100)
+        self.assertFalse(mocked_read_variants_in_vicinity.called)
+
+        self.assertEquals(reader.get_max_frequency(('1', '100', 'G', 'A'), ('GENE1', 'c.100G>A')), (0.0, '.'))
+        mocked_read_variants_in_vicinity.assert_called_once_with('1', 100, 100)
+
+
+    def test_lazy_open(self):
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            line = '{}\t100\t.\tG\tA\t100\tPASS\tGENE=GENE1;CSN=c.100G>A;GC_AFR=90,10,0;AF_AFR=0.05'
+            for chrom in ['1', '2']:
+                write_vcf(os.path.join(tmpdir, 'genomes.{}.vcf'.format(chrom)), [line.format(chrom)])
+            write_vcf(os.path.join(tmpdir, 'genomes.vcf'), [line.format('1'), line.format('2')])
+
+            # Per-chromosome files are opened on first use, closing the least recently used one above the limit
+            reader = gnomad.GnomadDBReader(os.path.join(tmpdir, 'genomes.{}.vcf.gz'), exomes=False, max_open_files=1)
+            self.assertEquals(len(reader.tabix_files), 0)
+
+            self.assertEquals(reader.get_max_frequency(('1', '100', 'G', 'A'), ('GENE1', 'c.100G>A')), (10.0, 'AFR'))
+            first = reader.tabix_files.get('1')
+            self.assertEquals(reader.get_max_frequency(('2', '100', 'G', 'A'), ('GENE1', 'c.100G>A')), (10.0, 'AFR'))
+            self.assertEquals(reader.tabix_files.data.keys(), ['2'])
+            self.assertFalse(first.is_open())
+            self.assertEquals(reader.get_max_frequency(('Y', '100', 'G', 'A'), ('GENE1', 'c.100G>A')), (0.0, '.'))
+
+            # A single genomes file may hold all chromosomes
+            reader = gnomad.GnomadDBReader(os.path.join(tmpdir, 'genomes.vcf.gz'), exomes=False)
+            self.assertEquals(reader.get_max_frequency(('2', '100', 'G', 'A'), ('GENE1', 'c.100G>A')), (10.0, 'AFR'))
+            self.assertEquals(reader.get_max_frequency(('3', '100', 'G', 'A'), ('GENE1', 'c.100G>A')), (0.0, '.'))
+            self.assertEquals(reader.tabix_files.data.keys(), ['_'])
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+
+def write_vcf(fn, lines):
+
+    with open(fn, 'w') as out:
+        out.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n')
+        for line in lines:
+            out.write(line + '\n')
+    return pysam.tabix_index(fn, preset='vcf')
+
+
+
+class FakeTabixFile(object):
+
+
+    def __init__(self, lines):
+
+        self.lines = lines
+        self.contigs = ['1']
+
+
+    def fetch(self, chrom, start, end):
+
+        ret = []
+        for line in self.lines:
+            cols = line.split('\t')
+            if cols[0] == chrom and int(cols[1]) - 1 < end and int(cols[1]) - 1 + len(cols[3]) > start:
+                ret.append(line)
+        return ret
@@ -0,0 +1,90 @@
+"""Unit tests for the gnomad_index module"""
+
+from unittest import TestCase
+from main import gnomad, gnomad_index
+import os
+import shutil
+import tempfile
+import pysam
+
+
+
+# Lines of the test gnomAD exomes file
+LINES = [
+    '1\t100\t.\tG\tA,T\t100\tPASS\tGENE=GENE1:GENE2,GENE1;CSN=c.100G>A:c.1C>T,c.100G>T;GC_AFR=90,5,1,3,0,1;GC_NFE=100,0,0,0,0,0;AF_AFR=0.1,0.1;AF_NFE=0,0',
+    '1\t150\t.\tCAT\tC\t100\tPASS\tGENE=GENE1;CSN=c.150_151delAT;GC_AFR=100,0,0;GC_NFE=98,2,0;AF_AFR=0;AF_NFE=0.01',
+    '1\t180\t.\tG\tA\t100\tPASS\tGENE=GENE1;CSN=c.100G>A;GC_AFR=50,50,0;GC_NFE=100,0,0;AF_AFR=0.25;AF_NFE=0',
+    '1\t200\t.\tT\tC\t100\tPASS\tGENE=GENE3;CSN=c.200T>C;GC_AFR=0,0,0;GC_NFE=0,0,0;AF_AFR=0;AF_NFE=0',
+]
+
+QUERIES = [
+    (('1', '100', 'G', 'A'), ('GENE1', 'c.100G>A')),
+    (('1', '100', 'G', 'T'), ('GENE1', 'c.100G>T')),
+    (('1', '100', 'G', 'A'), ('GENE2', 'c.1C>T')),
+    (('1', '100', 'G', 'A'), ('.', '.')),
+    (('1', '150', 'CAT', 'C'), ('.', '.')),
+    (('1', '260', 'G', 'A'), ('GENE1', 'c.100G>A')),
+    (('1', '251', 'A', 'T'), ('GENE1', 'c.150_151delAT')),
+    (('1', '252', 'A', 'T'), ('GENE1', 'c.150_151delAT')),
+    (('1', '200', 'T', 'C'), ('GENE3', 'c.200T>C')),
+    (('1', '200', 'T', 'G'), ('.', '.')),
+    (('2', '200', 'T', 'C'), ('GENE3', 'c.200T>C')),
+]
+
+
+
+class TestGnomadIndex(TestCase):
+
+
+    def setUp(self):
+
+        self.tmpdir = tempfile.mkdtemp()
+        vcf_fn = os.path.join(self.tmpdir, 'exomes.vcf')
+        with open(vcf_fn, 'w') as out:
+            out.write('##fileformat=VCFv4.1\n')
+            out.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n')
+            for line in LINES:
+                out.write(line + '\n')
+        self.fn = pysam.tabix_index(vcf_fn, preset='vcf')
+        self.index_fn = gnomad_index.index_fn(self.fn)
+
+
+    def tearDown(self):
+
+        shutil.rmtree(self.tmpdir)
+
+
+    def test_index_fn(self):
+
+        self.assertEquals(gnomad_index.index_fn('exomes.vcf.gz'), 'exomes.vcf.gz.denovo.sqlite')
+        self.assertEquals(gnomad_index.index_fn('genomes.{}.vcf.gz', False), 'genomes.all.vcf.gz.denovo.sqlite')
+
+
+    def test_build(self):
+
+        reader = gnomad.GnomadDBReader(self.fn, result_cache_size=0, use_index=False)
+        self.assertIsNone(reader.index)
+        self.assertEquals(gnomad_index.build(reader, self.index_fn), 5)
+
+        indexed_reader = gnomad.GnomadDBReader(self.fn, result_cache_size=0)
+        self.assertIsNotNone(indexed_reader.index)
+
+        for (var_key, csn_key) in QUERIES:
+            self.assertEquals(
+                indexed_reader.get_max_frequency(var_key, csn_key),
+                reader.get_max_frequency(var_key, csn_key)
+            )
+
+        self.assertEquals(indexed_reader.get_max_frequencies(QUERIES), reader.get_max_frequencies(QUERIES))
+
+
+    def test_outdated_index(self):
+
+        reader = gnomad.GnomadDBReader(self.fn, result_cache_size=0, use_index=False)
+        gnomad_index.build(reader, self.index_fn)
+        self.assertIsNotNone(gnomad_index.open_index(self.index_fn, [self.fn]))
+
+        # Indexes of modified data files are ignored
+        st = os.stat(self.fn)
+        os.utime(self.fn, (st.st_atime, st.st_mtime + 10))
+        self.assertIsNone(gnomad_index.open_index(self.index_fn, [self.fn]))
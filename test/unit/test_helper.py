@@ -2,6 +2,7 @@
 
 from unittest import TestCase
 from main import helper
+from optparse import Values
 
 
 
@@ -21,3 +22,92 @@ class TestHelper(TestCase):
             (None, None, None, None): None,
 
         }
+
+
+    def test_chunk_by_chromosome(self):
+
+        variants = [
+            (('1', '100', 'A', 'C'), 'v1'),
+            (('1', '200', 'A', 'C'), 'v2'),
+            (('1', '300', 'A', 'C'), 'v3'),
+            (('2', '100', 'A', 'C'), 'v4'),
+            (('1', '400', 'A', 'C'), 'v5'),
+        ]
+
+        chunks = list(helper.chunk_by_chromosome(iter(variants), 2))
+
+        self.assertEquals(
+            chunks,
+            [variants[0:2], variants[2:3], variants[3:4], variants[4:5]]
+        )
+
+        self.assertEquals(list(helper.chunk_by_chromosome(iter([]), 2)), [])
+
+        # Records of a position are not split between chunks
+        variants = [
+            (('1', '100', 'A', 'C'), 'v1'),
+            (('1', '200', 'A', 'C'), 'v2'),
+            (('1', '200', 'A', 'G'), 'v3'),
+            (('1', '300', 'A', 'C'), 'v4'),
+        ]
+        self.assertEquals(list(helper.chunk_by_chromosome(iter(variants), 2)), [variants[0:3], variants[3:4]])
+
+
+    def test_check_sorted(self):
+
+        variants = [
+            (('1', '100', 'A', 'C'), 'v1'),
+            (('1', '100', 'A', 'G'), 'v2'),
+            (('1', '99', 'A', 'C'), 'v3')
+        ]
+        self.assertEquals(list(helper.check_sorted(iter(variants[:2]))), variants[:2])
+        with self.assertRaises(ValueError):
+            list(helper.check_sorted(iter(variants)))
+
+        variants = [
+            (('1', '100', 'A', 'C'), 'v1'),
+            (('2', '50', 'A', 'C'), 'v2'),
+            (('10', '10', 'A', 'C'), 'v3'),
+            (('1', '200', 'A', 'C'), 'v4')
+        ]
+        self.assertEquals(list(helper.check_sorted(iter(variants[:3]))), variants[:3])
+        with self.assertRaises(ValueError):
+            list(helper.check_sorted(iter(variants)))
+
+
+    def test_output_record(self):
+
+        variant = {'gene': 'GENE1', 'csn': 'c.1A>C', 'class_': 'MS', 'altann': '.', 'altclass': '.', 'TR': 5, 'TC': 30, 'NF': 3, 'NR': 2}
+        result = {
+            'filter': 'low_quality',
+            'gnomad_exomes_freq': 0.123,
+            'pop_gnomad_exomes': 'NFE',
+            'gnomad_genomes_freq': 0.0,
+            'pop_gnomad_genomes': '.',
+            'control_freq': '.',
+            'parent_alleles': {'mother_tr': 0, 'mother_tc': 20, 'father_tr': '.', 'father_tc': '.'}
+        }
+
+        # Values of the record are given in the order of the output columns
+        for (maxentscan_scores, exac_values) in [(None, None), ({}, {})]:
+            columns = helper.output_columns(maxentscan_scores is not None, exac_values is not None, True)
+            record = helper.output_record(('1', '100', 'A', 'C'), variant, result, maxentscan_scores, exac_values, True)
+            self.assertEquals(len(record), len(columns))
+            values = dict(zip(columns, record))
+            self.assertEquals((values['POS'], values['Filter'], values['Child_TC']), ('100', 'low_quality', 30))
+            self.assertEquals((values['gnomAD_exomes_frequency'], values['Father_TR']), (0.123, '.'))
+
+        self.assertEquals(columns[-1], 'ExAC_pLI')
+        self.assertEquals(values['MaxEntScan_MAX3'], '.')
+        self.assertTrue(set(helper.OUTPUT_COLUMN_TYPES) <= set(columns))
+
+
+    def test_trio_options(self):
+
+        options = Values({'child_var': 'c.vcf', 'output': 'out', 'processes': 4, 'trios': 'trios.tsv', 'full_details': True})
+
+        trio_options = helper.trio_options(options, {'child_var': 'c1.vcf', 'output': 'out1'})
+
+        self.assertEquals((trio_options.child_var, trio_options.output), ('c1.vcf', 'out1'))
+        self.assertEquals((trio_options.processes, trio_options.trios, trio_options.full_details), (1, None, True))
+        self.assertEquals((options.child_var, options.processes), ('c.vcf', 4))
@@ -0,0 +1,96 @@
+"""Unit tests for the maxentscan module"""
+
+from unittest import TestCase
+from main import maxentscan
+import os
+import pysam
+import shutil
+import tempfile
+
+
+
+def maxentscan_line(var_key, csn, alt_known, scores):
+
+    cols = list(var_key) + ['ENST1', 'GENE1', 'Ex1', csn, 'SS', '8.1', '7.2', alt_known] + scores + ['100', '200']
+    return '\t'.join(cols) + '\n'
+
+
+
+class TestMaxEntScanData(TestCase):
+
+
+    def setUp(self):
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.fn = os.path.join(self.tmpdir, 'maxentscan.txt')
+        with open(self.fn, 'w') as f:
+            f.write('CHROM\tPOS\n')
+            f.write(maxentscan_line(('1', '631', 'C', 'G'), 'c.31+2C>G', '5.5', ['6.1', '7.7', '3.3', '4.4']))
+            f.write(maxentscan_line(('1', '2349', 'A', 'G'), 'c.49+2A>G', '.', ['6.1', '7.7', '3.3', '4.4']))
+            f.write(maxentscan_line(('1', '2349', 'A', 'T'), 'c.49+2A>T', '.', ['-1.0', '7.7', '5.0', '0.0']))
+            f.write(maxentscan_line(('1', '2500', 'AG', 'G'), 'c.60delA', '.', ['6.1', '7.7', '3.3', '4.4']))
+            f.write(maxentscan_line(('2', '900', 'G', 'A'), 'c.99-1G>A', '2.0', ['6.1', '7.7', '3.3', '4.4']))
+
+        self.scores = {
+            ('1', '631', 'C', 'G'): {'RefKnown': '8.1', 'PercentReduction': 32.1, 'PI5': '.', 'MAX5': '.'},
+            ('1', '2349', 'A', 'G'): {'RefKnown': '.', 'PercentReduction': '.', 'PI5': 0, 'PI3': 0, 'MAX5': '6.1'},
+            ('1', '2349', 'A', 'T'): {'PI5': 0, 'PI3': 100, 'MAX3': '5.0'},
+            ('2', '900', 'G', 'A'): {'RefKnown': '7.2', 'PercentReduction': 72.22, 'SpliceSiteType': 'spliceSiteRegion'}
+        }
+
+
+    def tearDown(self):
+
+        shutil.rmtree(self.tmpdir)
+
+
+    def assertScores(self, data):
+
+        for key, expected in self.scores.iteritems():
+            scores = data.get_scores(key)
+            self.assertEquals(len(scores), 17)
+            for k, value in expected.iteritems():
+                self.assertEquals(scores[k], value)
+
+        self.assertEquals(data.get_scores(('1', '2500', 'AG', 'G')), {})
+        self.assertEquals(data.get_scores(('1', '632', 'C', 'G')), {})
+        self.assertEquals(data.get_scores(('X', '631', 'C', 'G')), {})
+
+
+    def test_get_scores(self):
+
+        data = maxentscan.open_maxentscan_data(self.fn)
+
+        self.assertIsInstance(data, maxentscan.MaxEntScanData)
+        self.assertScores(data)
+
+
+    def test_prefiltered_keys(self):
+
+        var_keys = set([('1', '631', 'C', 'G'), ('1', '2500', 'AG', 'G'), ('3', '10', 'A', 'C')])
+        data = maxentscan.MaxEntScanData(self.fn, var_keys)
+
+        self.assertEquals(data.data.keys(), [('1', '631', 'C', 'G')])
+        self.assertEquals(data.get_scores(('1', '631', 'C', 'G'))['RefKnown'], '8.1')
+
+
+    def test_indexed_file(self):
+
+        fn = pysam.tabix_index(self.fn, seq_col=0, start_col=1, end_col=1, line_skip=1, force=True)
+        data = maxentscan.open_maxentscan_data(fn)
+
+        self.assertIsInstance(data, maxentscan.MaxEntScanDBReader)
+        self.assertScores(data)
+
+        # Only the lines of the last prefetched variants are kept
+        data.prefetch(self.scores.keys() + [('1', '2500', 'AG', 'G'), ('1', '5000', 'C', 'T'), ('X', '1', 'A', 'C')])
+        self.assertEquals(len(data.data), 5)
+        self.assertEquals(data.data[('1', '5000', 'C', 'T')], None)
+        self.assertScores(data)
+        data.prefetch([('1', '631', 'C', 'G')])
+        self.assertEquals(data.data.keys(), [('1', '631', 'C', 'G')])
+
+
+    def test_regions(self):
+
+        self.assertEquals(maxentscan._regions([5, 100, 1100, 2101, 2200]), [[5, 1100], [2101, 2200]])
@@ -0,0 +1,100 @@
+"""Unit tests for the parallel module"""
+
+from unittest import TestCase
+from main import parallel
+from mock import patch
+from optparse import Values
+import os
+import time
+
+
+
+class FakeCache(object):
+
+
+    def __init__(self):
+
+        self.hits = 0
+        self.misses = 0
+
+
+    def cache_stats(self):
+
+        return [('lookups', self.hits, self.misses)]
+
+
+
+def square_chunk(chunk, config, data, filt):
+
+    # Even chunks take longer, so that workers finish their chunks out of order
+    if chunk[0] % 2 == 0:
+        time.sleep(0.05)
+    data['mother_alleles'].hits += 1
+    data['father_alleles'].misses += chunk[0]
+    return [x * x for x in chunk]
+
+
+
+def run_or_crash(options, config, shared):
+
+    # A worker killed while running a trio, as by the OOM killer
+    if options.output == 'crash':
+        os._exit(1)
+    return options.output
+
+
+
+class TestParallel(TestCase):
+
+
+    @patch('main.parallel.helper.connect')
+    def test_imap_chunks(self, mocked_connect):
+
+        options = Values({'processes': 2, 'full_details': False, 'lazy_details': False})
+        data = dict((key, FakeCache()) for key in [
+            'gnomad_exomes_reader', 'gnomad_genomes_reader', 'mother_alleles', 'father_alleles'
+        ])
+
+        # Chunks are only read as far as the window of pending chunks
+        read = []
+        def chunks():
+            for i in range(10):
+                read.append(i)
+                yield [i, i + 100]
+
+        cache_stats = {}
+        results = parallel.imap_chunks(square_chunk, chunks(), options, {}, data, cache_stats)
+        self.assertEquals(next(results), [0, 10000])
+        self.assertEquals(len(read), 4)
+
+        # Results come back in the order of the chunks whichever worker processed them
+        self.assertEquals(list(results), [[i * i, (i + 100) * (i + 100)] for i in range(1, 10)])
+
+        # Cache statistics of the workers are added up
+        self.assertEquals(cache_stats, {
+            'gnomAD exomes lookups': [0, 0],
+            'gnomAD genomes lookups': [0, 0],
+            'Mother BAM lookups': [10, 0],
+            'Father BAM lookups': [0, 45]
+        })
+
+        # The data of the parent process is left untouched
+        self.assertEquals(data['mother_alleles'].hits, 0)
+
+
+    @patch('main.parallel.WORKER_CHECK_INTERVAL', 0.05)
+    @patch('main.parallel.helper.connect_databases')
+    def test_run_trio_worker_lost(self, mocked_connect_databases):
+
+        pool = parallel.trio_pool(2, {}, {})
+        try:
+            self.assertEquals(parallel.run_trio(pool, run_or_crash, Values({'output': 'out1'}), 0), 'out1')
+            with self.assertRaises(parallel.WorkerLostError):
+                parallel.run_trio(pool, run_or_crash, Values({'output': 'crash'}), 1)
+
+            # The dead worker is replaced and the other slots are not affected
+            self.assertEquals(parallel.run_trio(pool, run_or_crash, Values({'output': 'out2'}), 1), 'out2')
+            self.assertEquals(parallel.run_trio(pool, run_or_crash, Values({'output': 'out3'}), 0), 'out3')
+        finally:
+            pool.terminate()
+            pool.join()
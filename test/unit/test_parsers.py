@@ -2,6 +2,8 @@
 
 from unittest import TestCase
 from main import parsers
+import pickle
+import tempfile
 
 
 
@@ -33,7 +35,7 @@ class TestVCFParser(TestCase):
         ]
 
         parsed_record = parsers.parse_vcf_record(vcf_record)
-        self.assertDictEqual(parsed_record, expected)
+        self.assertDictEqual(as_dicts(parsed_record), expected)
 
 
     def test_parse_vcf_record_multiple_alt_single_transcript(self):
@@ -78,7 +80,7 @@ class TestVCFParser(TestCase):
         ]
 
         parsed_record = parsers.parse_vcf_record(vcf_record)
-        self.assertDictEqual(parsed_record, expected)
+        self.assertDictEqual(as_dicts(parsed_record), expected)
 
 
     def test_parse_vcf_record_single_alt_multiple_transcript(self):
@@ -120,7 +122,7 @@ class TestVCFParser(TestCase):
         ]
 
         parsed_record = parsers.parse_vcf_record(vcf_record)
-        self.assertDictEqual(parsed_record, expected)
+        self.assertDictEqual(as_dicts(parsed_record), expected)
 
 
     def test_parse_vcf_record_multiple_alt_multiple_transcript(self):
@@ -192,7 +194,7 @@ class TestVCFParser(TestCase):
         ]
 
         parsed_record = parsers.parse_vcf_record(vcf_record)
-        self.assertDictEqual(parsed_record, expected)
+        self.assertDictEqual(as_dicts(parsed_record), expected)
 
 
     def test_parse_vcf_record_tc_is_zero(self):
@@ -206,6 +208,56 @@ class TestVCFParser(TestCase):
         self.assertIsNone(parsers.parse_vcf_record(vcf_record))
 
 
+    def test_parse_vcf_record_keys(self):
+
+        vcf_record = 'chrX    106184601       .       TGAGAGAGAGAGA   TGAGA,T 2965    PASS    FR=0.5000,0.5000;NF=5,4;' \
+                     'NR=5,2;TC=39;TR=10,6;TYPE=Deletion,Deletion;GENE=MORC4,MORC4;CSN=c.+100_+107del8,c.+96_+107del12'
+
+        self.assertEquals(
+            parsers.parse_vcf_record_keys(vcf_record),
+            [('X', '106184601', 'TGAGAGAGAGAGA', 'TGAGA'), ('X', '106184601', 'TGAGAGAGAGAGA', 'T')]
+        )
+
+        self.assertEquals(parsers.parse_vcf_record_keys(vcf_record.replace('TC=39', 'TC=0')), [])
+
+
+    def test_allele_record(self):
+
+        vcf_record = '11      1642299 .       T       A       200     PASS    NF=14;NR=13;TC=60;TR=27;TYPE=Substitution;' \
+                     'GENE=KRTAP5-4:KRTAP5-5;CSN=c.+338A>T:c.10A>T;CLASS=3PU:MS;ALTANN=.:.;ALTCLASS=.:.'
+
+        variants = parsers.parse_vcf_record(vcf_record)[('11', '1642299', 'T', 'A')]
+
+        self.assertEquals(len(variants), 2)
+        self.assertEquals([v['csn'] for v in variants], ['c.+338A>T', 'c.10A>T'])
+        self.assertEquals((variants[1]['gene'], variants[1]['class_'], variants[1]['TR']), ('KRTAP5-5', 'MS', 27))
+        self.assertEquals(variants[-1]['csn'], 'c.10A>T')
+        self.assertIn('altann', variants[0])
+        with self.assertRaises(KeyError):
+            variants[0]['foo']
+        with self.assertRaises(IndexError):
+            variants[2]
+
+        # Records are sent to and from worker processes
+        for protocol in [0, 2]:
+            copy = pickle.loads(pickle.dumps(variants, protocol))
+            self.assertEquals([v.as_dict() for v in copy], [v.as_dict() for v in variants])
+            copy = pickle.loads(pickle.dumps(variants[1], protocol))
+            self.assertEquals(copy.as_dict(), variants[1].as_dict())
+
+        # Transcripts are split once and not pickled
+        self.assertIs(variants.transcripts, variants.transcripts)
+        self.assertIsNone(pickle.loads(pickle.dumps(variants, 2))._transcripts)
+
+
+    def test_info_fields(self):
+
+        info = 'NF=14;DB;TC=60;TR=27;SC=A=C;TC=61;GENE=KRTAP5-4'
+
+        self.assertEquals(parsers.info_fields(info, frozenset(['TC', 'SC', 'DB'])), {'TC': '61', 'SC': 'A=C'})
+        self.assertEquals(parsers.info_fields(info, frozenset(['CSN'])), {})
+
+
     def _test_read_vcf_file(self):
 
         pass
@@ -236,4 +288,62 @@ class TestExACDatabaseFileParser(TestCase):
 
     def _test_read_exac_data_file(self):
 
-        pass
\ No newline at end of file
+        pass
+
+
+
+class TestTrioManifestParser(TestCase):
+
+
+    def test_read_trio_manifest(self):
+
+        columns = ['output', 'child_var', 'mother_var', 'father_var', 'child_bam', 'mother_bam', 'father_bam']
+        f = tempfile.NamedTemporaryFile(suffix='.tsv')
+        f.write('#' + '\t'.join(columns) + '\n')
+        f.write('\t'.join(['out1', 'c1.vcf', 'm1.vcf', 'f1.vcf', 'c1.bam', 'm1.bam', 'f1.bam']) + '\n')
+        f.write('# Skipped trio\n\n')
+        f.write('\t'.join(['out2', 'c2.vcf.gz', 'm2.vcf', 'f2.vcf', 'c2.bam', 'm2.bam', 'f2.bam']) + '\n')
+        f.flush()
+
+        trios = parsers.read_trio_manifest(f.name)
+
+        self.assertEquals(len(trios), 2)
+        self.assertEquals(trios[0].keys(), parsers.TRIO_MANIFEST_COLUMNS)
+        self.assertEquals((trios[0]['output'], trios[0]['mother_bam']), ('out1', 'm1.bam'))
+        self.assertEquals((trios[1]['output'], trios[1]['child_var']), ('out2', 'c2.vcf.gz'))
+
+        # All columns are required
+        f = tempfile.NamedTemporaryFile(suffix='.tsv')
+        f.write('\t'.join(columns[:-1]) + '\n')
+        f.flush()
+        with self.assertRaises(ValueError):
+            parsers.read_trio_manifest(f.name)
+
+        # Rows with fewer fields than the header are rejected with the missing columns
+        f = tempfile.NamedTemporaryFile(suffix='.tsv')
+        f.write('\t'.join(columns) + '\n')
+        f.write('\t'.join(['out1', 'c1.vcf', 'm1.vcf', 'f1.vcf', 'c1.bam']) + '\n')
+        f.flush()
+        with self.assertRaises(ValueError) as cm:
+            parsers.read_trio_manifest(f.name)
+        self.assertEquals(
+            str(cm.exception), 'Missing values in trio manifest {}, line 2: mother_bam, father_bam'.format(f.name)
+        )
+
+        # So are rows with empty fields
+        f = tempfile.NamedTemporaryFile(suffix='.tsv')
+        f.write('\t'.join(columns) + '\n')
+        f.write('\t'.join(['out1', 'c1.vcf', 'm1.vcf', 'f1.vcf', 'c1.bam', 'm1.bam', 'f1.bam']) + '\n')
+        f.write('\t'.join(['out2', 'c2.vcf', 'm2.vcf', 'f2.vcf', '', ' ', 'f2.bam']) + '\n')
+        f.flush()
+        with self.assertRaises(ValueError) as cm:
+            parsers.read_trio_manifest(f.name)
+        self.assertEquals(
+            str(cm.exception), 'Missing values in trio manifest {}, line 3: child_bam, mother_bam'.format(f.name)
+        )
+
+
+
+def as_dicts(parsed_record):
+
+    return dict((var_key, [variant.as_dict() for variant in variants]) for var_key, variants in parsed_record.iteritems())
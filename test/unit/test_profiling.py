@@ -0,0 +1,56 @@
+"""Unit tests for the profiling module"""
+
+from unittest import TestCase
+from main import profiling
+
+
+
+class TestProfiler(TestCase):
+
+
+    def test_disabled(self):
+
+        profiler = profiling.Profiler()
+
+        with profiler.timer('a'):
+            pass
+        profiler.count('b')
+
+        self.assertEquals(profiler.pop_stats(), {'timers': {}, 'counters': {}})
+
+
+    def test_timer_and_count(self):
+
+        profiler = profiling.Profiler()
+        profiler.enabled = True
+
+        for _ in range(3):
+            with profiler.timer('a'):
+                pass
+        profiler.count('b')
+        profiler.count('b', 5)
+
+        self.assertEquals(profiler.timers['a'][0], 3)
+        self.assertEquals(profiler.counters['b'], 6)
+
+
+    def test_merge_stats(self):
+
+        worker = profiling.Profiler()
+        worker.enabled = True
+        with worker.timer('a'):
+            pass
+        worker.count('b', 2)
+        stats = worker.pop_stats()
+
+        self.assertEquals(len(worker.timers), 0)
+
+        profiler = profiling.Profiler()
+        profiler.enabled = True
+        with profiler.timer('a'):
+            pass
+        profiler.merge_stats(stats)
+        profiler.merge_stats({'timers': {}, 'counters': {'b': 1}})
+
+        self.assertEquals(profiler.timers['a'][0], 2)
+        self.assertEquals(profiler.counters['b'], 3)
@@ -0,0 +1,92 @@
+"""Unit tests for the server module"""
+
+from unittest import TestCase
+from main import parallel, server
+from mock import patch
+from optparse import Values
+import os
+import shutil
+import socket
+import tempfile
+import time
+
+
+
+# A job with all fields of a trio manifest
+JOB = {
+    'child_var': 'c.vcf',
+    'mother_var': 'm.vcf',
+    'father_var': 'f.vcf',
+    'child_bam': 'c.bam',
+    'mother_bam': 'm.bam',
+    'father_bam': 'f.bam',
+    'output': 'out'
+}
+
+
+class TestServer(TestCase):
+
+
+    def test_validate_job(self):
+
+        self.assertIsNone(server.validate_job(JOB))
+        self.assertEquals(server.validate_job([]), 'A job must be a JSON object')
+        self.assertEquals(server.validate_job(dict(JOB, output=None)), 'Fields must be strings')
+        self.assertIn('Missing fields: output', server.validate_job(dict((k, v) for k, v in JOB.items() if k != 'output')))
+        self.assertIn('Unknown fields: foo', server.validate_job(dict(JOB, foo='x')))
+
+
+    @patch('main.server.parallel.run_trio')
+    def test_job_queue(self, mocked_run_trio):
+
+        def run_trio(pool, process_fn, options, slot):
+            if options.output == 'bad':
+                raise IOError('No such file')
+            if options.output == 'crash':
+                raise parallel.WorkerLostError('Worker process 123 died while running the trio')
+            return options.output, 3, 5, {}
+
+        mocked_run_trio.side_effect = run_trio
+        jobs = server.JobQueue(None, None, Values({'processes': 1, 'trios': None}), 1, max_queued=10)
+
+        job_ids = [jobs.submit(dict(JOB, output=output))['id'] for output in ['out1', 'bad', 'crash', 'out2']]
+        for _ in range(100):
+            if jobs.metrics()['jobs_done'] + jobs.metrics()['jobs_failed'] == 4:
+                break
+            time.sleep(0.01)
+
+        self.assertEquals([jobs.status(job_id)['status'] for job_id in job_ids], ['done', 'failed', 'failed', 'done'])
+        self.assertEquals(jobs.status(job_ids[0])['denovo_candidates'], 3)
+        self.assertEquals(jobs.status(job_ids[1])['error'], 'IOError: No such file')
+        self.assertIsNone(jobs.status(99))
+
+        metrics = jobs.metrics()
+        self.assertEquals((metrics['queue_depth'], metrics['running'], metrics['jobs_submitted']), (0, 0, 4))
+        self.assertEquals(metrics['workers_lost'], 1)
+        self.assertEquals(mocked_run_trio.call_args[0][2].output, 'out2')
+
+
+    def test_unix_socket_path(self):
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'denovo.sock')
+            server.check_socket_path(path)
+
+            # A socket left behind by an earlier server is replaced
+            sock = socket.socket(socket.AF_UNIX)
+            sock.bind(path)
+            sock.close()
+            server.check_socket_path(path)
+            httpd = server.UnixHTTPServer(path, server.RequestHandler)
+            httpd.server_close()
+            self.assertFalse(os.path.exists(path))
+
+            # Any other file is kept
+            with open(path, 'w') as f:
+                f.write('data')
+            with self.assertRaises(ValueError):
+                server.UnixHTTPServer(path, server.RequestHandler)
+            self.assertEquals(open(path).read(), 'data')
+        finally:
+            shutil.rmtree(tmpdir)
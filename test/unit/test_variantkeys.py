@@ -0,0 +1,67 @@
+"""Unit tests for the variantkeys module"""
+
+from unittest import TestCase
+from main import variantkeys
+import os
+import shutil
+import tempfile
+
+
+
+VCF = '##fileformat=VCFv4.1\n' \
+      '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n' \
+      '1\t100\t.\tA\tC,G\t200\tPASS\tTC=30;TR=10,5\n' \
+      'chr2\t200\t.\tAT\tA\t200\tPASS\tTC=25;TR=9\n' \
+      '3\t300\t.\tG\tT\t200\tPASS\tTC=0;TR=0\n'
+
+
+
+class TestVariantKeySet(TestCase):
+
+
+    def setUp(self):
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.vcf_fn = os.path.join(self.tmpdir, 'parent.vcf')
+        with open(self.vcf_fn, 'w') as f:
+            f.write(VCF)
+
+
+    def tearDown(self):
+
+        shutil.rmtree(self.tmpdir)
+
+
+    def assert_keys(self, keys):
+
+        self.assertEquals(len(keys), 3)
+        self.assertIn(('1', '100', 'A', 'C'), keys)
+        self.assertIn(('1', '100', 'A', 'G'), keys)
+        self.assertIn(('2', '200', 'AT', 'A'), keys)
+        self.assertNotIn(('1', '100', 'A', 'T'), keys)
+        self.assertNotIn(('3', '300', 'G', 'T'), keys)
+
+
+    def test_load(self):
+
+        self.assert_keys(variantkeys.load(self.vcf_fn))
+
+
+    def test_load_with_cache(self):
+
+        # The cache directory is created if it does not exist
+        cache_dir = os.path.join(self.tmpdir, 'cache', 'keys')
+
+        self.assert_keys(variantkeys.load(self.vcf_fn, cache_dir))
+        cache_fn = os.path.join(cache_dir, '{}.keys'.format(variantkeys.checksum(self.vcf_fn)))
+        self.assertEquals(os.listdir(cache_dir), [os.path.basename(cache_fn)])
+        self.assertEquals(os.path.getsize(cache_fn), len(variantkeys.CACHE_HEADER) + 3 * 8)
+
+        self.assert_keys(variantkeys.load(self.vcf_fn, cache_dir))
+
+        # A cached file of another hash size is not used but written again
+        with open(cache_fn, 'r+b') as f:
+            f.write(variantkeys.CACHE_HEADER.replace(' 8 ', ' 4 '))
+        self.assert_keys(variantkeys.load(self.vcf_fn, cache_dir))
+        with open(cache_fn, 'rb') as f:
+            self.assertEquals(f.readline(), variantkeys.CACHE_HEADER)